@@ -0,0 +1,264 @@
+"""In-memory columnar copies of a site's GSC rows for fast slicing.
+
+A site's ``gsc_metrics`` rows are loaded once into NumPy columns. The
+url/query/country/device strings are dictionary-encoded into the smallest
+integer codes that fit, and dates are stored as day numbers. Filters become
+boolean masks, group-bys become ``bincount`` over the codes and top-N is an
+``argpartition``, so a slice costs a few vectorized passes instead of a
+Postgres aggregation.
+
+Sites are loaded lazily and kept in LRU order within ``ANALYTICS_CACHE_MB``.
+An entry is only used while ``sites.last_scan_at`` still matches the value
+it was loaded under, and imports drop it explicitly. ``ANALYTICS_CACHE_MB=0``
+turns the engine off.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+
+ANALYTICS_CACHE_MB = int(os.getenv("ANALYTICS_CACHE_MB", "512"))
+
+EPOCH = date(1970, 1, 1)
+NO_DATE = np.iinfo(np.int32).min
+
+DIMENSIONS = ("url", "query", "country", "device")
+GROUPS = DIMENSIONS + ("date",)
+SORTS = ("impressions", "clicks")
+
+LOAD_SQL = f"""
+    SELECT url, query, country, device, impressions, clicks,
+           COALESCE(ctr, 0), COALESCE(position, 0),
+           COALESCE(date - DATE '1970-01-01', {NO_DATE})
+    FROM gsc_metrics
+    WHERE site_id = %s
+"""
+
+_frames = OrderedDict()
+_loading = {}
+# site_id -> version of sites whose frame alone exceeds the budget
+_oversized = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "oversized": 0}
+
+
+def _code_dtype(size):
+    for dtype in (np.uint8, np.uint16, np.int32):
+        if size <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class _Builder:
+    """Accumulates encoded chunks for one site."""
+
+    def __init__(self):
+        self.codes = {name: {} for name in DIMENSIONS}
+        self.chunks = []
+
+    def add(self, rows):
+        columns = list(zip(*rows))
+        encoded = []
+        for name, values in zip(DIMENSIONS, columns):
+            codes = self.codes[name]
+            encoded.append(np.fromiter((codes.setdefault(v, len(codes)) for v in values),
+                                       dtype=np.int32, count=len(values)))
+        for values, dtype in zip(columns[4:], (np.int32, np.int32, np.float32, np.float32, np.int32)):
+            encoded.append(np.array(values, dtype=dtype))
+        self.chunks.append(encoded)
+
+    def build(self, site_id, version):
+        names = DIMENSIONS + ("impressions", "clicks", "ctr", "position", "day")
+        columns = {}
+        for i, name in enumerate(names):
+            parts = [chunk[i] for chunk in self.chunks]
+            column = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+            if name in DIMENSIONS:
+                column = column.astype(_code_dtype(len(self.codes[name])))
+            columns[name] = column
+        self.chunks = []
+        return SiteFrame(site_id, version, columns, self.codes)
+
+
+class SiteFrame:
+    """One site's rows as parallel arrays plus the string dictionaries."""
+
+    def __init__(self, site_id, version, columns, lookup):
+        self.site_id = site_id
+        self.version = version
+        self.columns = columns
+        # value -> code, and code -> value
+        self.lookup = lookup
+        self.dictionaries = {name: list(codes) for name, codes in lookup.items()}
+        self.rows = len(columns["impressions"])
+        # Row numbers by descending impressions / clicks, for top-N rows without a sort
+        self.order = {sort: np.argsort(-columns[sort], kind="stable").astype(np.int32) for sort in SORTS}
+        # Each distinct string costs its object plus a list slot and a lookup entry
+        self.nbytes = (sum(c.nbytes for c in columns.values())
+                       + sum(o.nbytes for o in self.order.values())
+                       + sum(len(v or "") + 150 for values in self.dictionaries.values() for v in values))
+
+    def mask(self, device=None, country=None, url=None, query=None, start_date=None, end_date=None):
+        """Boolean row mask for the filters; ``None`` when nothing is filtered."""
+        mask = None
+        for name, value in (("device", device), ("country", country), ("url", url), ("query", query)):
+            if value is None:
+                continue
+            code = self.lookup[name].get(value)
+            selected = (self.columns[name] == code) if code is not None else np.zeros(self.rows, dtype=bool)
+            mask = selected if mask is None else mask & selected
+        if start_date or end_date:
+            day = self.columns["day"]
+            selected = day != NO_DATE
+            if start_date:
+                selected &= day >= (date.fromisoformat(start_date) - EPOCH).days
+            if end_date:
+                selected &= day <= (date.fromisoformat(end_date) - EPOCH).days
+            mask = selected if mask is None else mask & selected
+        return mask
+
+    def _date(self, day):
+        return None if day == NO_DATE else (EPOCH + timedelta(days=int(day))).isoformat()
+
+    def top_rows(self, mask=None, limit=50, sort="impressions"):
+        """The ``limit`` rows with the most impressions (or clicks)."""
+        order = self.order[sort]
+        index = order[:limit] if mask is None else order[mask[order]][:limit]
+        c, d = self.columns, self.dictionaries
+        return [{
+            "url": d["url"][c["url"][i]],
+            "query": d["query"][c["query"][i]],
+            "country": d["country"][c["country"][i]],
+            "device": d["device"][c["device"][i]],
+            "impressions": int(c["impressions"][i]),
+            "clicks": int(c["clicks"][i]),
+            "ctr": float(c["ctr"][i]),
+            "position": float(c["position"][i]),
+            "date": self._date(c["day"][i])
+        } for i in index]
+
+    def group(self, by, mask=None, limit=50, sort="impressions"):
+        """Totals per value of ``by``, the ``limit`` largest by ``sort``."""
+        c = self.columns
+        keys = c["day" if by == "date" else by]
+        if by == "date":
+            dated = keys != NO_DATE
+            mask = dated if mask is None else mask & dated
+        if mask is None:
+            keys, impressions, clicks, ctr, position = (
+                keys, c["impressions"], c["clicks"], c["ctr"], c["position"])
+        else:
+            keys, impressions, clicks, ctr, position = (
+                keys[mask], c["impressions"][mask], c["clicks"][mask], c["ctr"][mask], c["position"][mask])
+        if by == "date":
+            # Day numbers are dense, so offsetting them makes them bincount keys
+            first = int(keys.min()) if len(keys) else 0
+            keys = keys - first
+            size = int(keys.max()) + 1 if len(keys) else 0
+        else:
+            size = len(self.dictionaries[by])
+
+        totals = {
+            "impressions": np.bincount(keys, weights=impressions, minlength=size),
+            "clicks": np.bincount(keys, weights=clicks, minlength=size),
+        }
+        count = np.bincount(keys, minlength=size)
+        present = np.flatnonzero(count)
+        order = totals[sort][present]
+        if len(present) > limit:
+            top = np.argpartition(-order, limit - 1)[:limit]
+            present, order = present[top], order[top]
+        present = present[np.argsort(-order, kind="stable")]
+
+        # Impression-weighted, so grouped ctr/position are exact means
+        weight = impressions.astype(np.float64)
+        ctr_sum = np.bincount(keys, weights=ctr * weight, minlength=size)[present]
+        position_sum = np.bincount(keys, weights=position * weight, minlength=size)[present]
+        shown = totals["impressions"][present]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ctr = np.where(shown > 0, ctr_sum / shown, 0.0)
+            position = np.where(shown > 0, position_sum / shown, 0.0)
+
+        labels = ([self._date(first + k) for k in present] if by == "date"
+                  else [self.dictionaries[by][k] for k in present])
+        return [{
+            by: label,
+            "impressions": int(totals["impressions"][k]),
+            "clicks": int(totals["clicks"][k]),
+            "ctr": float(ctr[i]),
+            "position": float(position[i]),
+            "rows": int(count[k])
+        } for i, (k, label) in enumerate(zip(present, labels))]
+
+
+def enabled():
+    return ANALYTICS_CACHE_MB > 0
+
+
+async def _load(site_id, version):
+    builder = _Builder()
+    async for rows in db.stream(LOAD_SQL, (site_id,)):
+        await asyncio.to_thread(builder.add, rows)
+    return await asyncio.to_thread(builder.build, site_id, version)
+
+
+def _store(frame):
+    budget = ANALYTICS_CACHE_MB * 1024 * 1024
+    if frame.nbytes > budget:
+        _oversized[frame.site_id] = frame.version
+        _stats["oversized"] += 1
+        return
+    _frames[frame.site_id] = frame
+    _frames.move_to_end(frame.site_id)
+    used = sum(f.nbytes for f in _frames.values())
+    while used > budget:
+        _, evicted = _frames.popitem(last=False)
+        used -= evicted.nbytes
+        _stats["evictions"] += 1
+
+
+async def get_frame(site_id):
+    """The site's frame, loading it (once, for concurrent callers) if it is
+    missing or older than the site's last sync. ``None`` when the site is too
+    large for the budget and should be queried in Postgres instead."""
+    row = await db.fetchone("SELECT last_scan_at FROM sites WHERE id = %s", (site_id,))
+    version = row[0] if row else None
+    if site_id in _oversized and _oversized[site_id] == version:
+        return None
+    frame = _frames.get(site_id)
+    if frame is not None and frame.version == version:
+        _frames.move_to_end(site_id)
+        _stats["hits"] += 1
+        return frame
+
+    key = (site_id, version)
+    inflight = _loading.get(key)
+    if inflight is None:
+        _stats["misses"] += 1
+        inflight = _loading[key] = asyncio.ensure_future(_load(site_id, version))
+    try:
+        frame = await asyncio.shield(inflight)
+    finally:
+        if inflight.done():
+            _loading.pop(key, None)
+    _store(frame)
+    return _frames.get(site_id)
+
+
+def invalidate(site_id):
+    _frames.pop(site_id, None)
+    _oversized.pop(site_id, None)
+
+
+def stats():
+    return dict(
+        _stats,
+        enabled=enabled(),
+        sites=len(_frames),
+        rows=sum(f.rows for f in _frames.values()),
+        bytes=sum(f.nbytes for f in _frames.values()),
+        budget_bytes=ANALYTICS_CACHE_MB * 1024 * 1024
+    )
@@ -0,0 +1,219 @@
+"""Compare and benchmark the single-pass extractor against the BeautifulSoup
+implementation it replaced.
+
+    python bench_extractor.py                 # built-in fixtures
+    python bench_extractor.py saved_pages/    # plus every *.html in a directory
+
+Every fixture must produce the same analysis dict as the old
+implementation (``tests/test_extractor.py`` checks the built-in ones);
+timings are reported for the larger pages.
+"""
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+import extractor
+
+
+def reference_analyze_html(url, html):
+    """The previous BeautifulSoup-based analyze_html, kept as the oracle."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    title = soup.find('title')
+    title_text = title.text.strip() if title else ""
+
+    meta_desc = soup.find('meta', {'name': 'description'})
+    meta_desc_text = meta_desc.get('content', '').strip() if meta_desc else ""
+
+    h1s = [h.text.strip() for h in soup.find_all('h1')]
+    h2s = [h.text.strip() for h in soup.find_all('h2')]
+    h3s = [h.text.strip() for h in soup.find_all('h3')]
+
+    text = soup.get_text()
+    words = len(text.split())
+
+    paragraphs = len(soup.find_all('p'))
+
+    images = soup.find_all('img')
+    images_with_alt = len([img for img in images if img.get('alt')])
+
+    links = soup.find_all('a', href=True)
+    internal_links = []
+    external_links = []
+    for link in links:
+        href = link.get('href', '')
+        if href.startswith('http'):
+            if url.split('/')[2] in href:
+                internal_links.append(href)
+            else:
+                external_links.append(href)
+
+    schemas = soup.find_all('script', {'type': 'application/ld+json'})
+    schema_types = []
+    for schema in schemas:
+        try:
+            schema_data = json.loads(schema.string)
+            if '@type' in schema_data:
+                schema_types.append(schema_data['@type'])
+            elif isinstance(schema_data, list):
+                for item in schema_data:
+                    if '@type' in item:
+                        schema_types.append(item['@type'])
+        except:
+            pass
+
+    has_faq = bool(soup.find_all(['div', 'section'],
+                  class_=lambda x: x and 'faq' in x.lower())) or \
+              'FAQPage' in schema_types
+
+    has_breadcrumb = 'BreadcrumbList' in schema_types
+    has_article = 'Article' in schema_types or 'BlogPosting' in schema_types
+    has_review = 'Review' in schema_types or 'AggregateRating' in schema_types
+
+    words_list = text.lower().split()
+    word_freq = {}
+    stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'is', 'are', 'was', 'were'}
+    for word in words_list:
+        if len(word) > 3 and word not in stop_words:
+            word_freq[word] = word_freq.get(word, 0) + 1
+
+    top_keywords = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:20]
+
+    return {
+        "url": url,
+        "title": title_text,
+        "title_length": len(title_text),
+        "meta_desc": meta_desc_text,
+        "meta_desc_length": len(meta_desc_text),
+        "word_count": words,
+        "paragraph_count": paragraphs,
+        "h1_count": len(h1s),
+        "h2_count": len(h2s),
+        "h3_count": len(h3s),
+        "h1s": h1s,
+        "h2s": h2s[:15],
+        "h3s": h3s[:10],
+        "images_total": len(images),
+        "images_with_alt": images_with_alt,
+        "internal_links": len(internal_links),
+        "external_links": len(external_links),
+        "schemas": schema_types,
+        "has_faq": has_faq,
+        "has_breadcrumb": has_breadcrumb,
+        "has_article_schema": has_article,
+        "has_review_schema": has_review,
+        "top_keywords": top_keywords
+    }
+
+
+FIXTURES = {
+    "basic": """<!DOCTYPE html><html><head><title> Best Running Shoes 2024 </title>
+        <meta name="description" content=" Our picks for every runner. ">
+        <script type="application/ld+json">{"@type": "Article", "headline": "x"}</script>
+        <script type="application/ld+json">[{"@type": "BreadcrumbList"}, {"@type": "FAQPage"}]</script>
+        <style>body { color: red }</style></head>
+        <body><h1>Best <em>Running</em> Shoes</h1><p>Running shoes reviewed by runners.</p>
+        <h2>Cushioning</h2><p>Cushioned shoes for long runs.</p><img src="a.png" alt="shoe"><img src="b.png">
+        <a href="https://example.com/guide">guide</a><a href="https://other.org/x">other</a><a href="/rel">rel</a>
+        <div class="Product-FAQ item"><h3>Questions?</h3></div></body></html>""",
+    "unclosed": """<title>Unclosed<h1>heading <b>bold<h2>nested</h1> tail <p>para<p>para2
+        <h3>never closed <a href=https://example.com/a>link</a>""",
+    "void_quirks": """<h1>a<br>b</br>c<br/>d<img alt>e</img>f</h1><h2>x<br/>y<br>z</h2>
+        <meta name=description><meta name="description" content="second">""",
+    "containers": """<title><!-- c -->T<script>var x = "<h1>no</h1>";</script>itle</title>
+        <template><h1>templated</h1><p>tp</p></template><ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby>
+        <h2>A<![CDATA[ cdata ]]>B</h2><?php echo 1 ?><noscript>ns text</noscript>""",
+    "whitespace": """<h1>  a <span>\n\n</span> b </h1><pre>  <b>  </b>  </pre><textarea>
+        </textarea><h2>\t<i> </i>\t</h2><p>one</p>\n\n<p>two</p>""",
+    "entities": """<h1>Fish &amp; Chips &copy &unknown; &#150; &#x41;&#X42; &#129; &#1114112;</h1>
+        <p>caf&eacute; na&iuml;ve &nbsp;space&ampx</p><div class=faqs></div>""",
+    "schemas": """<script type="application/ld+json"></script>
+        <script type="application/ld+json">   </script>
+        <script type="application/ld+json">not json</script>
+        <script type="application/ld+json">"@type"</script>
+        <script type="application/ld+json">["@type", {"@type": "Review"}]</script>
+        <script type="application/ld+json">{"@graph": [{"@type": "Article"}]}</script>
+        <script type="application/ld+json">[{"@type": ["Article", "NewsArticle"]}, 3]</script>
+        <script type="application/ld+json"/><script type='application/ld+json'>{"@type":"AggregateRating"}</script>
+        <script type="text/javascript">{"@type": "Article"}</script>""",
+    "end_tags": """<div><section class="x"><p>a</div>b</p></section><h1>h</h2>still h1</h1>
+        </span></br><a>no href</a><a href="">empty</a><a href="http://">bare</a>""",
+    "duplicate_attrs": """<img alt="x" alt=""><img alt="" alt="y"><meta name="description" name="other" content="no">
+        <div class="faq" class="none"></div><section class="plain" class="help-FAQ"></section>""",
+}
+
+
+def synthetic_page(sections):
+    """A large article-like page: nav, long body copy, tables, inline scripts."""
+    words = ("running shoes cushioning stability trail marathon training pace "
+             "comfort durability outsole midsole weight drop review guide").split()
+    parts = ["<!DOCTYPE html><html><head><title>Synthetic guide</title>",
+             '<meta name="description" content="A synthetic page for benchmarking.">',
+             '<script type="application/ld+json">{"@type": "BlogPosting"}</script>',
+             "<style>" + ".c{margin:0}" * 200 + "</style></head><body>",
+             "<nav>" + "".join(f'<a href="https://example.com/p{i}">Link {i}</a>' for i in range(50)) + "</nav>"]
+    for s in range(sections):
+        body = " ".join(words[(s + i) % len(words)] for i in range(120))
+        parts.append(f"<section><h2>Section {s} {words[s % len(words)]}</h2>")
+        parts.append(f"<p>{body} <strong>{words[s % 7]}</strong> &amp; more.</p>" * 3)
+        parts.append(f'<h3>Detail {s}</h3><img src="/i{s}.png" alt="img {s}">'
+                     f'<a href="https://other{s % 5}.org/x">ref</a>')
+        parts.append("<table><tr>" + "<td>cell</td>" * 10 + "</tr></table>")
+        parts.append(f"<script>window.data{s} = {{\"k\": {s}}};</script></section>")
+    parts.append('<div class="faq-block"><h3>FAQ</h3></div></body></html>')
+    return "".join(parts)
+
+
+def load_fixtures(directory=None):
+    fixtures = dict(FIXTURES)
+    for sections in (50, 500, 3000):
+        fixtures[f"synthetic_{sections}"] = synthetic_page(sections)
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".html"):
+                with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                    fixtures[name] = f.read()
+    return fixtures
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv):
+    url = "https://example.com/page"
+    fixtures = load_fixtures(argv[1] if len(argv) > 1 else None)
+
+    mismatches = 0
+    for name, html in fixtures.items():
+        expected = reference_analyze_html(url, html)
+        actual = extractor.analyze_html(url, html)
+        if expected != actual:
+            mismatches += 1
+            diff = {k: (expected.get(k), actual.get(k)) for k in expected.keys() | actual.keys()
+                    if expected.get(k) != actual.get(k)}
+            print(f"MISMATCH {name}: {diff}")
+    print(f"{len(fixtures) - mismatches}/{len(fixtures)} fixtures identical")
+
+    print(f"\n{'fixture':<24}{'size':>10}{'bs4 ms':>10}{'single-pass ms':>16}{'speedup':>9}")
+    for name, html in fixtures.items():
+        if len(html) < 50_000:
+            continue
+        repeat = 3 if len(html) > 1_000_000 else 10
+        old = best_of(lambda: reference_analyze_html(url, html), repeat)
+        new = best_of(lambda: extractor.analyze_html(url, html), repeat)
+        print(f"{name:<24}{len(html.encode()) // 1024:>8}KB{old * 1000:>10.1f}{new * 1000:>16.1f}{old / new:>8.1f}x")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
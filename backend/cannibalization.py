@@ -0,0 +1,186 @@
+"""Keyword cannibalization: queries for which several of a site's URLs compete.
+
+A run is one set-based pass in Postgres over the weekly
+``gsc_rollup_url_query`` rows of the site's last ``CANNIBALIZATION_WEEKS``
+weeks. Per (query, url) it sums impressions and clicks and derives:
+- the url's share of the query's impressions;
+- its impression-weighted average position;
+- its position volatility, the weighted standard deviation of its weekly
+  average positions. A url bouncing between page one and page three has a
+  high volatility.
+A query is a conflict when at least two urls each hold
+``CANNIBALIZATION_MIN_SHARE`` of its impressions. The url with the most
+clicks is the primary. The conflict's click loss is what the other urls'
+impressions would have earned at the primary's CTR, less the clicks they
+actually got.
+
+Runs are incremental. Every GSC merge records the queries it changed in
+``gsc_query_changes`` (see ``rollups``), and a run recomputes only those
+queries and consumes the records. When a new week has moved the window
+since the last run, the queries with rows in the weeks that left it are
+recomputed too, so every conflict is measured over the current window.
+The first run, or one with ``full``, recomputes every query.
+"""
+import time
+from datetime import timedelta
+
+import db
+import rollups
+
+CANNIBALIZATION_WEEKS = 13
+CANNIBALIZATION_MIN_SHARE = 0.1
+CANNIBALIZATION_MIN_IMPRESSIONS = 10
+CANNIBALIZATION_LOCK_ID = 72_410_025
+
+# Queries an incremental run recomputes, moved out of gsc_query_changes
+QUERIES_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS cannibalization_queries (
+        query TEXT PRIMARY KEY
+    ) ON COMMIT DROP
+"""
+
+# share and position are per url; a conflict's click loss is summed over its
+# non-primary urls. position_sq is the weighted mean of squared weekly positions.
+CONFLICTS_SQL = """
+    INSERT INTO cannibalization (site_id, query, urls, impressions, clicks, click_loss,
+                                 primary_url, competitors, computed_at)
+    WITH pairs AS (
+        SELECT r.query, r.url, SUM(r.impressions) AS impressions, SUM(r.clicks) AS clicks,
+               SUM(r.position_weighted) / SUM(r.impressions) AS position,
+               SUM(r.position_weighted * r.position_weighted / r.impressions)
+                   / SUM(r.impressions) AS position_sq
+        FROM gsc_rollup_url_query r
+        {join}
+        WHERE r.site_id = %(site_id)s AND r.grain = 'week'
+          AND r.period_start >= %(window_start)s AND r.impressions > 0
+        GROUP BY r.query, r.url
+    ), shares AS (
+        SELECT p.*, p.impressions::float / SUM(p.impressions) OVER w AS share,
+               SUM(p.impressions) OVER w AS query_impressions,
+               SUM(p.clicks) OVER w AS query_clicks
+        FROM pairs p
+        WINDOW w AS (PARTITION BY p.query)
+    ), competing AS (
+        SELECT s.*,
+               ROW_NUMBER() OVER w AS rank,
+               FIRST_VALUE(s.clicks::float / s.impressions) OVER w AS primary_ctr
+        FROM shares s
+        WHERE s.share >= %(min_share)s AND s.query_impressions >= %(min_impressions)s
+        WINDOW w AS (PARTITION BY s.query ORDER BY s.clicks DESC, s.impressions DESC, s.url)
+    )
+    SELECT %(site_id)s, query, COUNT(*), MAX(query_impressions), MAX(query_clicks),
+           SUM(GREATEST(impressions * primary_ctr - clicks, 0)) FILTER (WHERE rank > 1),
+           MIN(url) FILTER (WHERE rank = 1),
+           jsonb_agg(jsonb_build_object(
+               'url', url,
+               'impressions', impressions,
+               'clicks', clicks,
+               'share', round(share::numeric, 4),
+               'position', round(position::numeric, 1),
+               'volatility', round(sqrt(GREATEST(position_sq - position * position, 0))::numeric, 2)
+           ) ORDER BY rank),
+           NOW()
+    FROM competing
+    GROUP BY query
+    HAVING COUNT(*) >= 2
+"""
+
+
+def _window_start(cur, site_id):
+    cur.execute("""
+        SELECT MAX(period_start) FROM gsc_rollup_site
+        WHERE site_id = %s AND grain = 'week'
+    """, (site_id,))
+    latest = cur.fetchone()[0]
+    return latest - timedelta(weeks=CANNIBALIZATION_WEEKS - 1) if latest else None
+
+
+def refresh(cur, site_id, full=False):
+    """Recompute the site's conflicts for changed queries (or all of them).
+    Returns the run summary, or ``None`` when the site has no GSC data."""
+    started = time.perf_counter()
+    cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (CANNIBALIZATION_LOCK_ID, site_id))
+    window_start = _window_start(cur, site_id)
+    if window_start is None:
+        return None
+    cur.execute("SELECT window_start FROM cannibalization_runs WHERE site_id = %s", (site_id,))
+    row = cur.fetchone()
+    full = full or row is None
+    params = {
+        "site_id": site_id,
+        "window_start": window_start,
+        "min_share": CANNIBALIZATION_MIN_SHARE,
+        "min_impressions": CANNIBALIZATION_MIN_IMPRESSIONS,
+    }
+
+    # Changes recorded after this point stay queued for the next run
+    if full:
+        cur.execute("DELETE FROM gsc_query_changes WHERE site_id = %s", (site_id,))
+        changed = None
+        cur.execute("DELETE FROM cannibalization WHERE site_id = %s", (site_id,))
+        cur.execute(CONFLICTS_SQL.format(join=""), params)
+    else:
+        cur.execute(QUERIES_SQL)
+        cur.execute("""
+            WITH changed AS (
+                DELETE FROM gsc_query_changes WHERE site_id = %s RETURNING query
+            )
+            INSERT INTO cannibalization_queries SELECT DISTINCT query FROM changed
+        """, (site_id,))
+        changed = cur.rowcount
+        if row[0] != window_start:
+            # Weeks that left (or re-entered) the window change these queries' totals
+            cur.execute("""
+                INSERT INTO cannibalization_queries
+                SELECT DISTINCT query FROM gsc_rollup_url_query
+                WHERE site_id = %s AND grain = 'week' AND period_start >= %s AND period_start < %s
+                ON CONFLICT DO NOTHING
+            """, (site_id, min(row[0], window_start), max(row[0], window_start)))
+            changed += cur.rowcount
+        # Row counts steer the planner to index lookups for a small batch
+        cur.execute("ANALYZE cannibalization_queries")
+        cur.execute("""
+            DELETE FROM cannibalization c USING cannibalization_queries q
+            WHERE c.site_id = %s AND c.query = q.query
+        """, (site_id,))
+        cur.execute(CONFLICTS_SQL.format(join="JOIN cannibalization_queries q ON q.query = r.query"), params)
+    updated = cur.rowcount
+
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(SUM(click_loss), 0) FROM cannibalization WHERE site_id = %s
+    """, (site_id,))
+    conflicts, click_loss = cur.fetchone()
+    summary = {
+        "mode": "full" if full else "incremental",
+        "window_start": window_start,
+        "queries_changed": changed,
+        "conflicts_updated": updated,
+        "conflicts": conflicts,
+        "click_loss": round(click_loss, 1),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    cur.execute("""
+        INSERT INTO cannibalization_runs (site_id, mode, window_start, queries_changed,
+                                          conflicts, click_loss, seconds, computed_at)
+        VALUES (%(site_id)s, %(mode)s, %(window_start)s, %(queries_changed)s,
+                %(conflicts)s, %(click_loss)s, %(seconds)s, NOW())
+        ON CONFLICT (site_id) DO UPDATE SET
+            mode = EXCLUDED.mode, window_start = EXCLUDED.window_start,
+            queries_changed = EXCLUDED.queries_changed, conflicts = EXCLUDED.conflicts,
+            click_loss = EXCLUDED.click_loss, seconds = EXCLUDED.seconds, computed_at = NOW()
+    """, dict(summary, site_id=site_id))
+    return summary
+
+
+def delete_site(cur, site_id):
+    cur.execute("DELETE FROM cannibalization WHERE site_id = %s", (site_id,))
+    cur.execute("DELETE FROM cannibalization_runs WHERE site_id = %s", (site_id,))
+
+
+async def analyze_site(site_id, full=False):
+    """Bring the site's conflicts up to date with its GSC data."""
+    await rollups.ensure_site(site_id)
+    summary = await db.run(refresh, site_id, full)
+    if summary is None:
+        return {"error": "No GSC data for this site yet"}
+    return dict(summary, window_start=summary["window_start"].isoformat())
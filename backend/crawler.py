@@ -0,0 +1,544 @@
+"""Polite breadth-first crawler for a site's own pages.
+
+A crawl starts from the homepage and the site's sitemap inventory
+(``site_urls``) and follows links that stay on the site's host (and its
+``www.`` twin). The frontier lives in ``crawl_frontier``: URLs are claimed
+from it in batches, lowest link depth first, and marked done when their
+results are written, so a crawl interrupted by a restart resumes where it
+stopped. Sitemap URLs that no link reaches have no depth and are fetched
+once the link frontier is exhausted; ``max_depth`` limits how far links are
+followed, not which sitemap URLs are fetched.
+
+Before a URL goes to the database it is checked against a Bloom filter of
+every URL already discovered, which keeps the navigation links repeated on
+every page out of the frontier writes with a few MB of memory however large
+the site is. A false positive (about ``CRAWL_BLOOM_ERROR`` once
+``CRAWL_BLOOM_CAPACITY`` URLs are in) means a link-only URL is not crawled;
+URLs listed in a sitemap are seeded without it and are always fetched.
+
+Each host's robots.txt is honoured, including ``Crawl-delay``, and at most
+``CRAWL_PER_HOST`` requests are in flight per host. Redirects are followed
+by hand so every hop is recorded. Page results are written to
+``crawl_pages`` with a MinHash signature of their text (see ``duplicates``), and each
+page's followed internal links to the link graph (see ``linkgraph``), with
+one ``COPY`` per ``CRAWL_BATCH_ROWS`` pages.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+import db
+import extractor
+import http_client
+import ingest
+import linkgraph
+import parse_pool
+
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "16"))
+CRAWL_PER_HOST = int(os.getenv("CRAWL_PER_HOST", "4"))
+# Minimum seconds between requests to a host; robots.txt may ask for more
+CRAWL_DELAY = float(os.getenv("CRAWL_DELAY", "0"))
+CRAWL_MAX_DELAY = float(os.getenv("CRAWL_MAX_DELAY", "30"))
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "100000"))
+# Links are not followed past this many hops from the start URL; 0 means no limit
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "0"))
+CRAWL_MAX_PAGE_BYTES = int(os.getenv("CRAWL_MAX_PAGE_BYTES", str(3 * 1024 * 1024)))
+CRAWL_BATCH_ROWS = int(os.getenv("CRAWL_BATCH_ROWS", "200"))
+CRAWL_BLOOM_CAPACITY = int(os.getenv("CRAWL_BLOOM_CAPACITY", "2000000"))
+CRAWL_BLOOM_ERROR = float(os.getenv("CRAWL_BLOOM_ERROR", "0.001"))
+# A running crawl whose heartbeat is older than this is taken to be dead and may be resumed
+CRAWL_STALE_SECONDS = int(os.getenv("CRAWL_STALE_SECONDS", "120"))
+CRAWL_USER_AGENT = os.getenv("CRAWL_USER_AGENT", "SEOEngineBot/1.0")
+CRAWL_MAX_REDIRECTS = 5
+CRAWL_TIMEOUT = 15.0
+# Pending results are written at least this often, so new links reach the frontier
+CRAWL_FLUSH_SECONDS = 2.0
+
+CRAWL_LOCK_ID = 72_410_022
+
+# crawl_frontier.state
+QUEUED, CLAIMED, DONE = 0, 1, 2
+
+PAGE_COLUMNS = ["url", "depth", "status_code", "final_url", "redirects", "canonical",
+                "meta_robots", "title", "meta_desc", "h1", "h1_count", "word_count",
+                "internal_links", "external_links", "content_type", "bytes", "response_ms", "error", "minhash"]
+
+PAGES_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS crawl_pages_staging (
+        url TEXT, depth INTEGER, status_code INTEGER, final_url TEXT, redirects JSONB,
+        canonical TEXT, meta_robots TEXT, title TEXT, meta_desc TEXT, h1 TEXT,
+        h1_count INTEGER, word_count INTEGER, internal_links INTEGER, external_links INTEGER,
+        content_type TEXT, bytes INTEGER, response_ms INTEGER, error TEXT, minhash BYTEA
+    ) ON COMMIT DROP
+"""
+
+FRONTIER_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS crawl_frontier_staging (
+        url TEXT, depth INTEGER, state SMALLINT
+    ) ON COMMIT DROP
+"""
+
+
+class CrawlError(Exception):
+    pass
+
+
+class BloomFilter:
+    """Fixed-size probabilistic set of strings: no false negatives, false
+    positives at about ``error`` once ``capacity`` items have been added."""
+
+    def __init__(self, capacity, error):
+        self.size = max(64, int(-capacity * math.log(error) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item):
+        """Add ``item``; returns False if it was (probably) already present."""
+        added = False
+        for p in self._positions(item):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                added = True
+        self.count += added
+        return added
+
+
+class _Host:
+    """robots.txt rules and request pacing for one host."""
+
+    def __init__(self, robots, delay):
+        self.robots = robots
+        self.delay = delay
+        self.slots = asyncio.Semaphore(CRAWL_PER_HOST)
+        self._lock = asyncio.Lock()
+        self._next_at = 0.0
+
+    def allowed(self, url):
+        return self.robots.can_fetch(CRAWL_USER_AGENT, url)
+
+    async def wait_turn(self):
+        if not self.delay:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_at > now:
+                await asyncio.sleep(self._next_at - now)
+            self._next_at = max(now, self._next_at) + self.delay
+
+
+def _robots_lines(text):
+    # robotparser ignores fractional Crawl-delay values; round them up instead
+    for line in text.splitlines():
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "crawl-delay":
+            try:
+                line = f"Crawl-delay: {math.ceil(float(value.split('#', 1)[0]))}"
+            except ValueError:
+                pass
+        yield line
+
+
+async def fetch_robots(client, origin):
+    """robots.txt rules for ``origin``. A missing file (4xx) allows
+    everything; an unreachable one (5xx, network error) allows nothing."""
+    robots = RobotFileParser()
+    try:
+        response = await client.get(f"{origin}/robots.txt", follow_redirects=True,
+                                    headers={"User-Agent": CRAWL_USER_AGENT}, timeout=CRAWL_TIMEOUT)
+    except httpx.HTTPError:
+        robots.disallow_all = True
+        return robots
+    if response.status_code >= 500:
+        robots.disallow_all = True
+    elif response.status_code == 200:
+        robots.parse(_robots_lines(response.text))
+    else:
+        robots.parse([])
+    return robots
+
+
+def site_hosts(start_url):
+    """Hosts (``host[:port]``) that count as the site: the start URL's and its www twin."""
+    netloc = urlsplit(start_url).netloc.lower()
+    twin = netloc[4:] if netloc.startswith("www.") else f"www.{netloc}"
+    return {netloc, twin}
+
+
+# -- database ---------------------------------------------------------------
+
+def begin(cur, site_id, start_url, max_pages):
+    """Resume the site's unfinished crawl or start a new one.
+
+    Returns ``(crawl_id, pages already crawled, resumed)``."""
+    cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (CRAWL_LOCK_ID, site_id))
+    cur.execute("""
+        SELECT id, pages, status, updated_at > NOW() - make_interval(secs => %s)
+        FROM crawls
+        WHERE site_id = %s AND status IN ('running', 'paused')
+        ORDER BY id DESC
+        LIMIT 1
+    """, (CRAWL_STALE_SECONDS, site_id))
+    row = cur.fetchone()
+    if row:
+        crawl_id, pages, status, alive = row
+        if status == "running" and alive:
+            raise CrawlError(f"crawl {crawl_id} is already running for this site")
+        cur.execute("""
+            UPDATE crawls SET status = 'running', max_pages = %s, updated_at = NOW()
+            WHERE id = %s
+        """, (max_pages, crawl_id))
+        # Whatever was claimed when it stopped was never written
+        cur.execute("UPDATE crawl_frontier SET state = %s WHERE crawl_id = %s AND state = %s",
+                    (QUEUED, crawl_id, CLAIMED))
+        return crawl_id, pages, True
+
+    cur.execute("""
+        INSERT INTO crawls (site_id, start_url, max_pages) VALUES (%s, %s, %s) RETURNING id
+    """, (site_id, start_url, max_pages))
+    crawl_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO crawl_frontier (crawl_id, url, depth) VALUES (%s, %s, 0)",
+                (crawl_id, start_url))
+    cur.execute("""
+        INSERT INTO crawl_frontier (crawl_id, url)
+        SELECT %s, url FROM site_urls
+        WHERE site_id = %s AND lower(split_part(url, '/', 3)) = ANY(%s)
+        ON CONFLICT DO NOTHING
+    """, (crawl_id, site_id, list(site_hosts(start_url))))
+    cur.execute("UPDATE crawls SET discovered = 1 + %s WHERE id = %s", (cur.rowcount, crawl_id))
+    return crawl_id, 0, False
+
+
+# URLs reached by a link (or already fetched); sitemap-only URLs stay out of the filter
+SEEN_SQL = """
+    SELECT url FROM crawl_frontier
+    WHERE crawl_id = %s AND (depth IS NOT NULL OR state <> 0)
+"""
+
+
+def claim(cur, crawl_id, limit, unlinked=False):
+    """Claim up to ``limit`` queued URLs, shallowest first; with ``unlinked``,
+    the sitemap URLs no link has reached. Returns ``(url, depth)`` rows."""
+    # MATERIALIZED: inlined into the join, the LIMIT can be applied per rescan
+    cur.execute(f"""
+        WITH next AS MATERIALIZED (
+            SELECT url FROM crawl_frontier
+            WHERE crawl_id = %s AND state = %s AND depth IS {'' if unlinked else 'NOT '}NULL
+            ORDER BY depth, seq
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE crawl_frontier f SET state = %s
+        FROM next
+        WHERE f.crawl_id = %s AND f.url = next.url
+        RETURNING f.url, f.depth, f.seq
+    """, (crawl_id, QUEUED, limit, CLAIMED, crawl_id))
+    rows = sorted(cur.fetchall(), key=lambda r: (r[1] or 0, r[2]))
+    return [(url, depth) for url, depth, _ in rows]
+
+
+def store(cur, crawl_id, site_id, pages, discovered, elapsed):
+    """Write one batch of page results and newly found URLs. Returns the
+    number of URLs that were new to the frontier."""
+    cur.execute(PAGES_STAGING_SQL)
+    ingest.copy_records(cur, "crawl_pages_staging", PAGE_COLUMNS,
+                        (tuple(page[c] for c in PAGE_COLUMNS) for page in pages))
+    cols = ", ".join(PAGE_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in PAGE_COLUMNS if c != "url")
+    cur.execute(f"""
+        INSERT INTO crawl_pages (site_id, crawl_id, {cols})
+        SELECT DISTINCT ON (url) %s, %s, {cols} FROM crawl_pages_staging
+        ON CONFLICT (site_id, url) DO UPDATE SET
+            crawl_id = EXCLUDED.crawl_id, {updates}, fetched_at = NOW()
+    """, (site_id, crawl_id))
+    cur.execute("TRUNCATE crawl_pages_staging")
+    linkgraph.store_edges(cur, site_id, crawl_id, [(page["url"], page["links"]) for page in pages])
+
+    cur.execute("UPDATE crawl_frontier SET state = %s WHERE crawl_id = %s AND url = ANY(%s)",
+                (DONE, crawl_id, [page["url"] for page in pages if not page.get("extra")]))
+    # Pages reached through a redirect were fetched on the way and go in as done
+    extras = [(page["url"], page["depth"], DONE) for page in pages if page.get("extra")]
+    cur.execute(FRONTIER_STAGING_SQL)
+    ingest.copy_records(cur, "crawl_frontier_staging", ["url", "depth", "state"],
+                        extras + [(url, depth, QUEUED) for url, depth in discovered])
+    # A queued sitemap URL takes the depth of the first link to it
+    cur.execute("""
+        WITH merged AS (
+            INSERT INTO crawl_frontier AS f (crawl_id, url, depth, state)
+            SELECT DISTINCT ON (url) %s, url, depth, state FROM crawl_frontier_staging
+            ORDER BY url, state DESC
+            ON CONFLICT (crawl_id, url) DO UPDATE SET
+                depth = COALESCE(f.depth, EXCLUDED.depth),
+                state = GREATEST(f.state, EXCLUDED.state)
+            WHERE f.state = %s AND (f.depth IS NULL OR EXCLUDED.state = %s)
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted) FROM merged
+    """, (crawl_id, QUEUED, DONE))
+    new = cur.fetchone()[0]
+    cur.execute("TRUNCATE crawl_frontier_staging")
+
+    errors = sum(1 for page in pages if page["error"] or (page["status_code"] or 0) >= 400)
+    cur.execute("""
+        UPDATE crawls SET pages = pages + %s, errors = errors + %s, discovered = discovered + %s,
+                          seconds = seconds + %s, updated_at = NOW()
+        WHERE id = %s
+    """, (len(pages), errors, new, elapsed, crawl_id))
+    return new
+
+
+def finish(cur, crawl_id, status):
+    cur.execute("""
+        UPDATE crawls SET status = %s, updated_at = NOW(),
+                          finished_at = CASE WHEN %s = 'finished' THEN NOW() END
+        WHERE id = %s
+        RETURNING pages, errors, discovered, seconds
+    """, (status, status, crawl_id))
+    row = cur.fetchone()
+    if status == "finished":
+        cur.execute("DELETE FROM crawl_frontier WHERE crawl_id = %s", (crawl_id,))
+    return row
+
+
+def delete_site(cur, site_id):
+    cur.execute("DELETE FROM crawl_frontier WHERE crawl_id IN (SELECT id FROM crawls WHERE site_id = %s)",
+                (site_id,))
+    cur.execute("DELETE FROM crawl_pages WHERE site_id = %s", (site_id,))
+    cur.execute("DELETE FROM crawls WHERE site_id = %s", (site_id,))
+
+
+# -- crawling ---------------------------------------------------------------
+
+def _page(url, depth, links=(), **fields):
+    page = dict.fromkeys(PAGE_COLUMNS)
+    page.update(url=url, depth=depth, links=links, **fields)
+    return page
+
+
+class Crawl:
+    """One run of a crawl: claims URLs from the frontier, fetches them with
+    ``CRAWL_CONCURRENCY`` workers and writes the results back in batches."""
+
+    def __init__(self, crawl_id, site_id, start_url, client, max_pages, pages=0, progress=None, max_depth=None):
+        self.crawl_id = crawl_id
+        self.site_id = site_id
+        self.client = client
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.progress = progress
+        self.hosts = site_hosts(start_url)
+        self.seen = BloomFilter(CRAWL_BLOOM_CAPACITY, CRAWL_BLOOM_ERROR)
+        self.seen.add(start_url)
+
+        self.queue = asyncio.Queue()
+        self.active = 0           # claimed URLs not yet fetched (queued or in flight)
+        self.results = []         # fetched pages waiting to be written
+        self._done = asyncio.Event()
+        self._host_state = {}
+
+        self.pages = pages
+        self.run_pages = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self._flushed_at = self.started
+
+    def in_scope(self, url):
+        return urlsplit(url).netloc in self.hosts
+
+    async def _host(self, url):
+        parts = urlsplit(url)
+        host = self._host_state.get(parts.netloc)
+        if host is None:
+            # Concurrent first requests to a host share one robots.txt fetch
+            host = self._host_state[parts.netloc] = asyncio.ensure_future(
+                self._load_host(f"{parts.scheme}://{parts.netloc}"))
+        return await host
+
+    async def _load_host(self, origin):
+        robots = await fetch_robots(self.client, origin)
+        delay = min(float(robots.crawl_delay(CRAWL_USER_AGENT) or 0), CRAWL_MAX_DELAY)
+        return _Host(robots, max(delay, CRAWL_DELAY))
+
+    async def load_seen(self):
+        """Refill the Bloom filter from the frontier of a resumed crawl."""
+        async for rows in db.stream(SEEN_SQL, (self.crawl_id,)):
+            for (url,) in rows:
+                self.seen.add(url)
+
+    async def fetch(self, url, depth):
+        """Fetch one URL. Returns the page records to store: two when an
+        in-scope redirect lands on a URL not crawled yet. Each record's
+        ``links`` are the followed internal links (a redirect links to its
+        target)."""
+        started = time.perf_counter()
+        chain = []
+        current = url
+        while True:
+            host = await self._host(current)
+            if not host.allowed(current):
+                if not chain:
+                    return [_page(url, depth, error="blocked by robots.txt")]
+                return [_page(url, depth, status_code=chain[0]["status"], redirects=json.dumps(chain),
+                              final_url=current, error="redirect target blocked by robots.txt")]
+            async with host.slots:
+                await host.wait_turn()
+                async with self.client.stream("GET", current, follow_redirects=False, timeout=CRAWL_TIMEOUT,
+                                              headers={"User-Agent": CRAWL_USER_AGENT}) as response:
+                    status = response.status_code
+                    location = response.headers.get("location")
+                    if response.is_redirect and location:
+                        chain.append({"url": current, "status": status})
+                        target = extractor.absolute_url(current, location)
+                        if (len(chain) <= CRAWL_MAX_REDIRECTS and target and self.in_scope(target)
+                                and all(hop["url"] != target for hop in chain)):
+                            current = target
+                            continue
+                        error = None
+                        if len(chain) > CRAWL_MAX_REDIRECTS or any(hop["url"] == target for hop in chain):
+                            error = "too many redirects"
+                        return [_page(url, depth, status_code=chain[0]["status"], redirects=json.dumps(chain),
+                                      final_url=target, error=error)]
+                    content_type = response.headers.get("content-type")
+                    # The landing page of a redirect is stored under its own URL, once
+                    landing = bool(chain) and self.seen.add(current)
+                    body = None
+                    if status == 200 and http_client.is_html(content_type) and (landing or not chain):
+                        body = await http_client.read_html(response, CRAWL_MAX_PAGE_BYTES)
+                    encoding = response.encoding
+            break
+
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        fields = {"status_code": status, "content_type": content_type, "response_ms": elapsed_ms}
+        links = []
+        if body is not None:
+            parsed = await parse_pool.crawl(current, body, encoding)
+            found = parsed.pop("links")
+            internal = [link for link in found if self.in_scope(link)]
+            fields.update(parsed, bytes=len(body), internal_links=len(internal),
+                          external_links=len(found) - len(internal))
+            if "nofollow" not in (parsed["meta_robots"] or ""):
+                links = internal
+
+        if not chain:
+            return [_page(url, depth, links=links, **fields)]
+        chain.append({"url": current, "status": status})
+        pages = [_page(url, depth, status_code=chain[0]["status"], redirects=json.dumps(chain),
+                       final_url=current, response_ms=elapsed_ms, links=[current])]
+        if landing:
+            pages.append(_page(current, depth, extra=True, links=links, **fields))
+        return pages
+
+    async def _worker(self):
+        while True:
+            url, depth = await self.queue.get()
+            try:
+                pages = await self.fetch(url, depth)
+            except Exception as e:
+                pages = [_page(url, depth, error=str(e) or type(e).__name__)]
+            self.results.append(pages)
+            self.active -= 1
+            self._done.set()
+
+    def _follows(self, page):
+        return not self.max_depth or page["depth"] is None or page["depth"] < self.max_depth
+
+    async def _flush(self):
+        results, self.results = self.results, []
+        pages = [page for batch in results for page in batch]
+        # Links past the depth limit stay out of the filter too, in case a shallower page links them later
+        discovered = [(link, None if page["depth"] is None else page["depth"] + 1)
+                      for page in pages if self._follows(page) for link in page["links"] if self.seen.add(link)]
+        now = time.perf_counter()
+        await db.run(store, self.crawl_id, self.site_id, pages, discovered, now - self._flushed_at)
+        self._flushed_at = now
+        self.pages += len(pages)
+        self.run_pages += len(pages)
+        self.errors += sum(1 for page in pages if page["error"] or (page["status_code"] or 0) >= 400)
+        if self.progress:
+            await self.progress(**self.as_dict())
+
+    async def run(self):
+        workers = [asyncio.create_task(self._worker()) for _ in range(max(1, CRAWL_CONCURRENCY))]
+        try:
+            while True:
+                room = self.max_pages - self.pages - len(self.results) - self.active
+                starved = False
+                if room > 0 and self.queue.qsize() < CRAWL_CONCURRENCY:
+                    limit = min(room, CRAWL_CONCURRENCY * 4)
+                    rows = await db.run(claim, self.crawl_id, limit)
+                    if not rows and not self.active and not self.results:
+                        # Nothing left to reach by links: fetch what only the sitemaps list
+                        rows = await db.run(claim, self.crawl_id, limit, True)
+                    for row in rows:
+                        self.queue.put_nowait(row)
+                    self.active += len(rows)
+                    starved = not rows
+                pending = sum(len(pages) for pages in self.results)
+                if self.results and (pending >= CRAWL_BATCH_ROWS or starved
+                                     or time.perf_counter() - self._flushed_at >= CRAWL_FLUSH_SECONDS):
+                    await self._flush()
+                    continue
+                if not self.active and not self.results and (starved or room <= 0):
+                    break
+                self._done.clear()
+                # Not wait_for: on 3.11 it can swallow a cancellation that races the wakeup
+                waiter = asyncio.ensure_future(self._done.wait())
+                try:
+                    await asyncio.wait((waiter,), timeout=CRAWL_FLUSH_SECONDS)
+                finally:
+                    waiter.cancel()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return room > 0
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "crawl_id": self.crawl_id,
+            "pages_crawled": self.pages,
+            "pages_this_run": self.run_pages,
+            "errors": self.errors,
+            "urls_seen": self.seen.count,
+            "pages_per_sec": round(self.run_pages / elapsed, 1) if elapsed else 0.0
+        }
+
+
+async def crawl_site(site_id, start_url, client, max_pages=None, progress=None, max_depth=None):
+    """Crawl the site from ``start_url``, resuming its unfinished crawl if
+    there is one. Returns the run's stats."""
+    start_url = extractor.absolute_url(start_url, start_url)
+    if not start_url:
+        raise CrawlError("start URL must be an http(s) URL")
+    max_pages = max_pages or CRAWL_MAX_PAGES
+    max_depth = CRAWL_MAX_DEPTH if max_depth is None else max_depth
+    crawl_id, pages, resumed = await db.run(begin, site_id, start_url, max_pages)
+    crawl = Crawl(crawl_id, site_id, start_url, client, max_pages, pages, progress, max_depth)
+    if resumed:
+        await crawl.load_seen()
+    try:
+        exhausted = await crawl.run()
+    except Exception:
+        await db.run(finish, crawl_id, "paused")
+        raise
+    await db.run(finish, crawl_id, "finished")
+    return dict(crawl.as_dict(), resumed=resumed, reached_max_pages=not exhausted)
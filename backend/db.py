@@ -0,0 +1,189 @@
+"""Shared Postgres connection pool.
+
+psycopg2 is a blocking driver, so every query is run on a bounded thread pool
+instead of directly inside the async route handlers. The executor has one
+thread per ``DB_POOL_MAX`` connection, and the pool holds ``DB_STREAM_MAX``
+more for streams, which keep a connection between fetches; a stream waits
+for one of those slots before it takes a connection. So a worker thread
+never waits on the pool and the event loop never waits on Postgres.
+"""
+import asyncio
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from psycopg2.pool import ThreadedConnectionPool
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_STREAM_MAX = int(os.getenv("DB_STREAM_MAX", "4"))
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "10000"))
+
+_pool = None
+_executor = None
+_stream_slots = None
+
+
+def init_pool(dsn):
+    """Open the pool. Called once from the app startup hook."""
+    global _pool, _executor, _stream_slots
+    if _pool is not None or not dsn:
+        return
+    _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX + DB_STREAM_MAX, dsn)
+    _executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+    _stream_slots = asyncio.Semaphore(DB_STREAM_MAX)
+    print(f"Database pool ready ({DB_POOL_MIN}-{DB_POOL_MAX} connections, {DB_STREAM_MAX} for streams)")
+
+
+def close_pool():
+    global _pool, _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; commit on success, roll back on error."""
+    if _pool is None:
+        raise RuntimeError("Database pool is not initialised")
+    conn = _pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # Connections broken mid-query are discarded instead of recycled.
+        _pool.putconn(conn, close=bool(conn.closed))
+
+
+def _call(fn, args):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            return fn(cur, *args)
+
+
+async def run(fn, *args):
+    """Run ``fn(cur, *args)`` in one transaction off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _call, fn, args)
+
+
+def _call_autocommit(fn, args):
+    with connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                return fn(cur, *args)
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+
+
+async def run_autocommit(fn, *args):
+    """``run`` without a transaction: every statement commits on its own, as
+    ``CREATE INDEX CONCURRENTLY`` requires."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _call_autocommit, fn, args)
+
+
+def _fetchone(cur, sql, params):
+    cur.execute(sql, params)
+    return cur.fetchone()
+
+
+def _fetchall(cur, sql, params):
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def _execute(cur, sql, params):
+    cur.execute(sql, params)
+    return cur.rowcount
+
+
+async def fetchone(sql, params=None):
+    return await run(_fetchone, sql, params)
+
+
+async def fetchall(sql, params=None):
+    return await run(_fetchall, sql, params)
+
+
+async def execute(sql, params=None):
+    return await run(_execute, sql, params)
+
+
+def _open_stream(sql, params):
+    conn = _pool.getconn()
+    try:
+        cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cur.execute(sql, params)
+    except Exception:
+        _close_stream(conn, None)
+        raise
+    return conn, cur
+
+
+def _close_stream(conn, cur):
+    try:
+        if cur is not None and not conn.closed:
+            cur.close()
+            conn.rollback()
+    finally:
+        _pool.putconn(conn, close=bool(conn.closed))
+
+
+async def stream(sql, params=None, chunk_size=None):
+    """Yield the rows of a query in lists of ``chunk_size``.
+
+    Rows come from a named (server-side) cursor, so neither Postgres nor
+    this process ever holds more than one chunk. A pooled connection is
+    held until the generator finishes or is closed; at most
+    ``DB_STREAM_MAX`` streams are open at once, later ones wait."""
+    loop = asyncio.get_running_loop()
+    slots = _stream_slots
+    await slots.acquire()
+    opened = _executor.submit(_open_stream, sql, params)
+    try:
+        conn, cur = await asyncio.wrap_future(opened)
+    except asyncio.CancelledError:
+        # The open may already be running; whatever it returns goes back
+        opened.add_done_callback(lambda _: _abandon(opened, loop, slots))
+        raise
+    except BaseException:
+        slots.release()
+        raise
+    try:
+        while True:
+            rows = await loop.run_in_executor(_executor, cur.fetchmany, chunk_size or STREAM_CHUNK_ROWS)
+            if not rows:
+                break
+            yield rows
+    finally:
+        # Also reached on cancellation (client gone) while a fetch may still
+        # be running; psycopg2 serialises calls on a connection, so closing
+        # on the executor waits for it without blocking the event loop. The
+        # slot is freed once the connection is back in the pool
+        closed = _executor.submit(_close_stream, conn, cur)
+        closed.add_done_callback(lambda _: _release_soon(loop, slots))
+
+
+def _release_soon(loop, slots):
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        # The loop has closed; so has everything waiting on it
+        pass
+
+
+def _abandon(opened, loop, slots):
+    if not opened.cancelled() and opened.exception() is None:
+        _close_stream(*opened.result())
+    _release_soon(loop, slots)
@@ -0,0 +1,134 @@
+"""Streaming encoders for data exports.
+
+An encoder turns one chunk of database rows at a time into bytes, so an
+export of any size is produced with the memory of a single chunk. CSV is
+always available; Parquet and the Arrow IPC stream format need the optional
+``pyarrow`` package. Any format can be gzipped on the fly.
+"""
+import csv
+import io
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = {
+    # format: (media type, file extension, needs pyarrow)
+    "csv": ("text/csv", "csv", False),
+    "parquet": ("application/vnd.apache.parquet", "parquet", True),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows", True),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+class CsvEncoder:
+    def __init__(self, columns):
+        self._header = [header for _, header, _ in columns]
+
+    def write(self, rows):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if self._header:
+            writer.writerow(self._header)
+            self._header = None
+        writer.writerows(rows)
+        return buf.getvalue().encode()
+
+    def close(self):
+        if self._header:
+            return self.write([])
+        return b""
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class _ArrowEncoder:
+    def __init__(self, columns):
+        self._names = [name for name, _, _ in columns]
+        self._schema = pa.schema([(name, type_) for name, _, type_ in columns])
+        self._sink = _Sink()
+        self._writer = self._open(self._sink, self._schema)
+
+    def write(self, rows):
+        arrays = [pa.array(values, type=field.type)
+                  for values, field in zip(zip(*rows), self._schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        return self._sink.drain()
+
+    def close(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+class ParquetEncoder(_ArrowEncoder):
+    """One Parquet row group per chunk; the footer is written on close."""
+
+    def _open(self, sink, schema):
+        return pq.ParquetWriter(sink, schema, compression="zstd")
+
+
+class ArrowEncoder(_ArrowEncoder):
+    """Arrow IPC stream, one record batch per chunk."""
+
+    def _open(self, sink, schema):
+        return pa.ipc.new_stream(sink, schema)
+
+
+class GzipEncoder:
+    def __init__(self, inner):
+        self._inner = inner
+        self._zlib = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+    def write(self, rows):
+        return self._zlib.compress(self._inner.write(rows))
+
+    def close(self):
+        return self._zlib.compress(self._inner.close()) + self._zlib.flush()
+
+
+ENCODERS = {"csv": CsvEncoder, "parquet": ParquetEncoder, "arrow": ArrowEncoder}
+
+
+def encoder(fmt, columns, gzip=False):
+    """Encoder for ``fmt``; ``columns`` are ``(name, CSV header, arrow type name)``.
+
+    Returns ``(encoder, media type, file extension)``."""
+    if fmt not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+    media_type, extension, needs_arrow = FORMATS[fmt]
+    if needs_arrow:
+        if pa is None:
+            raise ExportError(f"{fmt} export needs the pyarrow package")
+        columns = [(name, header, getattr(pa, type_name)()) for name, header, type_name in columns]
+    enc = ENCODERS[fmt](columns)
+    if gzip:
+        return GzipEncoder(enc), "application/gzip", extension + ".gz"
+    return enc, media_type, extension
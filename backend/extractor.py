@@ -0,0 +1,358 @@
+"""Single-pass page extractor.
+
+Builds the page analysis dict in one ``html.parser`` pass without
+constructing a tree. Only the state needed to answer the same questions the
+BeautifulSoup (``html.parser`` builder) version answered is tracked: the
+stack of open element names, which strings count as visible text, the text
+under each open title/heading, and the ``.string`` of JSON-LD scripts. Tree
+quirks that change those answers (void elements, ``<tag/>``, end tags that
+close intermediate elements, whitespace-only strings, script/style/template
+text) are reproduced so the output is identical.
+"""
+import json
+from html.entities import html5
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import duplicates
+import keywords
+
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr',
+    'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'
+])
+# Text inside these is not page text (script/style bodies, templates, ruby annotations)
+STRING_CONTAINERS = frozenset(['rt', 'rp', 'style', 'script', 'template'])
+PRESERVE_WHITESPACE = frozenset(['pre', 'textarea'])
+HEADINGS = frozenset(['h1', 'h2', 'h3'])
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+ENTITIES = {(name[:-1] if name.endswith(';') else name): char for name, char in html5.items()}
+
+# Kinds of string segment
+TEXT, CDATA, MARKUP = 0, 1, 2
+
+
+class PageExtractor(HTMLParser):
+    """Collects every field of the analysis dict from parser events."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []          # (name, heading/title buffer, JSON-LD record)
+        self.open_counts = {}
+        self.collecting = []     # buffers of the open title/heading elements
+        self.containers = 0
+        self.preserving = 0
+        self.already_closed = {}  # void elements whose stray end tag is still expected
+        self.data = []
+
+        self.text = []
+        self.title = None
+        self.meta_desc = None
+        self.headings = {'h1': [], 'h2': [], 'h3': []}
+        self.paragraphs = 0
+        self.images = 0
+        self.images_with_alt = 0
+        self.hrefs = []
+        self.schemas = []
+        self.has_faq_class = False
+        self.canonical = None
+        self.meta_robots = None
+
+    # -- element stack -----------------------------------------------------
+
+    def _push(self, name, attrs):
+        buffer = schema = None
+        if name in HEADINGS:
+            buffer = []
+            self.headings[name].append(buffer)
+        elif name == 'title' and self.title is None:
+            buffer = self.title = []
+        elif name == 'script' and attrs.get('type') == 'application/ld+json':
+            schema = {'children': 0, 'string': None}
+            self.schemas.append(schema)
+
+        if buffer is not None:
+            self.collecting.append(buffer)
+        if name in STRING_CONTAINERS:
+            self.containers += 1
+        if name in PRESERVE_WHITESPACE:
+            self.preserving += 1
+        self.open_counts[name] = self.open_counts.get(name, 0) + 1
+        self.stack.append((name, buffer, schema))
+
+    def _pop(self):
+        name, buffer, _ = self.stack.pop()
+        if buffer is not None:
+            self.collecting.pop()
+        if name in STRING_CONTAINERS:
+            self.containers -= 1
+        if name in PRESERVE_WHITESPACE:
+            self.preserving -= 1
+        self.open_counts[name] -= 1
+        return name
+
+    def _pop_to(self, name):
+        """Close the most recent open ``name`` and everything opened after it."""
+        if not self.open_counts.get(name):
+            return
+        while self._pop() != name:
+            pass
+
+    def _flush(self, kind=TEXT):
+        """End the current string segment."""
+        if not self.data:
+            return
+        data = ''.join(self.data)
+        self.data = []
+        if not self.preserving and not data.strip(ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+
+        if self.stack and self.stack[-1][2] is not None:
+            # html.parser reads script bodies as CDATA, so a script's
+            # children are only ever strings
+            schema = self.stack[-1][2]
+            schema['children'] += 1
+            schema['string'] = data
+
+        if kind == MARKUP or (kind == TEXT and self.containers):
+            return
+        self.text.append(data)
+        for buffer in self.collecting:
+            buffer.append(data)
+
+    # -- parser events -----------------------------------------------------
+
+    def handle_starttag(self, name, attrs, handle_empty_element=True):
+        attr_dict = {}
+        for key, value in attrs:
+            attr_dict[key] = '' if value is None else value
+
+        self._flush()
+        if self.stack and self.stack[-1][2] is not None:
+            self.stack[-1][2]['children'] += 1
+            self.stack[-1][2]['string'] = None
+
+        if name == 'p':
+            self.paragraphs += 1
+        elif name == 'img':
+            self.images += 1
+            if attr_dict.get('alt'):
+                self.images_with_alt += 1
+        elif name == 'a':
+            if 'href' in attr_dict:
+                self.hrefs.append(attr_dict['href'])
+        elif name in ('div', 'section'):
+            if 'faq' in attr_dict.get('class', '').lower():
+                self.has_faq_class = True
+        elif name == 'meta':
+            if self.meta_desc is None and attr_dict.get('name') == 'description':
+                self.meta_desc = attr_dict.get('content', '')
+            elif self.meta_robots is None and attr_dict.get('name', '').lower() == 'robots':
+                self.meta_robots = attr_dict.get('content', '')
+        elif name == 'link':
+            if self.canonical is None and 'canonical' in attr_dict.get('rel', '').lower().split():
+                self.canonical = attr_dict.get('href')
+
+        self._push(name, attr_dict)
+        if handle_empty_element and name in VOID_ELEMENTS:
+            self.handle_endtag(name, check_already_closed=False)
+            self.already_closed[name] = self.already_closed.get(name, 0) + 1
+
+    def handle_startendtag(self, name, attrs):
+        self.handle_starttag(name, attrs, handle_empty_element=False)
+        self.handle_endtag(name)
+
+    def handle_endtag(self, name, check_already_closed=True):
+        if check_already_closed and self.already_closed.get(name):
+            self.already_closed[name] -= 1
+        else:
+            self._flush()
+            self._pop_to(name)
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_charref(self, name):
+        if name.startswith('x'):
+            code = int(name.lstrip('x'), 16)
+        elif name.startswith('X'):
+            code = int(name.lstrip('X'), 16)
+        else:
+            code = int(name)
+        data = None
+        if code < 256:
+            # Low numeric references are usually meant as windows-1252
+            try:
+                data = bytearray([code]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(code)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or '\N{REPLACEMENT CHARACTER}')
+
+    def handle_entityref(self, name):
+        char = ENTITIES.get(name)
+        self.handle_data(char if char is not None else f'&{name}')
+
+    def _markup(self, data, kind=MARKUP):
+        self._flush()
+        self.data.append(data)
+        self._flush(kind)
+
+    def handle_comment(self, data):
+        self._markup(data)
+
+    def handle_decl(self, data):
+        self._markup(data[len('DOCTYPE '):])
+
+    def unknown_decl(self, data):
+        if data.upper().startswith('CDATA['):
+            self._markup(data[len('CDATA['):], CDATA)
+        else:
+            self._markup(data)
+
+    def handle_pi(self, data):
+        self._markup(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+        while self.stack:
+            self._pop()
+
+
+def analyze_html(url, html):
+    """Extract SEO elements, content stats and keywords from a page"""
+    return _analyze_html(url, html)[0]
+
+
+def _analyze_html(url, html, all_terms=False):
+    parser = PageExtractor()
+    parser.feed(html)
+    parser.close()
+
+    title_text = ''.join(parser.title).strip() if parser.title is not None else ""
+    meta_desc_text = parser.meta_desc.strip() if parser.meta_desc is not None else ""
+
+    h1s = [''.join(h).strip() for h in parser.headings['h1']]
+    h2s = [''.join(h).strip() for h in parser.headings['h2']]
+    h3s = [''.join(h).strip() for h in parser.headings['h3']]
+
+    text = ''.join(parser.text)
+    words = len(text.split())
+    top_keywords, terms = keywords.page_keywords(text, all_terms)
+
+    internal_links = 0
+    external_links = 0
+    for href in parser.hrefs:
+        if href.startswith('http'):
+            if url.split('/')[2] in href:
+                internal_links += 1
+            else:
+                external_links += 1
+
+    schema_types = []
+    for schema in parser.schemas:
+        try:
+            schema_data = json.loads(schema['string'] if schema['children'] == 1 else None)
+            if '@type' in schema_data:
+                schema_types.append(schema_data['@type'])
+            elif isinstance(schema_data, list):
+                for item in schema_data:
+                    if '@type' in item:
+                        schema_types.append(item['@type'])
+        except Exception:
+            pass
+
+    has_faq = parser.has_faq_class or 'FAQPage' in schema_types
+    has_breadcrumb = 'BreadcrumbList' in schema_types
+    has_article = 'Article' in schema_types or 'BlogPosting' in schema_types
+    has_review = 'Review' in schema_types or 'AggregateRating' in schema_types
+
+    analysis = {
+        "url": url,
+        "title": title_text,
+        "title_length": len(title_text),
+        "meta_desc": meta_desc_text,
+        "meta_desc_length": len(meta_desc_text),
+        "word_count": words,
+        "paragraph_count": parser.paragraphs,
+        "h1_count": len(h1s),
+        "h2_count": len(h2s),
+        "h3_count": len(h3s),
+        "h1s": h1s,
+        "h2s": h2s[:15],
+        "h3s": h3s[:10],
+        "images_total": parser.images,
+        "images_with_alt": parser.images_with_alt,
+        "internal_links": internal_links,
+        "external_links": external_links,
+        "schemas": schema_types,
+        "has_faq": has_faq,
+        "has_breadcrumb": has_breadcrumb,
+        "has_article_schema": has_article,
+        "has_review_schema": has_review,
+        "top_keywords": top_keywords
+    }
+    return analysis, terms
+
+
+def analyze_bytes(url, body, encoding=None, all_terms=False):
+    """``(analysis, terms)`` for an undecoded response body (the parse-pool
+    entry point); ``terms`` is ``keywords.page_terms`` of its text, with
+    every term when ``all_terms``."""
+    return _analyze_html(url, body.decode(encoding or 'utf-8', errors='replace'), all_terms)
+
+
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+def absolute_url(base, href):
+    """Resolve ``href`` against ``base`` into a normalized http(s) URL without
+    its fragment; ``None`` for other schemes and unparseable links."""
+    try:
+        parts = urlsplit(urljoin(base, href.strip()))
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.netloc:
+        return None
+    netloc = parts.netloc.lower()
+    if netloc.endswith(DEFAULT_PORTS[scheme]):
+        netloc = netloc[:-len(DEFAULT_PORTS[scheme])]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def crawl_bytes(url, body, encoding=None):
+    """The fields the site crawler stores for a page, plus every link on it
+    resolved against ``url`` (in document order, without repeats)."""
+    parser = PageExtractor()
+    parser.feed(body.decode(encoding or 'utf-8', errors='replace'))
+    parser.close()
+
+    links = []
+    seen = set()
+    for href in parser.hrefs:
+        link = absolute_url(url, href)
+        if link and link not in seen:
+            seen.add(link)
+            links.append(link)
+
+    h1s = [''.join(h).strip() for h in parser.headings['h1']]
+    text = ''.join(parser.text)
+    return {
+        "title": ''.join(parser.title).strip() if parser.title is not None else "",
+        "meta_desc": parser.meta_desc.strip() if parser.meta_desc is not None else "",
+        "meta_robots": parser.meta_robots.strip().lower() if parser.meta_robots is not None else None,
+        "canonical": absolute_url(url, parser.canonical) if parser.canonical else None,
+        "h1": h1s[0] if h1s else "",
+        "h1_count": len(h1s),
+        "word_count": len(text.split()),
+        "minhash": duplicates.minhash(text),
+        "links": links
+    }
@@ -0,0 +1,176 @@
+"""Paginated, date-sharded fetchers for the Search Console and GA4 APIs.
+
+The requested date range is split into shards that are fetched concurrently
+(bounded by a semaphore-like worker count). Each shard is paged through until
+the API stops returning full pages. Pages are yielded as soon as they arrive
+so callers can ingest them while the remaining shards are still downloading.
+"""
+import asyncio
+import os
+from datetime import timedelta
+from urllib.parse import quote_plus
+
+GSC_SHARD_DAYS = int(os.getenv("GSC_SHARD_DAYS", "1"))
+GSC_FETCH_CONCURRENCY = int(os.getenv("GSC_FETCH_CONCURRENCY", "4"))
+GSC_ROW_LIMIT = 25000  # API maximum per request
+
+GSC_DIMENSIONS = ["page", "query", "country", "device", "date"]
+
+GA4_SHARD_DAYS = int(os.getenv("GA4_SHARD_DAYS", "7"))
+GA4_FETCH_CONCURRENCY = int(os.getenv("GA4_FETCH_CONCURRENCY", "4"))
+GA4_PAGE_SIZE = int(os.getenv("GA4_PAGE_SIZE", "25000"))
+
+# pagePath and date are always requested; they identify a ga4_metrics row.
+GA4_REQUIRED_DIMENSIONS = ["pagePath", "date"]
+GA4_OPTIONAL_DIMENSIONS = ["country", "deviceCategory"]
+GA4_METRICS = ["sessions", "totalUsers", "screenPageViews",
+               "averageSessionDuration", "bounceRate", "conversions"]
+
+_DONE = object()
+
+
+class GoogleAPIError(Exception):
+    """Non-200 response from a Google API."""
+
+    def __init__(self, status, details):
+        super().__init__(f"Google API returned {status}")
+        self.status = status
+        self.details = details
+
+
+def date_shards(start_date, end_date, shard_days):
+    """Split the inclusive range into consecutive ``shard_days``-long windows."""
+    shard_days = max(1, int(shard_days))
+    current = start_date
+    while current <= end_date:
+        shard_end = min(current + timedelta(days=shard_days - 1), end_date)
+        yield current, shard_end
+        current = shard_end + timedelta(days=1)
+
+
+async def gsc_query_pages(client, site_url, access_token, start_date, end_date,
+                          dimensions=GSC_DIMENSIONS, row_limit=GSC_ROW_LIMIT):
+    """Page through one Search Analytics query via ``startRow``."""
+    api_url = f"https://searchconsole.googleapis.com/webmasters/v3/sites/{quote_plus(site_url)}/searchAnalytics/query"
+    start_row = 0
+    while True:
+        response = await client.post(
+            api_url,
+            json={
+                "startDate": start_date.isoformat(),
+                "endDate": end_date.isoformat(),
+                "dimensions": dimensions,
+                "rowLimit": row_limit,
+                "startRow": start_row
+            },
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            },
+            timeout=60.0
+        )
+        if response.status_code != 200:
+            raise GoogleAPIError(response.status_code, response.text)
+
+        rows = response.json().get('rows', [])
+        if rows:
+            yield rows
+        if len(rows) < row_limit:
+            return
+        start_row += len(rows)
+
+
+def ga4_dimensions(requested=None):
+    """Dimensions to request: the required ones plus any requested optional ones."""
+    if requested is None:
+        requested = GA4_OPTIONAL_DIMENSIONS
+    return GA4_REQUIRED_DIMENSIONS + [d for d in GA4_OPTIONAL_DIMENSIONS if d in requested]
+
+
+async def ga4_report_pages(client, property_id, access_token, start_date, end_date,
+                           dimensions, page_size=None):
+    """Page through one runReport via ``offset`` until ``rowCount`` is reached."""
+    page_size = page_size or GA4_PAGE_SIZE
+    offset = 0
+    while True:
+        response = await client.post(
+            f"https://analyticsdata.googleapis.com/v1beta/properties/{property_id}:runReport",
+            json={
+                "dateRanges": [{"startDate": start_date.isoformat(), "endDate": end_date.isoformat()}],
+                "dimensions": [{"name": name} for name in dimensions],
+                "metrics": [{"name": name} for name in GA4_METRICS],
+                "limit": page_size,
+                "offset": offset
+            },
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            },
+            timeout=60.0
+        )
+        if response.status_code != 200:
+            raise GoogleAPIError(response.status_code, response.text)
+
+        data = response.json()
+        rows = data.get('rows', [])
+        if rows:
+            yield rows
+        offset += len(rows)
+        if not rows or offset >= data.get('rowCount', 0):
+            return
+
+
+async def fan_out(shards, fetch_pages, concurrency):
+    """Run ``fetch_pages(shard)`` for every shard with at most ``concurrency``
+    shards in flight, yielding pages in arrival order."""
+    pending = list(shards)
+    queue = asyncio.Queue(maxsize=max(1, concurrency) * 2)
+
+    async def worker():
+        try:
+            while pending:
+                shard = pending.pop(0)
+                async for page in fetch_pages(*shard):
+                    await queue.put(page)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(_DONE)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(pending))))]
+    running = len(workers)
+    try:
+        while running:
+            item = await queue.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+def stream_gsc_rows(client, site_url, access_token, start_date, end_date,
+                    shard_days=None, concurrency=None):
+    """Yield every Search Analytics row page for the range, shard by shard."""
+    shards = date_shards(start_date, end_date, shard_days or GSC_SHARD_DAYS)
+
+    def fetch_pages(shard_start, shard_end):
+        return gsc_query_pages(client, site_url, access_token, shard_start, shard_end)
+
+    return fan_out(shards, fetch_pages, concurrency or GSC_FETCH_CONCURRENCY)
+
+
+def stream_ga4_rows(client, property_id, access_token, start_date, end_date,
+                    dimensions, shard_days=None, concurrency=None):
+    """Yield every runReport row page for the range, shard by shard."""
+    shards = date_shards(start_date, end_date, shard_days or GA4_SHARD_DAYS)
+
+    def fetch_pages(shard_start, shard_end):
+        return ga4_report_pages(client, property_id, access_token, shard_start, shard_end, dimensions)
+
+    return fan_out(shards, fetch_pages, concurrency or GA4_FETCH_CONCURRENCY)
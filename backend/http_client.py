@@ -0,0 +1,143 @@
+"""Application-scoped HTTP client.
+
+One ``httpx.AsyncClient`` is created at startup and shared by every outbound
+call (Google APIs, Serper, competitor pages) so connections are pooled and
+kept alive instead of paying a TCP + TLS handshake per request. HTTP/2 is
+negotiated when the optional ``h2`` package is installed.
+
+httpx only caps connections globally, so a thin transport wrapper adds a
+per-host cap on in-flight requests; a slot is held until the response body
+is closed.
+"""
+import asyncio
+import os
+
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "8"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+TIMEOUT = httpx.Timeout(30.0, connect=5.0, pool=10.0)
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+_client = None
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, slot):
+        self._stream = stream
+        self._slot = slot
+        self._released = False
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._slot.release()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._release()
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Allow at most ``per_host`` in-flight requests per host."""
+
+    def __init__(self, transport, per_host):
+        self._transport = transport
+        self._per_host = per_host
+        self._slots = {}
+
+    async def handle_async_request(self, request):
+        slot = self._slots.get(request.url.host)
+        if slot is None:
+            slot = self._slots[request.url.host] = asyncio.Semaphore(self._per_host)
+        await slot.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            slot.release()
+            raise
+        if response.is_closed:
+            # Body was already loaded in memory (e.g. mock transports)
+            slot.release()
+        else:
+            response.stream = _ReleasingStream(response.stream, slot)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def is_html(content_type):
+    """Whether a response with this Content-Type is worth parsing as HTML."""
+    # Plenty of small sites send no Content-Type at all; let the parser try
+    if not content_type:
+        return True
+    return content_type.split(";", 1)[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+async def read_html(response, limit):
+    """Read at most ``limit`` body bytes, stopping once ``</body>`` has arrived
+    so trailing scripts and tracking markup are never downloaded."""
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        # The closing tag may straddle two chunks
+        start = max(0, len(body) - 6)
+        body += chunk[:limit - len(body)]
+        if len(body) >= limit or b"</body" in body[start:].lower():
+            break
+    return bytes(body)
+
+
+def build_client():
+    http2 = _http2_available()
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    transport = httpx.AsyncHTTPTransport(http2=http2, limits=limits, retries=1)
+    return httpx.AsyncClient(
+        transport=HostLimitedTransport(transport, HTTP_PER_HOST_LIMIT),
+        timeout=TIMEOUT
+    )
+
+
+async def init_client():
+    global _client
+    if _client is None:
+        _client = build_client()
+        print(f"HTTP client ready (http2={'on' if _http2_available() else 'off'})")
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client():
+    if _client is None:
+        raise RuntimeError("HTTP client is not initialised")
+    return _client
@@ -0,0 +1,257 @@
+"""Bulk ingestion of GSC / GA4 rows.
+
+Rows are streamed into a temporary staging table with ``COPY`` and then
+upserted into the metrics table with a single ``INSERT ... SELECT``, instead
+of one ``INSERT`` round trip per row.
+
+Incremental syncs are driven by a per-site, per-source high-water mark in
+``sync_watermarks``: only dates after it (plus a short trailing window for
+late-arriving data) are fetched again.
+
+Each merge also folds its changes into the rollup tables (see ``rollups``)
+in the same transaction.
+"""
+import csv
+import io
+import os
+import time
+from datetime import date, timedelta
+
+import rollups
+
+NULL = "\\N"
+NOT_SET = "(not set)"
+
+# GSC keeps revising the last ~3 days; GA4 settles faster.
+GSC_TRAILING_DAYS = int(os.getenv("GSC_TRAILING_DAYS", "3"))
+GA4_TRAILING_DAYS = int(os.getenv("GA4_TRAILING_DAYS", "2"))
+
+GSC_COLUMNS = ["site_id", "url", "query", "country", "device",
+               "impressions", "clicks", "ctr", "position", "date"]
+GSC_KEY = ["site_id", "url", "query", "country", "device", "date"]
+
+GA4_COLUMNS = ["site_id", "page_path", "date", "country", "device", "sessions", "users",
+               "pageviews", "avg_session_duration", "bounce_rate", "conversions"]
+GA4_KEY = ["site_id", "page_path", "date", "country", "device"]
+
+GSC_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS gsc_staging (
+        site_id INTEGER, url TEXT, query TEXT, country TEXT, device TEXT,
+        impressions INTEGER, clicks INTEGER, ctr DOUBLE PRECISION,
+        position DOUBLE PRECISION, date DATE
+    ) ON COMMIT DROP
+"""
+
+GA4_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS ga4_staging (
+        site_id INTEGER, page_path TEXT, date DATE, country TEXT, device TEXT,
+        sessions INTEGER, users INTEGER, pageviews INTEGER,
+        avg_session_duration DOUBLE PRECISION, bounce_rate DOUBLE PRECISION,
+        conversions DOUBLE PRECISION
+    ) ON COMMIT DROP
+"""
+
+
+class IngestStats:
+    """Accumulates row counts and time spent across ingest batches."""
+
+    def __init__(self):
+        self.rows = 0
+        self.seconds = 0.0
+        self.max_date = None
+
+    def add(self, rows, seconds, max_date=None):
+        self.rows += rows
+        self.seconds += seconds
+        if max_date and (self.max_date is None or max_date > self.max_date):
+            self.max_date = max_date
+
+    @property
+    def rows_per_sec(self):
+        return round(self.rows / self.seconds, 1) if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "seconds": round(self.seconds, 3),
+            "rows_per_sec": self.rows_per_sec
+        }
+
+
+def gsc_records(site_id, rows, default_date=None):
+    """Flatten Search Analytics API rows into ``GSC_COLUMNS`` tuples."""
+    for row in rows:
+        keys = row.get('keys', [])
+        yield (
+            site_id,
+            keys[0] if len(keys) > 0 else None,
+            keys[1] if len(keys) > 1 else None,
+            keys[2] if len(keys) > 2 else None,
+            keys[3] if len(keys) > 3 else None,
+            row.get('impressions', 0),
+            row.get('clicks', 0),
+            row.get('ctr', 0.0),
+            row.get('position', 0.0),
+            (keys[4] if len(keys) > 4 else None) or default_date
+        )
+
+
+def ga4_records(site_id, rows, dimensions=None):
+    """Flatten GA4 runReport rows into ``GA4_COLUMNS`` tuples.
+
+    ``dimensions`` names the requested dimensions in order; any of
+    country/deviceCategory that was not requested is stored as GA4's own
+    ``(not set)`` placeholder. Such rows would sit beside full-dimension rows
+    of the same page and date, so a site keeps one dimension set (see
+    ``pin_ga4_dimensions``).
+    """
+    dimensions = dimensions or ["pagePath", "date", "country", "deviceCategory"]
+    positions = {name: i for i, name in enumerate(dimensions)}
+    columns = [positions.get(name) for name in ("pagePath", "date", "country", "deviceCategory")]
+
+    for row in rows:
+        values = [d.get('value') for d in row.get('dimensionValues', [])]
+        metrics = row.get('metricValues', [])
+
+        if len(values) >= len(dimensions) and len(metrics) >= 6:
+            yield (
+                site_id,
+                *[values[i] if i is not None else NOT_SET for i in columns],
+                int(metrics[0].get('value', 0)),
+                int(metrics[1].get('value', 0)),
+                int(metrics[2].get('value', 0)),
+                float(metrics[3].get('value', 0)),
+                float(metrics[4].get('value', 0)),
+                float(metrics[5].get('value', 0))
+            )
+
+
+def copy_records(cur, table, columns, records):
+    """COPY an iterable of tuples into ``table``. Returns the row count."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    count = 0
+    for record in records:
+        # bytes go in as bytea hex text
+        writer.writerow([NULL if value is None else "\\x" + value.hex() if isinstance(value, bytes) else value
+                         for value in record])
+        count += 1
+    if not count:
+        return 0
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')",
+        buf
+    )
+    return count
+
+
+def _merge(cur, staging_sql, staging, target, columns, key, site_id, records, stats):
+    started = time.perf_counter()
+    cur.execute(staging_sql)
+    count = copy_records(cur, staging, columns, records)
+    max_date = None
+    if count:
+        cols = ", ".join(columns)
+        key_cols = ", ".join(key)
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in key)
+        cur.execute(f"SELECT MAX(date) FROM {staging}")
+        max_date = cur.fetchone()[0]
+        rollup = rollups.ROLLUPS[target]
+        rollups.lock(cur, site_id)
+        rollups.ensure_built(cur, site_id)
+        cur.execute(rollup.delta_table_sql())
+        # DISTINCT ON keeps a batch with repeated keys from hitting the same row
+        # twice. Every part of the statement sees the same snapshot, so the
+        # delta join still reads the rows as they were before the upsert.
+        cur.execute(f"""
+            WITH batch AS MATERIALIZED (
+                SELECT DISTINCT ON ({key_cols}) {cols} FROM {staging}
+            ), merged AS (
+                INSERT INTO {target} ({cols})
+                SELECT {cols} FROM batch
+                ON CONFLICT ({key_cols}) DO UPDATE SET {updates}
+            )
+            INSERT INTO {rollup.delta} {rollup.delta_select("batch", target, key)}
+        """)
+        rollups.apply_deltas(cur, rollup)
+        cur.execute(f"TRUNCATE {staging}")
+    if stats is not None:
+        stats.add(count, time.perf_counter() - started, max_date)
+    return count
+
+
+def _stored_ga4_dimensions(cur, site_id):
+    """The dimension set the site's existing GA4 rows were imported with,
+    read from the placeholders (``None`` when it has none)."""
+    cur.execute("""
+        SELECT bool_and(country = %s), bool_and(device = %s) FROM ga4_metrics WHERE site_id = %s
+    """, (NOT_SET, NOT_SET, site_id))
+    no_country, no_device = cur.fetchone()
+    if no_country is None:
+        return None
+    return ["pagePath", "date"] + ["country"] * (not no_country) + ["deviceCategory"] * (not no_device)
+
+
+def pin_ga4_dimensions(cur, site_id, dimensions):
+    """Record the site's GA4 dimension set on its first import; raise
+    ``ValueError`` if ``dimensions`` differs from it.
+
+    Rows of different sets have different natural keys for the same
+    traffic, so mixing them would count it twice in ``ga4_metrics`` and
+    the rollups."""
+    cur.execute("SELECT dimensions FROM ga4_dimension_sets WHERE site_id = %s", (site_id,))
+    row = cur.fetchone()
+    if row is None:
+        cur.execute("""
+            INSERT INTO ga4_dimension_sets (site_id, dimensions) VALUES (%s, %s)
+            ON CONFLICT (site_id) DO NOTHING
+        """, (site_id, _stored_ga4_dimensions(cur, site_id) or list(dimensions)))
+        cur.execute("SELECT dimensions FROM ga4_dimension_sets WHERE site_id = %s", (site_id,))
+        row = cur.fetchone()
+    if row[0] != list(dimensions):
+        raise ValueError(f"GA4 data for this site is stored with dimensions {row[0]}; "
+                         f"importing {list(dimensions)} as well would count the same traffic twice")
+
+
+def get_watermark(cur, site_id, source):
+    cur.execute("""
+        SELECT high_water_date FROM sync_watermarks
+        WHERE site_id = %s AND source = %s
+    """, (site_id, source))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(cur, site_id, source, high_water_date):
+    """Advance the high-water mark; it never moves backwards."""
+    cur.execute("""
+        INSERT INTO sync_watermarks (site_id, source, high_water_date, updated_at)
+        VALUES (%s, %s, %s, NOW())
+        ON CONFLICT (site_id, source) DO UPDATE SET
+            high_water_date = GREATEST(sync_watermarks.high_water_date, EXCLUDED.high_water_date),
+            updated_at = NOW()
+    """, (site_id, source, high_water_date))
+
+
+def sync_window(watermark, days, trailing_days, today=None):
+    """Date range to fetch: everything since the watermark, re-fetching the
+    last ``trailing_days`` before it, capped at the full ``days`` window.
+    Returns ``(start_date, end_date, mode)``."""
+    end_date = today or date.today()
+    full_start = end_date - timedelta(days=days)
+    if watermark is None:
+        return full_start, end_date, "full"
+    return max(full_start, watermark - timedelta(days=trailing_days)), end_date, "incremental"
+
+
+def ingest_gsc(cur, site_id, rows, stats=None, default_date=None):
+    """Load Search Analytics rows into ``gsc_metrics`` in one COPY + merge."""
+    return _merge(cur, GSC_STAGING_SQL, "gsc_staging", "gsc_metrics", GSC_COLUMNS, GSC_KEY,
+                  site_id, gsc_records(site_id, rows, default_date), stats)
+
+
+def ingest_ga4(cur, site_id, rows, stats=None, dimensions=None):
+    """Load GA4 runReport rows into ``ga4_metrics`` in one COPY + merge."""
+    return _merge(cur, GA4_STAGING_SQL, "ga4_staging", "ga4_metrics", GA4_COLUMNS, GA4_KEY,
+                  site_id, ga4_records(site_id, rows, dimensions), stats)
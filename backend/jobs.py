@@ -0,0 +1,292 @@
+"""Background jobs for long-running imports and analyses.
+
+With ``REDIS_URL`` configured, jobs are queued in Redis and executed by
+separate worker processes (``python worker.py``). Without Redis, an
+in-process queue with the same interface runs them inside the API process,
+which is enough for local development.
+
+Handlers are registered by name and called as ``await handler(params,
+progress)``; ``progress(**fields)`` publishes intermediate state to the job
+record. A handler result containing an ``"error"`` key marks the job failed.
+
+A Redis worker moves each job it takes (``BLMOVE``) from the queue onto its
+own processing list, removes it when the job finishes, and refreshes a
+heartbeat key while it runs. On startup and with every beat, workers hand
+the jobs of workers whose heartbeat has expired back to the queue, or mark
+them failed once they have been started ``JOB_MAX_ATTEMPTS`` times, so a
+crashed or killed worker loses no jobs.
+"""
+import asyncio
+import json
+import os
+import secrets
+import socket
+import time
+import traceback
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+# A worker whose heartbeat is this old is taken to be dead
+JOB_WORKER_TIMEOUT = int(os.getenv("JOB_WORKER_TIMEOUT", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+
+QUEUE_KEY = "seo-engine:jobs:queue"
+JOB_KEY = "seo-engine:job:{}"
+WORKERS_KEY = "seo-engine:jobs:workers"
+PROCESSING_KEY = "seo-engine:jobs:processing:{}"
+HEARTBEAT_KEY = "seo-engine:jobs:heartbeat:{}"
+
+_handlers = {}
+_backend = None
+_tasks = []
+
+
+def register(kind, handler):
+    _handlers[kind] = handler
+
+
+def _new_record(kind, params):
+    return {
+        "id": secrets.token_hex(12),
+        "kind": kind,
+        "status": "queued",
+        "params": params,
+        "progress": {},
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None
+    }
+
+
+class MemoryBackend:
+    """In-process fallback: an asyncio queue drained by worker tasks."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.queue = asyncio.Queue()
+
+    async def save(self, record):
+        self.jobs[record["id"]] = record
+
+    async def load(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def push(self, job_id):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for old_id in [j for j, r in self.jobs.items() if (r["finished_at"] or time.time()) < cutoff]:
+            del self.jobs[old_id]
+        await self.queue.put(job_id)
+
+    async def pop(self):
+        return await self.queue.get()
+
+    async def ack(self, job_id):
+        pass
+
+    async def join(self):
+        pass
+
+    async def heartbeat(self):
+        pass
+
+    async def recover_dead(self):
+        pass
+
+    async def leave(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Job records as JSON strings with a TTL, queue as a Redis list, and a
+    processing list plus heartbeat key per worker."""
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.processing = PROCESSING_KEY.format(self.worker_id)
+
+    async def save(self, record):
+        await self.redis.set(JOB_KEY.format(record["id"]), json.dumps(record, default=str),
+                             ex=JOB_TTL_SECONDS)
+
+    async def load(self, job_id):
+        data = await self.redis.get(JOB_KEY.format(job_id))
+        return json.loads(data) if data else None
+
+    async def push(self, job_id):
+        await self.redis.lpush(QUEUE_KEY, job_id)
+
+    async def pop(self):
+        while True:
+            job_id = await self.redis.blmove(QUEUE_KEY, self.processing, 5, "RIGHT", "LEFT")
+            if job_id:
+                return job_id
+
+    async def ack(self, job_id):
+        await self.redis.lrem(self.processing, 1, job_id)
+
+    async def heartbeat(self):
+        await self.redis.set(HEARTBEAT_KEY.format(self.worker_id), time.time(), ex=JOB_WORKER_TIMEOUT)
+
+    async def join(self):
+        """Register this worker, then recover the jobs of dead ones."""
+        await self.heartbeat()
+        await self.redis.sadd(WORKERS_KEY, self.worker_id)
+        await self.recover_dead()
+
+    async def recover_dead(self):
+        for worker_id in await self.redis.smembers(WORKERS_KEY):
+            if worker_id != self.worker_id and not await self.redis.exists(HEARTBEAT_KEY.format(worker_id)):
+                await self._recover(worker_id)
+
+    async def _recover(self, worker_id):
+        processing = PROCESSING_KEY.format(worker_id)
+        while True:
+            # Oldest first, back onto the end the workers pop from
+            job_id = await self.redis.lmove(processing, QUEUE_KEY, "RIGHT", "RIGHT")
+            if job_id is None:
+                break
+            record = await self.load(job_id)
+            if record is None:
+                await self.redis.lrem(QUEUE_KEY, 1, job_id)
+            elif record["status"] in ("succeeded", "failed"):
+                # Finished, but the worker died before acknowledging it
+                await self.redis.lrem(QUEUE_KEY, 1, job_id)
+            elif record.get("attempts", 0) >= JOB_MAX_ATTEMPTS:
+                await self.redis.lrem(QUEUE_KEY, 1, job_id)
+                record.update(status="failed", finished_at=time.time(),
+                              error=f"worker stopped while running it ({record.get('attempts')} attempts)")
+                await self.save(record)
+                print(f"Job {job_id} failed: its worker {worker_id} stopped")
+            else:
+                record["status"] = "queued"
+                await self.save(record)
+                print(f"Job {job_id} requeued: its worker {worker_id} stopped")
+        await self.redis.srem(WORKERS_KEY, worker_id)
+
+    async def leave(self):
+        """Deregister on a clean shutdown; interrupted jobs go back to the queue."""
+        await self.redis.delete(HEARTBEAT_KEY.format(self.worker_id))
+        await self._recover(self.worker_id)
+
+    async def close(self):
+        await self.redis.close()
+
+
+async def start(redis_url=None, run_workers=None, require_redis=False):
+    """Pick a backend. Workers run in this process only for the in-memory
+    backend unless ``run_workers`` says otherwise. With ``require_redis``
+    (a dedicated worker process) an unreachable Redis raises instead of
+    falling back to a queue nothing else enqueues to."""
+    global _backend, _tasks
+    if _backend is not None:
+        return
+    if require_redis and not redis_url:
+        raise RuntimeError("REDIS_URL is required")
+    if redis_url:
+        try:
+            backend = RedisBackend(redis_url)
+            await backend.redis.ping()
+            _backend = backend
+            print("Job queue: redis")
+        except Exception as e:
+            if require_redis:
+                raise RuntimeError(f"Redis unavailable: {e}") from e
+            print(f"Redis unavailable ({e}), using in-process job queue")
+    if _backend is None:
+        _backend = MemoryBackend()
+        print("Job queue: in-process")
+    if run_workers is None:
+        run_workers = isinstance(_backend, MemoryBackend)
+    if run_workers:
+        _tasks = [asyncio.create_task(_work()) for _ in range(JOB_CONCURRENCY)]
+
+
+async def stop():
+    global _backend, _tasks
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks = []
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
+
+async def _heartbeat():
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await _backend.heartbeat()
+            # Workers that die while others keep running are caught here
+            await _backend.recover_dead()
+        except Exception as e:
+            print(f"Job worker heartbeat failed: {e}")
+
+
+async def enqueue(kind, params):
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    record = _new_record(kind, params)
+    await _backend.save(record)
+    await _backend.push(record["id"])
+    return record
+
+
+async def get(job_id):
+    return await _backend.load(job_id)
+
+
+async def _run(job_id):
+    record = await _backend.load(job_id)
+    if record is None:
+        return
+    record["status"] = "running"
+    record["started_at"] = time.time()
+    record["attempts"] = record.get("attempts", 0) + 1
+    await _backend.save(record)
+
+    async def progress(**fields):
+        record["progress"].update(fields)
+        await _backend.save(record)
+
+    try:
+        result = await _handlers[record["kind"]](record["params"], progress)
+        record["result"] = result
+        if isinstance(result, dict) and result.get("error"):
+            record["status"] = "failed"
+            record["error"] = result["error"]
+        else:
+            record["status"] = "succeeded"
+    except Exception as e:
+        traceback.print_exc()
+        record["status"] = "failed"
+        record["error"] = str(e)
+    record["finished_at"] = time.time()
+    await _backend.save(record)
+
+
+async def _work():
+    while True:
+        job_id = await _backend.pop()
+        await _run(job_id)
+        await _backend.ack(job_id)
+
+
+async def work_forever():
+    """Worker-process entry point: drain the queue with ``JOB_CONCURRENCY`` slots."""
+    await _backend.join()
+    heartbeat = asyncio.create_task(_heartbeat())
+    try:
+        await asyncio.gather(*[_work() for _ in range(JOB_CONCURRENCY)])
+    finally:
+        heartbeat.cancel()
+        await _backend.leave()
@@ -0,0 +1,147 @@
+"""Keyword statistics for analyzed pages.
+
+A page's text is tokenized once. From those tokens we keep the classic
+``top_keywords`` list (single words, unchanged format) and the page's
+unigram/bigram/trigram term counts. Competitors keep (and cache) only their
+``KEYWORD_TERMS_PER_PAGE`` most frequent terms; the page being analyzed
+keeps all of its terms, so a term it uses anywhere is never reported as a
+gap. The page and its competitors are weighted with TF-IDF in one numpy
+batch to find the terms competitors lean on that the page does not use.
+"""
+import os
+from collections import Counter
+from itertools import islice
+
+import numpy as np
+
+KEYWORD_TERMS_PER_PAGE = int(os.getenv("KEYWORD_TERMS_PER_PAGE", "300"))
+
+# The original top_keywords filter; kept as-is so results stay comparable
+STOP_WORDS = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'is', 'are', 'was', 'were'}
+
+# Phrases may not start or end with these
+PHRASE_STOP_WORDS = STOP_WORDS | {
+    'about', 'after', 'all', 'also', 'any', 'as', 'be', 'been', 'before', 'being', 'by', 'can',
+    'could', 'did', 'do', 'does', 'from', 'had', 'has', 'have', 'he', 'her', 'here', 'his', 'how',
+    'i', 'if', 'into', 'it', 'its', 'just', 'may', 'me', 'more', 'most', 'my', 'no', 'not', 'now',
+    'only', 'other', 'our', 'out', 'over', 'she', 'should', 'so', 'some', 'such', 'than', 'that',
+    'their', 'them', 'then', 'there', 'these', 'they', 'this', 'those', 'through', 'up', 'us',
+    'very', 'we', 'what', 'when', 'where', 'which', 'while', 'who', 'why', 'will', 'would', 'you',
+    'your'
+}
+
+STRIP_CHARS = '.,;:!?()[]{}"\'`*|<>«»“”‘’…-–—'
+PHRASE_BREAKS = frozenset('.,;:!?()[]{}|…')
+
+
+def _tokens(words):
+    """Clean tokens with ``None`` wherever punctuation breaks a phrase."""
+    tokens = []
+    append = tokens.append
+    for word in words:
+        if word.isalnum():
+            append(word)
+            continue
+        token = word.strip(STRIP_CHARS)
+        valid = bool(token) and token.replace('-', '').replace("'", '').isalnum()
+        if not valid or word[0] in PHRASE_BREAKS:
+            append(None)
+        if valid:
+            append(token)
+            if word[-1] in PHRASE_BREAKS:
+                append(None)
+    return tokens
+
+
+def term_counts(words):
+    """Unigram, bigram and trigram counts."""
+    stop = PHRASE_STOP_WORDS
+    tokens = _tokens(words)
+    # Count n-gram tuples in C, then filter the (far fewer) distinct ones
+    counts = Counter({t: n for t, n in Counter(tokens).items()
+                      if t and len(t) > 2 and t not in stop and not t.isdigit()})
+    for gram, n in Counter(zip(tokens, tokens[1:])).items():
+        if gram[0] and gram[1] and gram[0] not in stop and gram[1] not in stop:
+            counts[" ".join(gram)] = n
+    for gram, n in Counter(zip(tokens, tokens[1:], tokens[2:])).items():
+        if gram[0] and gram[1] and gram[2] and gram[0] not in stop and gram[2] not in stop:
+            counts[" ".join(gram)] = n
+    return counts
+
+
+def page_terms(words, limit=KEYWORD_TERMS_PER_PAGE):
+    """The page's ``limit`` most frequent terms (all of them for ``None``)
+    with their counts, most frequent first."""
+    return {"counts": dict(term_counts(words).most_common(limit))}
+
+
+def top_terms(terms, limit=KEYWORD_TERMS_PER_PAGE):
+    """``page_terms`` cut down to its ``limit`` most frequent terms."""
+    return {"counts": dict(islice(terms["counts"].items(), limit))}
+
+
+def top_keywords(words, limit=20):
+    """Most frequent words longer than three characters, stop words excluded."""
+    counts = Counter({w: n for w, n in Counter(words).items() if len(w) > 3 and w not in STOP_WORDS})
+    # most_common(n) is a heap selection that keeps first-seen order on ties
+    return counts.most_common(limit)
+
+
+def page_keywords(text, all_terms=False):
+    """``(top_keywords, terms)`` for a page's visible text."""
+    words = text.lower().split()
+    return top_keywords(words), page_terms(words, None if all_terms else KEYWORD_TERMS_PER_PAGE)
+
+
+def tfidf(docs):
+    """L2-normalised TF-IDF weights for a list of term-count dicts.
+
+    Returns ``(vocabulary, weights, present)`` where row ``i`` of the
+    ``docs x vocabulary`` matrices belongs to ``docs[i]``."""
+    vocab = {}
+    for doc in docs:
+        for term in doc:
+            vocab.setdefault(term, len(vocab))
+    counts = np.zeros((len(docs), len(vocab)), dtype=np.float64)
+    for i, doc in enumerate(docs):
+        if doc:
+            cols = np.fromiter((vocab[t] for t in doc), dtype=np.int64, count=len(doc))
+            counts[i, cols] = np.fromiter(doc.values(), dtype=np.float64, count=len(doc))
+
+    present = counts > 0
+    df = present.sum(axis=0)
+    idf = np.log((1 + len(docs)) / (1 + df)) + 1
+    tf = np.zeros_like(counts)
+    np.log(counts, out=tf, where=present)
+    tf[present] += 1  # sublinear tf: 1 + log(count)
+    weights = tf * idf
+    norms = np.linalg.norm(weights, axis=1, keepdims=True)
+    np.divide(weights, norms, out=weights, where=norms > 0)
+    return list(vocab), weights, present
+
+
+def term_gaps(page_terms, competitor_terms, limit=20):
+    """Terms that competitors weight heavily but the page does not use.
+
+    Takes ``page_terms`` results, the page's with all of its terms. A gap
+    must appear on at least two competitors (or the only one), and is
+    ranked by its mean TF-IDF weight across competitors."""
+    competitor_terms = [terms["counts"] for terms in competitor_terms if terms and terms["counts"]]
+    if not competitor_terms:
+        return []
+    vocab, weights, present = tfidf([page_terms["counts"], *competitor_terms])
+    uses = present[0]
+
+    competitor_weight = weights[1:].mean(axis=0)
+    competitors_using = present[1:].sum(axis=0)
+    candidates = np.flatnonzero(~uses & (competitors_using >= min(2, len(competitor_terms))))
+    if len(candidates) > limit:
+        top = np.argpartition(-competitor_weight[candidates], limit - 1)[:limit]
+        candidates = candidates[top]
+    candidates = candidates[np.argsort(-competitor_weight[candidates], kind="stable")]
+
+    return [{
+        "term": vocab[i],
+        "competitor_weight": round(float(competitor_weight[i]), 4),
+        "competitors_using": int(competitors_using[i])
+    } for i in candidates]
@@ -0,0 +1,294 @@
+"""Internal link graph: PageRank, click depth and orphan pages.
+
+The crawler stores each page's followed internal links as one row of
+``crawl_links``: the source page's id and an integer array of target ids,
+with the URLs themselves kept once per site in ``crawl_urls``.
+
+The analysis streams the edge rows of the site's latest crawl into NumPy
+arrays and compacts the URL ids to ``0..n-1``. It then works on the
+adjacency matrix in sparse form:
+- PageRank is computed by power iteration, one gather and one ``bincount``
+  over the edge list per step. Rank on pages without outlinks is spread
+  evenly.
+- Click depth from the start URL is a level-by-level BFS over the matrix
+  in CSR form (targets sorted by source).
+- Orphans are URLs with GSC impressions and no inbound internal links.
+Memory is a few arrays of the edge count. The per-URL results replace the
+site's rows in ``link_metrics``.
+"""
+import asyncio
+import os
+import time
+from itertools import chain
+
+import numpy as np
+
+import db
+import extractor
+import ingest
+import rollups
+
+PAGERANK_DAMPING = float(os.getenv("PAGERANK_DAMPING", "0.85"))
+PAGERANK_TOLERANCE = float(os.getenv("PAGERANK_TOLERANCE", "1e-6"))
+PAGERANK_MAX_ITERATIONS = int(os.getenv("PAGERANK_MAX_ITERATIONS", "100"))
+
+LINKS_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS crawl_links_staging (
+        source TEXT, target TEXT
+    ) ON COMMIT DROP
+"""
+
+GSC_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS link_gsc_staging (
+        url TEXT, impressions BIGINT
+    ) ON COMMIT DROP
+"""
+
+METRIC_COLUMNS = ["url_id", "pagerank", "inlinks", "outlinks", "depth", "impressions", "orphan"]
+
+METRICS_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS link_metrics_staging (
+        url_id INTEGER, pagerank DOUBLE PRECISION, inlinks INTEGER, outlinks INTEGER,
+        depth INTEGER, impressions BIGINT, orphan BOOLEAN
+    ) ON COMMIT DROP
+"""
+
+EDGES_SQL = "SELECT source_id, targets FROM crawl_links WHERE site_id = %s AND crawl_id = %s"
+
+
+def _intern(cur, site_id, table, columns):
+    """Add the URLs in ``columns`` of ``table`` to ``crawl_urls``."""
+    urls = " UNION ".join(f"SELECT {c} FROM {table} WHERE {c} IS NOT NULL" for c in columns)
+    # NOT EXISTS first, so known URLs do not burn sequence values on conflict
+    cur.execute(f"""
+        INSERT INTO crawl_urls (site_id, url)
+        SELECT %s, u.url FROM ({urls}) AS u (url)
+        WHERE NOT EXISTS (SELECT 1 FROM crawl_urls c WHERE c.site_id = %s AND c.url = u.url)
+        ON CONFLICT DO NOTHING
+    """, (site_id, site_id))
+
+
+def store_edges(cur, site_id, crawl_id, pages):
+    """Replace the outlinks of each ``(url, links)`` page."""
+    cur.execute(LINKS_STAGING_SQL)
+    ingest.copy_records(cur, "crawl_links_staging", ["source", "target"], chain.from_iterable(
+        ((url, link) for link in links) if links else [(url, None)] for url, links in pages))
+    _intern(cur, site_id, "crawl_links_staging", ["source", "target"])
+    cur.execute("""
+        INSERT INTO crawl_links (site_id, source_id, crawl_id, targets)
+        SELECT %s, s.id, %s,
+               COALESCE(array_agg(DISTINCT t.id) FILTER (WHERE t.id <> s.id), '{}')
+        FROM crawl_links_staging l
+        JOIN crawl_urls s ON s.site_id = %s AND s.url = l.source
+        LEFT JOIN crawl_urls t ON t.site_id = %s AND t.url = l.target
+        GROUP BY s.id
+        ON CONFLICT (site_id, source_id) DO UPDATE SET
+            crawl_id = EXCLUDED.crawl_id, targets = EXCLUDED.targets
+    """, (site_id, crawl_id, site_id, site_id))
+    cur.execute("TRUNCATE crawl_links_staging")
+
+
+def delete_site(cur, site_id):
+    for table in ("link_metrics", "link_analyses", "crawl_links", "crawl_urls"):
+        cur.execute(f"DELETE FROM {table} WHERE site_id = %s", (site_id,))
+
+
+class LinkGraph:
+    """A directed graph over ``n`` nodes given as parallel edge arrays."""
+
+    def __init__(self, n, sources, targets):
+        self.n = n
+        self.sources = sources
+        self.targets = targets
+        self.outlinks = np.bincount(sources, minlength=n)
+        self.inlinks = np.bincount(targets, minlength=n)
+
+    def pagerank(self, damping=PAGERANK_DAMPING, tolerance=PAGERANK_TOLERANCE,
+                 max_iterations=PAGERANK_MAX_ITERATIONS):
+        """Returns ``(ranks summing to 1, iterations run)``."""
+        n = self.n
+        if not n:
+            return np.zeros(0), 0
+        rank = np.full(n, 1.0 / n)
+        dangling = self.outlinks == 0
+        out = np.maximum(self.outlinks, 1).astype(np.float64)
+        iterations = 0
+        for iterations in range(1, max_iterations + 1):
+            share = rank / out
+            spread = rank[dangling].sum() / n
+            new = np.bincount(self.targets, weights=share[self.sources], minlength=n)
+            new = damping * (new + spread) + (1.0 - damping) / n
+            delta = np.abs(new - rank).sum()
+            rank = new
+            if delta < tolerance:
+                break
+        return rank, iterations
+
+    def depths(self, root):
+        """Fewest clicks from ``root`` to each node; -1 where unreachable."""
+        depth = np.full(self.n, -1, dtype=np.int32)
+        if root is None:
+            return depth
+        neighbours = self.targets[np.argsort(self.sources)]
+        indptr = np.concatenate(([0], np.cumsum(self.outlinks)))
+        depth[root] = 0
+        frontier = np.array([root])
+        level = 0
+        while len(frontier):
+            starts = indptr[frontier]
+            counts = indptr[frontier + 1] - starts
+            total = int(counts.sum())
+            if not total:
+                break
+            # Concatenated CSR rows of the frontier, without a Python loop
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+            reached = np.zeros(self.n, dtype=bool)
+            reached[neighbours[offsets]] = True
+            frontier = np.flatnonzero(reached & (depth < 0))
+            level += 1
+            depth[frontier] = level
+        return depth
+
+
+def _latest_crawl(cur, site_id):
+    cur.execute("""
+        SELECT id, start_url FROM crawls
+        WHERE site_id = %s AND pages > 0
+        ORDER BY status = 'finished' DESC, id DESC
+        LIMIT 1
+    """, (site_id,))
+    return cur.fetchone()
+
+
+def _gsc_impressions(cur, site_id):
+    """Intern the site's GSC page URLs (normalized like crawled links) and
+    return ``(url ids, total impressions)``."""
+    cur.execute("""
+        SELECT url, SUM(impressions) FROM gsc_rollup_url
+        WHERE site_id = %s AND grain = 'month'
+        GROUP BY url
+        HAVING SUM(impressions) > 0
+    """, (site_id,))
+    rows = [(extractor.absolute_url(url, url), impressions) for url, impressions in cur.fetchall() if url]
+    cur.execute(GSC_STAGING_SQL)
+    ingest.copy_records(cur, "link_gsc_staging", ["url", "impressions"], (r for r in rows if r[0]))
+    _intern(cur, site_id, "link_gsc_staging", ["url"])
+    cur.execute("""
+        SELECT c.id, SUM(g.impressions) FROM link_gsc_staging g
+        JOIN crawl_urls c ON c.site_id = %s AND c.url = g.url
+        GROUP BY c.id
+    """, (site_id,))
+    result = cur.fetchall()
+    cur.execute("TRUNCATE link_gsc_staging")
+    ids = np.fromiter((r[0] for r in result), dtype=np.int64, count=len(result))
+    impressions = np.fromiter((r[1] for r in result), dtype=np.int64, count=len(result))
+    return ids, impressions
+
+
+def _root_id(cur, site_id, start_url):
+    cur.execute("SELECT id FROM crawl_urls WHERE site_id = %s AND url = %s", (site_id, start_url))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _edge_arrays(rows):
+    counts = [len(targets) for _, targets in rows]
+    sources = np.repeat(np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)), counts)
+    targets = np.fromiter(chain.from_iterable(r[1] for r in rows), dtype=np.int64, count=sum(counts))
+    nodes = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    return sources, targets, nodes
+
+
+def _metric_rows(metrics, step=100_000):
+    for start in range(0, len(metrics["url_id"]), step):
+        columns = [metrics[c][start:start + step].tolist() for c in METRIC_COLUMNS]
+        for row in zip(*columns):
+            # Unreachable pages have no click depth
+            yield row if row[4] >= 0 else row[:4] + (None,) + row[5:]
+
+
+def _write_metrics(cur, site_id, crawl_id, metrics, summary):
+    cur.execute("DELETE FROM link_metrics WHERE site_id = %s", (site_id,))
+    cur.execute(METRICS_STAGING_SQL)
+    ingest.copy_records(cur, "link_metrics_staging", METRIC_COLUMNS, _metric_rows(metrics))
+    cur.execute(f"""
+        INSERT INTO link_metrics (site_id, crawl_id, {', '.join(METRIC_COLUMNS)})
+        SELECT %s, %s, {', '.join(METRIC_COLUMNS)} FROM link_metrics_staging
+    """, (site_id, crawl_id))
+    cur.execute("""
+        INSERT INTO link_analyses (site_id, crawl_id, urls, edges, orphans, max_depth,
+                                   iterations, seconds, computed_at)
+        VALUES (%(site_id)s, %(crawl_id)s, %(urls)s, %(edges)s, %(orphans)s, %(max_depth)s,
+                %(iterations)s, %(seconds)s, NOW())
+        ON CONFLICT (site_id) DO UPDATE SET
+            crawl_id = EXCLUDED.crawl_id, urls = EXCLUDED.urls, edges = EXCLUDED.edges,
+            orphans = EXCLUDED.orphans, max_depth = EXCLUDED.max_depth,
+            iterations = EXCLUDED.iterations, seconds = EXCLUDED.seconds, computed_at = NOW()
+    """, dict(summary, site_id=site_id, crawl_id=crawl_id))
+
+
+def _analyze(parts, gsc_ids, impressions, root_id):
+    """Per-URL metric columns and a summary, from ``_edge_arrays`` chunks."""
+    empty = np.zeros(0, dtype=np.int64)
+    sources = np.concatenate([p[0] for p in parts] or [empty])
+    targets = np.concatenate([p[1] for p in parts] or [empty])
+    crawled = np.concatenate([p[2] for p in parts] or [empty])
+
+    # Compact the site's URL ids to 0..n-1
+    ids = np.unique(np.concatenate((crawled, targets, gsc_ids)))
+    graph = LinkGraph(len(ids), np.searchsorted(ids, sources).astype(np.int32),
+                      np.searchsorted(ids, targets).astype(np.int32))
+    del sources, targets, crawled
+
+    rank, iterations = graph.pagerank()
+    root = None
+    if root_id is not None:
+        position = int(np.searchsorted(ids, root_id))
+        if position < len(ids) and ids[position] == root_id:
+            root = position
+    depth = graph.depths(root)
+    shown = np.zeros(len(ids), dtype=np.int64)
+    shown[np.searchsorted(ids, gsc_ids)] = impressions
+    orphan = (shown > 0) & (graph.inlinks == 0)
+    if root is not None:
+        orphan[root] = False
+
+    metrics = {
+        "url_id": ids,
+        "pagerank": rank,
+        "inlinks": graph.inlinks,
+        "outlinks": graph.outlinks,
+        "depth": depth,
+        "impressions": shown,
+        "orphan": orphan,
+    }
+    summary = {
+        "urls": len(ids),
+        "edges": len(graph.targets),
+        "orphans": int(orphan.sum()),
+        "max_depth": int(depth.max()) if len(depth) else 0,
+        "iterations": iterations,
+    }
+    return metrics, summary
+
+
+async def analyze_site(site_id):
+    """Recompute ``link_metrics`` for the site from its latest crawl."""
+    started = time.perf_counter()
+    crawl = await db.run(_latest_crawl, site_id)
+    if not crawl:
+        return {"error": "Site has not been crawled yet"}
+    crawl_id, start_url = crawl
+    await rollups.ensure_site(site_id)
+    gsc_ids, impressions = await db.run(_gsc_impressions, site_id)
+    root_id = await db.run(_root_id, site_id, start_url)
+
+    # Each chunk becomes arrays as it arrives, so rows never pile up as Python objects
+    parts = []
+    async for rows in db.stream(EDGES_SQL, (site_id, crawl_id)):
+        parts.append(await asyncio.to_thread(_edge_arrays, rows))
+    metrics, summary = await asyncio.to_thread(_analyze, parts, gsc_ids, impressions, root_id)
+    del parts
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    await db.run(_write_metrics, site_id, crawl_id, metrics, summary)
+    return dict(summary, crawl_id=crawl_id)
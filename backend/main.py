@@ -1,13 +1,35 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import httpx
 import os
-from urllib.parse import urlencode, quote_plus
+import asyncio
+import base64
+from urllib.parse import urlencode
 import secrets
-from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
+from datetime import datetime
 import json
+from psycopg2.extras import Json
+
+import analytics
+import cannibalization
+import crawler
+import db
+import duplicates
+import export
+import google_api
+import http_client
+import ingest
+import jobs
+import keywords
+import linkgraph
+import opportunities
+import page_cache
+import parse_pool
+import rollups
+import schema
+import serp_cache
+import sitemaps
+import ttl_cache
 
 app = FastAPI(title="SEO Engine API")
 
@@ -32,6 +54,35 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 REDIS_URL = os.getenv("REDIS_URL")
 HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "10"))
+MAX_PAGE_BYTES = int(os.getenv("MAX_PAGE_BYTES", str(3 * 1024 * 1024)))
+GSC_TOTALS_CACHE_SIZE = int(os.getenv("GSC_TOTALS_CACHE_SIZE", "5000"))
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "2"))
+
+_scrape_slots = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+
+@app.on_event("startup")
+async def startup(require_redis=False):
+    db.init_pool(DATABASE_URL)
+    if DATABASE_URL:
+        try:
+            await schema.migrate()
+        except Exception as e:
+            print(f"Schema migration failed: {e}")
+    await http_client.init_client()
+    await parse_pool.start()
+    await page_cache.init(REDIS_URL)
+    await serp_cache.init(REDIS_URL)
+    await jobs.start(REDIS_URL, require_redis=require_redis)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await jobs.stop()
+    await http_client.close_client()
+    await parse_pool.stop()
+    await page_cache.close()
+    await serp_cache.close()
+    db.close_pool()
 
 @app.get("/")
 def read_root():
@@ -50,6 +101,11 @@ def health_check():
         }
     }
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {"page_cache": await page_cache.stats(), "serp_cache": await serp_cache.stats(),
+            "analytics": analytics.stats()}
+
 @app.get("/api/connect")
 async def connect_gsc():
     if not all([GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_REDIRECT_URI]):
@@ -92,96 +148,82 @@ async def oauth_callback(code: str = None, state: str = None, error: str = None)
         del oauth_states[state]
     
     try:
-        async with httpx.AsyncClient() as client:
-            token_response = await client.post(
-                "https://oauth2.googleapis.com/token",
-                data={
-                    "code": code,
-                    "client_id": GOOGLE_CLIENT_ID,
-                    "client_secret": GOOGLE_CLIENT_SECRET,
-                    "redirect_uri": GOOGLE_REDIRECT_URI,
-                    "grant_type": "authorization_code"
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                timeout=30.0
-            )
-            
-            if token_response.status_code != 200:
-                return RedirectResponse(url="https://seo-engine-gold.vercel.app/?oauth_error=token_failed")
-            
-            tokens = token_response.json()
-            
-            if DATABASE_URL:
-                try:
-                    import psycopg2
-                    from psycopg2.extras import Json
-                    
-                    conn = psycopg2.connect(DATABASE_URL)
-                    cur = conn.cursor()
-                    
-                    # FIXED: Delete old connector first, then insert new one
-                    cur.execute("DELETE FROM connectors WHERE type = 'google'")
-                    
-                    cur.execute("""
-                        INSERT INTO connectors (site_id, type, credentials_meta, status)
-                        VALUES (%s, %s, %s, %s)
-                        RETURNING id
-                    """, (
-                        None,
-                        'google',
-                        Json({
-                            'access_token': tokens.get('access_token'),
-                            'refresh_token': tokens.get('refresh_token'),
-                            'token_expiry': tokens.get('expires_in'),
-                            'scopes': tokens.get('scope', '').split()
-                        }),
-                        'active'
-                    ))
-                    
-                    connector_id = cur.fetchone()[0]
-                    conn.commit()
-                    cur.close()
-                    conn.close()
-                    
-                    print(f"SUCCESS: Connector created with ID {connector_id}")
-                    
-                    return RedirectResponse(url=f"https://seo-engine-gold.vercel.app/?oauth_success=true&connector_id={connector_id}")
-                    
-                except Exception as db_error:
-                    print(f"Database error: {db_error}")
-                    import traceback
-                    traceback.print_exc()
-                    return RedirectResponse(url="https://seo-engine-gold.vercel.app/?oauth_error=db_error")
-            else:
-                print("ERROR: DATABASE_URL not configured")
-                return RedirectResponse(url="https://seo-engine-gold.vercel.app/?oauth_error=no_db")
-            
+        client = http_client.get_client()
+        token_response = await client.post(
+            "https://oauth2.googleapis.com/token",
+            data={
+                "code": code,
+                "client_id": GOOGLE_CLIENT_ID,
+                "client_secret": GOOGLE_CLIENT_SECRET,
+                "redirect_uri": GOOGLE_REDIRECT_URI,
+                "grant_type": "authorization_code"
+            },
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=30.0
+        )
+        
+        if token_response.status_code != 200:
+            return RedirectResponse(url="https://seo-engine-gold.vercel.app/?oauth_error=token_failed")
+        
+        tokens = token_response.json()
+        
+        if DATABASE_URL:
+            try:
+                connector_id = await db.run(_store_google_connector, tokens)
+                
+                print(f"SUCCESS: Connector created with ID {connector_id}")
+                
+                return RedirectResponse(url=f"https://seo-engine-gold.vercel.app/?oauth_success=true&connector_id={connector_id}")
+                
+            except Exception as db_error:
+                print(f"Database error: {db_error}")
+                import traceback
+                traceback.print_exc()
+                return RedirectResponse(url="https://seo-engine-gold.vercel.app/?oauth_error=db_error")
+        else:
+            print("ERROR: DATABASE_URL not configured")
+            return RedirectResponse(url="https://seo-engine-gold.vercel.app/?oauth_error=no_db")
+        
     except Exception as e:
         print(f"OAuth error: {e}")
         import traceback
         traceback.print_exc()
         return RedirectResponse(url="https://seo-engine-gold.vercel.app/?oauth_error=exception")
+
+def _store_google_connector(cur, tokens):
+    # FIXED: Delete old connector first, then insert new one
+    cur.execute("DELETE FROM connectors WHERE type = 'google'")
+    
+    cur.execute("""
+        INSERT INTO connectors (site_id, type, credentials_meta, status)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id
+    """, (
+        None,
+        'google',
+        Json({
+            'access_token': tokens.get('access_token'),
+            'refresh_token': tokens.get('refresh_token'),
+            'token_expiry': tokens.get('expires_in'),
+            'scopes': tokens.get('scope', '').split()
+        }),
+        'active'
+    ))
+    
+    return cur.fetchone()[0]
+
 @app.post("/api/sites")
 async def create_site(site_data: dict):
     if not DATABASE_URL:
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("""
+        site = await db.fetchone("""
             INSERT INTO sites (owner_id, domain, sitemap_url, created_at)
             VALUES (%s, %s, %s, NOW())
             RETURNING id, domain, sitemap_url, created_at
         """, (1, site_data.get('domain'), site_data.get('sitemap_url')))
         
-        site = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
-        
         return {
             "success": True,
             "site": {
@@ -200,18 +242,14 @@ async def get_sites():
         return {"sites": []}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("""
+        rows = await db.fetchall("""
             SELECT id, domain, sitemap_url, created_at, last_scan_at
             FROM sites
             ORDER BY created_at DESC
         """)
         
         sites = []
-        for row in cur.fetchall():
+        for row in rows:
             sites.append({
                 "id": row[0],
                 "domain": row[1],
@@ -220,8 +258,6 @@ async def get_sites():
                 "last_scan_at": row[4].isoformat() if row[4] else None
             })
         
-        cur.close()
-        conn.close()
         return {"sites": sites}
     except Exception as e:
         return {"sites": [], "error": str(e)}
@@ -232,25 +268,58 @@ async def delete_site(site_id: int):
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("DELETE FROM gsc_metrics WHERE site_id = %s", (site_id,))
-        cur.execute("DELETE FROM ga4_metrics WHERE site_id = %s", (site_id,))
-        cur.execute("DELETE FROM issues WHERE site_id = %s", (site_id,))
-        cur.execute("DELETE FROM sites WHERE id = %s", (site_id,))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        await db.run(_delete_site_rows, site_id)
         
         return {"success": True, "message": "Site deleted successfully"}
     except Exception as e:
         return {"error": str(e)}
 
+def _delete_site_rows(cur, site_id):
+    cur.execute("DELETE FROM gsc_metrics WHERE site_id = %s", (site_id,))
+    cur.execute("DELETE FROM ga4_metrics WHERE site_id = %s", (site_id,))
+    rollups.delete_site(cur, site_id)
+    analytics.invalidate(site_id)
+    cur.execute("DELETE FROM issues WHERE site_id = %s", (site_id,))
+    cur.execute("DELETE FROM sync_watermarks WHERE site_id = %s", (site_id,))
+    cur.execute("DELETE FROM ga4_dimension_sets WHERE site_id = %s", (site_id,))
+    cur.execute("DELETE FROM site_urls WHERE site_id = %s", (site_id,))
+    cur.execute("DELETE FROM site_sitemaps WHERE site_id = %s", (site_id,))
+    crawler.delete_site(cur, site_id)
+    linkgraph.delete_site(cur, site_id)
+    cannibalization.delete_site(cur, site_id)
+    cur.execute("DELETE FROM sites WHERE id = %s", (site_id,))
+
+async def _no_progress(**fields):
+    pass
+
+async def _enqueue_job(kind, request_data):
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        job = await jobs.enqueue(kind, request_data)
+        return {
+            "success": True,
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": f"/api/jobs/{job['id']}"
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await jobs.get(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job
+
 @app.post("/api/fetch-gsc-data")
 async def fetch_gsc_data(request_data: dict):
+    """Queue a GSC import; poll /api/jobs/{job_id} for the result"""
+    return await _enqueue_job("gsc_import", request_data)
+
+async def run_gsc_import(request_data, progress=_no_progress, client=None):
     site_id = request_data.get('site_id')
     days = request_data.get('days', 90)
     
@@ -258,35 +327,16 @@ async def fetch_gsc_data(request_data: dict):
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        from psycopg2.extras import Json
-        
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("SELECT domain FROM sites WHERE id = %s", (site_id,))
-        site = cur.fetchone()
+        site = await db.fetchone("SELECT domain FROM sites WHERE id = %s", (site_id,))
         
         if not site:
-            cur.close()
-            conn.close()
             return {"error": "Site not found"}
         
         domain = site[0]
         
-        cur.execute("""
-            SELECT credentials_meta 
-            FROM connectors 
-            WHERE type = 'google' AND status = 'active'
-            ORDER BY created_at DESC
-            LIMIT 1
-        """)
-        
-        connector = cur.fetchone()
+        connector = await db.fetchone(GOOGLE_CONNECTOR_SQL)
         
         if not connector:
-            cur.close()
-            conn.close()
             return {
                 "error": "No Google connector found",
                 "solution": "Click 'Connect Google Account' button first."
@@ -296,113 +346,73 @@ async def fetch_gsc_data(request_data: dict):
         access_token = credentials.get('access_token')
         
         if not access_token:
-            cur.close()
-            conn.close()
             return {
                 "error": "No access token",
                 "solution": "Reconnect your Google account."
             }
         
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days)
+        # Incremental by default: only dates since the last sync plus a trailing re-fetch window
+        watermark = None if request_data.get('full') else await db.run(ingest.get_watermark, site_id, 'gsc')
+        start_date, end_date, mode = ingest.sync_window(watermark, days, ingest.GSC_TRAILING_DAYS)
         
         url_formats = [domain]
         if not domain.startswith('http'):
             url_formats = [f"https://{domain}", f"http://{domain}"]
         
         last_error = None
+        imported = None
         
-        async with httpx.AsyncClient() as client:
-            for attempt_url in url_formats:
-                try:
-                    encoded_site_url = quote_plus(attempt_url)
-                    gsc_api_url = f"https://searchconsole.googleapis.com/webmasters/v3/sites/{encoded_site_url}/searchAnalytics/query"
-                    
-                    # Fetch with all dimensions
-                    response = await client.post(
-                        gsc_api_url,
-                        json={
-                            "startDate": start_date.isoformat(),
-                            "endDate": end_date.isoformat(),
-                            "dimensions": ["page", "query", "country", "device", "date"],
-                            "rowLimit": 25000
-                        },
-                        headers={
-                            "Authorization": f"Bearer {access_token}",
-                            "Content-Type": "application/json"
-                        },
-                        timeout=60.0
-                    )
-                    
-                    if response.status_code == 200:
-                        gsc_data = response.json()
-                        rows = gsc_data.get('rows', [])
-                        
-                        if len(rows) == 0:
-                            cur.close()
-                            conn.close()
-                            return {
-                                "success": True,
-                                "rows_imported": 0,
-                                "message": f"No data found for {attempt_url}. Site may not have search traffic yet.",
-                                "date_range": f"{start_date} to {end_date}"
-                            }
-                        
-                        # Clear old data for this date range
-                        cur.execute("""
-                            DELETE FROM gsc_metrics 
-                            WHERE site_id = %s AND date >= %s AND date <= %s
-                        """, (site_id, start_date, end_date))
-                        
-                        for row in rows:
-                            keys = row.get('keys', [])
-                            page_url = keys[0] if len(keys) > 0 else None
-                            query = keys[1] if len(keys) > 1 else None
-                            country = keys[2] if len(keys) > 2 else None
-                            device = keys[3] if len(keys) > 3 else None
-                            date = keys[4] if len(keys) > 4 else None
-                            
-                            cur.execute("""
-                                INSERT INTO gsc_metrics 
-                                (site_id, url, query, country, device, impressions, clicks, ctr, position, date)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                ON CONFLICT DO NOTHING
-                            """, (
-                                site_id,
-                                page_url,
-                                query,
-                                country,
-                                device,
-                                row.get('impressions', 0),
-                                row.get('clicks', 0),
-                                row.get('ctr', 0.0),
-                                row.get('position', 0.0),
-                                date or datetime.now().date()
-                            ))
-                        
-                        conn.commit()
-                        cur.execute("UPDATE sites SET last_scan_at = NOW() WHERE id = %s", (site_id,))
-                        conn.commit()
-                        
-                        cur.close()
-                        conn.close()
-                        
-                        return {
-                            "success": True,
-                            "rows_imported": len(rows),
-                            "message": f"✅ Successfully imported {len(rows)} rows from GSC",
-                            "date_range": f"{start_date} to {end_date}",
-                            "days": days
-                        }
-                    else:
-                        last_error = {"url": attempt_url, "status": response.status_code, "details": response.text}
-                        
-                except Exception as e:
-                    last_error = {"url": attempt_url, "error": str(e)}
-                    continue
-        
-        cur.close()
-        conn.close()
+        client = client or http_client.get_client()
+        for attempt_url in url_formats:
+            try:
+                stats = ingest.IngestStats()
+                
+                # Shards are fetched concurrently and ingested page by page as they arrive
+                async for rows in google_api.stream_gsc_rows(
+                    client, attempt_url, access_token, start_date, end_date,
+                    shard_days=request_data.get('shard_days'),
+                    concurrency=request_data.get('concurrency')
+                ):
+                    await db.run(ingest.ingest_gsc, site_id, rows, stats, datetime.now().date())
+                    await progress(rows_imported=stats.rows, rows_per_sec=stats.rows_per_sec)
+                
+                if stats.rows == 0:
+                    return {
+                        "success": True,
+                        "rows_imported": 0,
+                        "message": f"No data found for {attempt_url}. Site may not have search traffic yet.",
+                        "date_range": f"{start_date} to {end_date}",
+                        "mode": mode
+                    }
+                
+                await db.run(_finish_sync, site_id, 'gsc', stats.max_date)
+                analytics.invalidate(site_id)
+                imported = {
+                    "success": True,
+                    "rows_imported": stats.rows,
+                    "message": f"✅ Successfully imported {stats.rows} rows from GSC",
+                    "date_range": f"{start_date} to {end_date}",
+                    "days": days,
+                    "mode": mode,
+                    "rows_per_sec": stats.rows_per_sec
+                }
+                break
+            
+            except google_api.GoogleAPIError as e:
+                last_error = {"url": attempt_url, "status": e.status, "details": e.details}
+            except Exception as e:
+                last_error = {"url": attempt_url, "error": str(e)}
+                continue
+        
+        if imported:
+            # Only the queries this import touched are re-checked; the import stands if this fails
+            await progress(stage="cannibalization")
+            try:
+                imported["cannibalization"] = await cannibalization.analyze_site(site_id)
+            except Exception as e:
+                print(f"Cannibalization refresh failed for site {site_id}: {e}")
+                imported["cannibalization"] = {"error": str(e)}
+            return imported
         
         if last_error:
             status_code = last_error.get('status', 0)
@@ -447,8 +457,25 @@ Tried: {', '.join(url_formats)}"""
     except Exception as e:
         return {"error": str(e), "solution": "Server error. Try again."}
 
+GOOGLE_CONNECTOR_SQL = """
+    SELECT credentials_meta 
+    FROM connectors 
+    WHERE type = 'google' AND status = 'active'
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+
+def _finish_sync(cur, site_id, source, high_water_date):
+    if high_water_date:
+        ingest.set_watermark(cur, site_id, source, high_water_date)
+    cur.execute("UPDATE sites SET last_scan_at = NOW() WHERE id = %s", (site_id,))
+
 @app.post("/api/fetch-ga4-data")
 async def fetch_ga4_data(request_data: dict):
+    """Queue a GA4 import; poll /api/jobs/{job_id} for the result"""
+    return await _enqueue_job("ga4_import", request_data)
+
+async def run_ga4_import(request_data, progress=_no_progress, client=None):
     """Fetch GA4 data for cross-analysis"""
     site_id = request_data.get('site_id')
     property_id = request_data.get('property_id')  # GA4 Property ID
@@ -458,185 +485,531 @@ async def fetch_ga4_data(request_data: dict):
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT credentials_meta 
-            FROM connectors 
-            WHERE type = 'google' AND status = 'active'
-            ORDER BY created_at DESC
-            LIMIT 1
-        """)
-        
-        connector = cur.fetchone()
+        connector = await db.fetchone(GOOGLE_CONNECTOR_SQL)
         
         if not connector:
-            cur.close()
-            conn.close()
             return {"error": "No Google connector found"}
         
         credentials = connector[0]
         access_token = credentials.get('access_token')
         
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days)
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"https://analyticsdata.googleapis.com/v1beta/properties/{property_id}:runReport",
-                json={
-                    "dateRanges": [{"startDate": start_date.isoformat(), "endDate": end_date.isoformat()}],
-                    "dimensions": [
-                        {"name": "pagePath"},
-                        {"name": "date"},
-                        {"name": "country"},
-                        {"name": "deviceCategory"}
-                    ],
-                    "metrics": [
-                        {"name": "sessions"},
-                        {"name": "totalUsers"},
-                        {"name": "screenPageViews"},
-                        {"name": "averageSessionDuration"},
-                        {"name": "bounceRate"},
-                        {"name": "conversions"}
-                    ],
-                    "limit": 25000
-                },
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type": "application/json"
-                },
-                timeout=60.0
-            )
+        watermark = None if request_data.get('full') else await db.run(ingest.get_watermark, site_id, 'ga4')
+        start_date, end_date, mode = ingest.sync_window(watermark, days, ingest.GA4_TRAILING_DAYS)
+        
+        # Only the dimensions the caller asked for (pagePath and date are always included)
+        dimensions = google_api.ga4_dimensions(request_data.get('dimensions'))
+        try:
+            await db.run(ingest.pin_ga4_dimensions, site_id, dimensions)
+        except ValueError as e:
+            return {"error": str(e), "dimensions": dimensions}
+        
+        client = client or http_client.get_client()
+        stats = ingest.IngestStats()
+        
+        try:
+            async for rows in google_api.stream_ga4_rows(
+                client, property_id, access_token, start_date, end_date, dimensions,
+                shard_days=request_data.get('shard_days'),
+                concurrency=request_data.get('concurrency')
+            ):
+                await db.run(ingest.ingest_ga4, site_id, rows, stats, dimensions)
+                await progress(rows_imported=stats.rows, rows_per_sec=stats.rows_per_sec)
+        except google_api.GoogleAPIError as e:
+            return {"error": f"GA4 API failed: {e.status}", "details": e.details}
+        
+        if stats.max_date:
+            await db.run(ingest.set_watermark, site_id, 'ga4', stats.max_date)
+        
+        return {
+            "success": True,
+            "rows_imported": stats.rows,
+            "message": f"✅ Successfully imported {stats.rows} rows from GA4",
+            "date_range": f"{start_date} to {end_date}",
+            "mode": mode,
+            "dimensions": dimensions,
+            "rows_per_sec": stats.rows_per_sec
+        }
             
-            if response.status_code == 200:
-                ga4_data = response.json()
-                rows = ga4_data.get('rows', [])
-                
-                # Clear old GA4 data
-                cur.execute("""
-                    DELETE FROM ga4_metrics 
-                    WHERE site_id = %s AND date >= %s AND date <= %s
-                """, (site_id, start_date, end_date))
-                
-                for row in rows:
-                    dimensions = row.get('dimensionValues', [])
-                    metrics = row.get('metricValues', [])
-                    
-                    if len(dimensions) >= 4 and len(metrics) >= 6:
-                        cur.execute("""
-                            INSERT INTO ga4_metrics 
-                            (site_id, page_path, date, country, device, sessions, users, pageviews, 
-                             avg_session_duration, bounce_rate, conversions)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT DO NOTHING
-                        """, (
-                            site_id,
-                            dimensions[0].get('value'),
-                            dimensions[1].get('value'),
-                            dimensions[2].get('value'),
-                            dimensions[3].get('value'),
-                            int(metrics[0].get('value', 0)),
-                            int(metrics[1].get('value', 0)),
-                            int(metrics[2].get('value', 0)),
-                            float(metrics[3].get('value', 0)),
-                            float(metrics[4].get('value', 0)),
-                            float(metrics[5].get('value', 0))
-                        ))
-                
-                conn.commit()
-                cur.close()
-                conn.close()
-                
-                return {
-                    "success": True,
-                    "rows_imported": len(rows),
-                    "message": f"✅ Successfully imported {len(rows)} rows from GA4",
-                    "date_range": f"{start_date} to {end_date}"
-                }
-            else:
-                return {"error": f"GA4 API failed: {response.status_code}", "details": response.text}
-                
     except Exception as e:
         return {"error": str(e)}
 
-@app.get("/api/gsc-data/{site_id}")
-async def get_gsc_data(site_id: int, page: int = 1, per_page: int = 50, 
-                       filter_device: str = None, filter_country: str = None,
-                       start_date: str = None, end_date: str = None):
+GSC_ROWS_SQL = """
+    SELECT id, url, query, country, device, impressions, clicks, ctr, position, date
+    FROM gsc_metrics
+    WHERE site_id = %s{filters}
+    ORDER BY impressions DESC, id DESC
+    LIMIT %s{offset}
+"""
+
+# (site_id, filters) -> (sites.last_scan_at, total); every sync bumps last_scan_at
+_gsc_totals = ttl_cache.TTLCache(GSC_TOTALS_CACHE_SIZE, 24 * 3600)
+
+def _encode_cursor(impressions, row_id):
+    return base64.urlsafe_b64encode(json.dumps([impressions, row_id]).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    impressions, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    return int(impressions), int(row_id)
+
+def _gsc_filters(filter_device, filter_country, start_date, end_date):
+    clauses, params = [], []
+    for clause, value in (("device = %s", filter_device), ("country = %s", filter_country),
+                          ("date >= %s", start_date), ("date <= %s", end_date)):
+        if value:
+            clauses.append(clause)
+            params.append(value)
+    return "".join(f" AND {c}" for c in clauses), params
+
+async def _gsc_total(site_id, filters, params):
+    """Rows matching the filters, recounted only after the site's data changed"""
+    scan = await db.fetchone("SELECT last_scan_at FROM sites WHERE id = %s", (site_id,))
+    last_scan_at = scan[0] if scan else None
+    key = (site_id, filters, tuple(params))
+    cached = _gsc_totals.get(key)
+    if cached and cached[0] == last_scan_at:
+        return cached[1]
+    total = (await db.fetchone(
+        f"SELECT COUNT(*) FROM gsc_metrics WHERE site_id = %s{filters}", (site_id, *params)
+    ))[0]
+    _gsc_totals.set(key, (last_scan_at, total))
+    return total
+
+@app.post("/api/fetch-sitemap")
+async def fetch_sitemap(request_data: dict):
+    """Queue a sitemap import into the site's URL inventory; poll /api/jobs/{job_id}"""
+    return await _enqueue_job("sitemap_import", request_data)
+
+async def run_sitemap_import(request_data, progress=_no_progress, client=None):
+    site_id = request_data.get('site_id')
+    
     if not DATABASE_URL:
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
+        site = await db.fetchone("SELECT domain, sitemap_url FROM sites WHERE id = %s", (site_id,))
+        if not site:
+            return {"error": "Site not found"}
         
-        # Build dynamic query
-        query = """
-            SELECT 
-                url,
-                query,
-                country,
-                device,
-                SUM(impressions) as total_impressions,
-                SUM(clicks) as total_clicks,
-                AVG(ctr) as avg_ctr,
-                AVG(position) as avg_position,
-                date
-            FROM gsc_metrics
-            WHERE site_id = %s
-        """
-        params = [site_id]
+        domain, sitemap_url = site
+        sitemap_url = request_data.get('sitemap_url') or sitemap_url
+        if not sitemap_url:
+            base = domain if domain.startswith('http') else f"https://{domain}"
+            sitemap_url = f"{base.rstrip('/')}/sitemap.xml"
         
-        if filter_device:
-            query += " AND device = %s"
-            params.append(filter_device)
+        client = client or http_client.get_client()
+        result = await sitemaps.ingest_site(site_id, sitemap_url, client, progress)
         
-        if filter_country:
-            query += " AND country = %s"
-            params.append(filter_country)
+        if not result["sitemaps_fetched"] and result["errors"]:
+            return {"error": f"Sitemap fetch failed: {result['errors'][0]['error']}", **result}
         
-        if start_date:
-            query += " AND date >= %s"
-            params.append(start_date)
+        return {
+            "success": True,
+            "sitemap_url": sitemap_url,
+            "message": f"✅ {result['urls_seen']} URLs from {result['sitemaps_fetched']} sitemap(s)",
+            **result
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/api/site-urls/{site_id}")
+async def get_site_urls(site_id: int, per_page: int = 100, after: str = None,
+                        changed_since: str = None):
+    """The site's URL inventory in url order; pass the returned ``next_after``
+    to continue. ``changed_since`` keeps URLs whose lastmod changed after it."""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        filters, params = "", [site_id, after or ""]
+        if changed_since:
+            filters = " AND changed_at >= %s"
+            params.append(changed_since)
+        params.append(per_page)
+        
+        rows = await db.fetchall(f"""
+            SELECT url, lastmod, sitemap_url, first_seen_at, changed_at
+            FROM site_urls
+            WHERE site_id = %s AND url > %s{filters}
+            ORDER BY url
+            LIMIT %s
+        """, tuple(params))
+        
+        urls = []
+        for row in rows:
+            urls.append({
+                "url": row[0],
+                "lastmod": row[1].isoformat() if row[1] else None,
+                "sitemap_url": row[2],
+                "first_seen_at": row[3].isoformat(),
+                "changed_at": row[4].isoformat()
+            })
         
-        if end_date:
-            query += " AND date <= %s"
-            params.append(end_date)
+        return {
+            "urls": urls,
+            "count": len(urls),
+            "next_after": rows[-1][0] if len(rows) == per_page else None
+        }
+    except Exception as e:
+        return {"error": str(e), "urls": []}
+
+@app.post("/api/crawl-site")
+async def crawl_site(request_data: dict):
+    """Queue a crawl of the site (or resume its unfinished one); poll /api/jobs/{job_id}"""
+    return await _enqueue_job("site_crawl", request_data)
+
+async def run_site_crawl(request_data, progress=_no_progress, client=None):
+    site_id = request_data.get('site_id')
+    
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        site = await db.fetchone("SELECT domain FROM sites WHERE id = %s", (site_id,))
+        if not site:
+            return {"error": "Site not found"}
         
-        query += """
-            GROUP BY url, query, country, device, date
-            ORDER BY total_impressions DESC
-            LIMIT %s OFFSET %s
-        """
-        params.extend([per_page, (page - 1) * per_page])
+        start_url = request_data.get('start_url')
+        if not start_url:
+            domain = site[0]
+            start_url = domain if domain.startswith('http') else f"https://{domain}/"
         
-        cur.execute(query, tuple(params))
+        client = client or http_client.get_client()
+        result = await crawler.crawl_site(site_id, start_url, client,
+                                          max_pages=request_data.get('max_pages'), progress=progress,
+                                          max_depth=request_data.get('max_depth'))
+        await progress(stage="link_analysis")
+        result["link_graph"] = await linkgraph.analyze_site(site_id)
+        
+        return {
+            "success": True,
+            "start_url": start_url,
+            "message": f"✅ Crawled {result['pages_this_run']} pages ({result['pages_per_sec']} pages/sec)",
+            **result
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/api/crawls/{site_id}")
+async def get_crawls(site_id: int, limit: int = 10):
+    """The site's most recent crawls with their throughput"""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        rows = await db.fetchall("""
+            SELECT id, status, start_url, max_pages, pages, errors, discovered, seconds,
+                   started_at, updated_at, finished_at
+            FROM crawls
+            WHERE site_id = %s
+            ORDER BY id DESC
+            LIMIT %s
+        """, (site_id, limit))
+        
+        crawls = []
+        for row in rows:
+            crawls.append({
+                "id": row[0],
+                "status": row[1],
+                "start_url": row[2],
+                "max_pages": row[3],
+                "pages": row[4],
+                "errors": row[5],
+                "urls_discovered": row[6],
+                "seconds": round(row[7], 1),
+                "pages_per_sec": round(row[4] / row[7], 1) if row[7] else 0.0,
+                "started_at": row[8].isoformat(),
+                "updated_at": row[9].isoformat(),
+                "finished_at": row[10].isoformat() if row[10] else None
+            })
+        
+        return {"crawls": crawls}
+    except Exception as e:
+        return {"error": str(e), "crawls": []}
+
+@app.get("/api/crawl-pages/{site_id}")
+async def get_crawl_pages(site_id: int, per_page: int = 100, after: str = None,
+                          status_code: int = None, errors_only: bool = False):
+    """Crawled pages in url order; pass the returned ``next_after`` to continue"""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        filters, params = "", [site_id, after or ""]
+        if status_code is not None:
+            filters += " AND status_code = %s"
+            params.append(status_code)
+        if errors_only:
+            filters += " AND (error IS NOT NULL OR status_code >= 400)"
+        params.append(per_page)
+        
+        rows = await db.fetchall(f"""
+            SELECT url, depth, status_code, final_url, redirects, canonical, meta_robots,
+                   title, meta_desc, h1, h1_count, word_count, internal_links, external_links,
+                   content_type, bytes, response_ms, error, fetched_at
+            FROM crawl_pages
+            WHERE site_id = %s AND url > %s{filters}
+            ORDER BY url
+            LIMIT %s
+        """, tuple(params))
         
         pages = []
-        for row in cur.fetchall():
+        for row in rows:
             pages.append({
                 "url": row[0],
-                "query": row[1],
-                "country": row[2],
-                "device": row[3],
-                "impressions": int(row[4] or 0),
-                "clicks": int(row[5] or 0),
-                "ctr": float(row[6] or 0),
-                "position": float(row[7] or 0),
-                "date": row[8].isoformat() if row[8] else None
+                "depth": row[1],
+                "status_code": row[2],
+                "final_url": row[3],
+                "redirects": row[4],
+                "canonical": row[5],
+                "meta_robots": row[6],
+                "title": row[7],
+                "meta_desc": row[8],
+                "h1": row[9],
+                "h1_count": row[10],
+                "word_count": row[11],
+                "internal_links": row[12],
+                "external_links": row[13],
+                "content_type": row[14],
+                "bytes": row[15],
+                "response_ms": row[16],
+                "error": row[17],
+                "fetched_at": row[18].isoformat()
             })
         
-        # Get total count
-        count_query = "SELECT COUNT(DISTINCT url) FROM gsc_metrics WHERE site_id = %s"
-        cur.execute(count_query, (site_id,))
-        total = cur.fetchone()[0]
+        return {
+            "pages": pages,
+            "count": len(pages),
+            "next_after": rows[-1][0] if len(rows) == per_page else None
+        }
+    except Exception as e:
+        return {"error": str(e), "pages": []}
+
+@app.post("/api/link-analysis")
+async def link_analysis(request_data: dict):
+    """Queue a link graph analysis of the site's latest crawl; poll /api/jobs/{job_id}"""
+    return await _enqueue_job("link_analysis", request_data)
+
+async def run_link_analysis(request_data, progress=_no_progress, client=None):
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        result = await linkgraph.analyze_site(request_data.get('site_id'))
+        if result.get("error"):
+            return result
+        return {"success": True, **result}
+    except Exception as e:
+        return {"error": str(e)}
+
+LINK_GRAPH_SORTS = {
+    "pagerank": "m.pagerank DESC",
+    "inlinks": "m.inlinks DESC, m.pagerank DESC",
+    "depth": "m.depth DESC NULLS FIRST, m.pagerank DESC",
+    "impressions": "m.impressions DESC, m.pagerank DESC",
+}
+
+@app.get("/api/link-graph/{site_id}")
+async def get_link_graph(site_id: int, sort: str = "pagerank", orphans_only: bool = False,
+                         url: str = None, limit: int = 100):
+    """Internal PageRank, inlinks, click depth and orphan status per URL"""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    if sort not in LINK_GRAPH_SORTS:
+        return {"error": f"sort must be one of {', '.join(LINK_GRAPH_SORTS)}"}
+    
+    try:
+        summary = await db.fetchone("""
+            SELECT crawl_id, urls, edges, orphans, max_depth, iterations, seconds, computed_at
+            FROM link_analyses WHERE site_id = %s
+        """, (site_id,))
+        if not summary:
+            return {"error": "No link analysis yet; crawl the site first", "urls": []}
+        
+        filters, params = "", [site_id]
+        if orphans_only:
+            filters += " AND m.orphan"
+        if url:
+            filters += " AND u.url = %s"
+            params.append(url)
+        params.append(limit)
+        
+        rows = await db.fetchall(f"""
+            SELECT u.url, m.pagerank, m.inlinks, m.outlinks, m.depth, m.impressions, m.orphan
+            FROM link_metrics m
+            JOIN crawl_urls u ON u.id = m.url_id
+            WHERE m.site_id = %s{filters}
+            ORDER BY {LINK_GRAPH_SORTS[sort]}
+            LIMIT %s
+        """, tuple(params))
+        
+        urls = []
+        for row in rows:
+            urls.append({
+                "url": row[0],
+                # 1.0 is the rank every page would have if links were spread evenly
+                "pagerank": round(row[1] * summary[1], 4),
+                "inlinks": row[2],
+                "outlinks": row[3],
+                "click_depth": row[4],
+                "impressions": row[5],
+                "orphan": row[6]
+            })
         
-        cur.close()
-        conn.close()
+        return {
+            "crawl_id": summary[0],
+            "summary": {
+                "urls": summary[1],
+                "edges": summary[2],
+                "orphans": summary[3],
+                "max_depth": summary[4],
+                "iterations": summary[5],
+                "seconds": summary[6],
+                "computed_at": summary[7].isoformat()
+            },
+            "urls": urls
+        }
+    except Exception as e:
+        return {"error": str(e), "urls": []}
+
+@app.get("/api/duplicates/{site_id}")
+async def get_duplicates(site_id: int, min_similarity: float = duplicates.DUPLICATE_SIMILARITY,
+                         limit: int = 50, thin_words: int = duplicates.THIN_CONTENT_WORDS):
+    """Near-duplicate page groups (estimated shingle similarity) and thin pages from the crawl"""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    if not 0.5 <= min_similarity <= 1:
+        return {"error": "min_similarity must be between 0.5 and 1"}
+    
+    try:
+        return await duplicates.analyze_site(site_id, threshold=min_similarity, limit=limit, thin_words=thin_words)
+    except Exception as e:
+        return {"error": str(e), "groups": [], "thin_pages": []}
+
+@app.post("/api/cannibalization")
+async def cannibalization_analysis(request_data: dict):
+    """Queue a keyword cannibalization refresh (``full`` recomputes every query); poll /api/jobs/{job_id}"""
+    return await _enqueue_job("cannibalization", request_data)
+
+async def run_cannibalization(request_data, progress=_no_progress, client=None):
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        result = await cannibalization.analyze_site(request_data.get('site_id'), full=bool(request_data.get('full')))
+        if result.get("error"):
+            return result
+        return {"success": True, **result}
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/api/cannibalization/{site_id}")
+async def get_cannibalization(site_id: int, limit: int = 50, query: str = None, url: str = None):
+    """Queries for which several of the site's URLs split impressions, ranked by click loss"""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    limit = max(1, min(limit, 1000))
+    
+    try:
+        run = await db.fetchone("""
+            SELECT mode, window_start, queries_changed, conflicts, click_loss, seconds, computed_at
+            FROM cannibalization_runs WHERE site_id = %s
+        """, (site_id,))
+        if not run:
+            return {"error": "No cannibalization analysis yet; import GSC data first", "conflicts": []}
+        
+        filters, params = "", [site_id]
+        if query:
+            filters += " AND query = %s"
+            params.append(query)
+        if url:
+            filters += " AND competitors @> %s::jsonb"
+            params.append(json.dumps([{"url": url}]))
+        params.append(limit)
+        
+        rows = await db.fetchall(f"""
+            SELECT query, urls, impressions, clicks, click_loss, primary_url, competitors, computed_at
+            FROM cannibalization
+            WHERE site_id = %s{filters}
+            ORDER BY click_loss DESC
+            LIMIT %s
+        """, tuple(params))
+        
+        conflicts = []
+        for row in rows:
+            conflicts.append({
+                "query": row[0],
+                "urls": row[1],
+                "impressions": row[2],
+                "clicks": row[3],
+                "click_loss": round(row[4], 1),
+                "primary_url": row[5],
+                "competitors": row[6],
+                "computed_at": row[7].isoformat()
+            })
+        
+        return {
+            "summary": {
+                "mode": run[0],
+                "window_start": run[1].isoformat(),
+                "queries_changed": run[2],
+                "conflicts": run[3],
+                "click_loss": run[4],
+                "seconds": run[5],
+                "computed_at": run[6].isoformat()
+            },
+            "conflicts": conflicts
+        }
+    except Exception as e:
+        return {"error": str(e), "conflicts": []}
+
+@app.get("/api/gsc-data/{site_id}")
+async def get_gsc_data(site_id: int, page: int = 1, per_page: int = 50, 
+                       filter_device: str = None, filter_country: str = None,
+                       start_date: str = None, end_date: str = None, cursor: str = None):
+    """Rows by impressions. Pass the returned ``next_cursor`` to get the next
+    page at constant cost; ``page`` still works but costs an OFFSET scan."""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    try:
+        filters, params = _gsc_filters(filter_device, filter_country, start_date, end_date)
+        row_filters = filters
+        row_params = [site_id, *params]
+        offset = ""
+        if cursor:
+            try:
+                last_impressions, last_id = _decode_cursor(cursor)
+            except Exception:
+                return {"error": "Invalid cursor", "pages": [], "count": 0}
+            # Row comparison walks the (site_id, impressions, id) index from the cursor
+            row_filters += " AND (impressions, id) < (%s, %s)"
+            row_params.extend([last_impressions, last_id])
+        elif page > 1:
+            offset = " OFFSET %s"
+        row_params.append(per_page)
+        if offset:
+            row_params.append((page - 1) * per_page)
+        
+        rows = await db.fetchall(GSC_ROWS_SQL.format(filters=row_filters, offset=offset),
+                                 tuple(row_params))
+        
+        pages = []
+        for row in rows:
+            pages.append({
+                "url": row[1],
+                "query": row[2],
+                "country": row[3],
+                "device": row[4],
+                "impressions": int(row[5] or 0),
+                "clicks": int(row[6] or 0),
+                "ctr": float(row[7] or 0),
+                "position": float(row[8] or 0),
+                "date": row[9].isoformat() if row[9] else None
+            })
+        
+        total = await _gsc_total(site_id, filters, params)
+        next_cursor = _encode_cursor(rows[-1][5], rows[-1][0]) if len(rows) == per_page else None
         
         return {
             "pages": pages,
@@ -644,11 +1017,156 @@ async def get_gsc_data(site_id: int, page: int = 1, per_page: int = 50,
             "total": total,
             "page": page,
             "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page
+            "total_pages": (total + per_page - 1) // per_page,
+            "next_cursor": next_cursor
         }
     except Exception as e:
         return {"error": str(e), "pages": [], "count": 0}
 
+GSC_TREND_TABLES = {
+    (False, False): "gsc_rollup_site",
+    (True, False): "gsc_rollup_url",
+    (False, True): "gsc_rollup_query",
+    (True, True): "gsc_rollup_url_query",
+}
+
+@app.get("/api/gsc-trend/{site_id}")
+async def get_gsc_trend(site_id: int, grain: str = "day", url: str = None, query: str = None,
+                        start_date: str = None, end_date: str = None):
+    """Impressions, clicks, CTR and position per day, week or month for the
+    whole site, one url, one query or one url + query, read from the rollups"""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    if grain not in rollups.GRAINS:
+        return {"error": f"grain must be one of {', '.join(rollups.GRAINS)}", "series": []}
+    
+    try:
+        await rollups.ensure_site(site_id)
+        table = GSC_TREND_TABLES[(bool(url), bool(query))]
+        clauses, params = [], [site_id, grain]
+        if url:
+            clauses.append("url = %s")
+            params.append(url)
+        if query:
+            clauses.append("query = %s")
+            params.append(query)
+        if start_date:
+            # Include the whole period start_date falls in
+            clauses.append("period_start >= date_trunc(%s, %s::timestamp)::date")
+            params.extend([grain, start_date])
+        if end_date:
+            clauses.append("period_start <= %s")
+            params.append(end_date)
+        
+        rows = await db.fetchall(f"""
+            SELECT period_start, impressions, clicks,
+                   ctr_weighted / NULLIF(impressions, 0),
+                   position_weighted / NULLIF(impressions, 0)
+            FROM {table}
+            WHERE site_id = %s AND grain = %s{''.join(f' AND {c}' for c in clauses)}
+            ORDER BY period_start
+        """, tuple(params))
+        
+        series = []
+        for row in rows:
+            series.append({
+                "period_start": row[0].isoformat(),
+                "impressions": int(row[1]),
+                "clicks": int(row[2]),
+                "ctr": float(row[3] or 0),
+                "position": float(row[4] or 0)
+            })
+        
+        return {"grain": grain, "series": series, "count": len(series)}
+    except Exception as e:
+        return {"error": str(e), "series": []}
+
+@app.get("/api/gsc-analytics/{site_id}")
+async def get_gsc_analytics(site_id: int, group_by: str = None, sort: str = "impressions",
+                            limit: int = 50, filter_device: str = None, filter_country: str = None,
+                            url: str = None, query: str = None,
+                            start_date: str = None, end_date: str = None):
+    """Slice a site's GSC rows by any filter combination, optionally grouped
+    by url, query, country, device or date. Served from the in-memory
+    columnar copy when the analytics cache is enabled."""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    if group_by is not None and group_by not in analytics.GROUPS:
+        return {"error": f"group_by must be one of {', '.join(analytics.GROUPS)}", "rows": []}
+    if sort not in analytics.SORTS:
+        return {"error": f"sort must be one of {', '.join(analytics.SORTS)}", "rows": []}
+    limit = max(1, min(limit, 1000))
+    
+    try:
+        frame = await analytics.get_frame(site_id) if analytics.enabled() else None
+        if frame is None:
+            rows = await _gsc_analytics_sql(site_id, group_by, sort, limit, filter_device,
+                                            filter_country, url, query, start_date, end_date)
+            return {"rows": rows, "count": len(rows), "source": "database"}
+        
+        def run_slice():
+            mask = frame.mask(device=filter_device, country=filter_country, url=url, query=query,
+                              start_date=start_date, end_date=end_date)
+            if group_by:
+                return frame.group(group_by, mask, limit, sort)
+            return frame.top_rows(mask, limit, sort)
+        
+        # NumPy releases the GIL for the heavy passes; keep them off the event loop
+        rows = await asyncio.to_thread(run_slice)
+        return {"rows": rows, "count": len(rows), "source": "memory"}
+    except Exception as e:
+        return {"error": str(e), "rows": []}
+
+async def _gsc_analytics_sql(site_id, group_by, sort, limit, filter_device, filter_country,
+                             url, query, start_date, end_date):
+    filters, params = _gsc_filters(filter_device, filter_country, start_date, end_date)
+    for column, value in (("url", url), ("query", query)):
+        if value:
+            filters += f" AND {column} = %s"
+            params.append(value)
+    
+    if not group_by:
+        rows = await db.fetchall(f"""
+            SELECT url, query, country, device, impressions, clicks, ctr, position, date
+            FROM gsc_metrics
+            WHERE site_id = %s{filters}
+            ORDER BY {sort} DESC
+            LIMIT %s
+        """, (site_id, *params, limit))
+        return [{
+            "url": row[0],
+            "query": row[1],
+            "country": row[2],
+            "device": row[3],
+            "impressions": int(row[4] or 0),
+            "clicks": int(row[5] or 0),
+            "ctr": float(row[6] or 0),
+            "position": float(row[7] or 0),
+            "date": row[8].isoformat() if row[8] else None
+        } for row in rows]
+    
+    rows = await db.fetchall(f"""
+        SELECT {group_by}, SUM(impressions) AS impressions, SUM(clicks) AS clicks,
+               {rollups.weighted('ctr * impressions', 'impressions')},
+               {rollups.weighted('position * impressions', 'impressions')},
+               COUNT(*)
+        FROM gsc_metrics
+        WHERE site_id = %s{filters}{' AND date IS NOT NULL' if group_by == 'date' else ''}
+        GROUP BY 1
+        ORDER BY {sort} DESC
+        LIMIT %s
+    """, (site_id, *params, limit))
+    return [{
+        group_by: row[0].isoformat() if group_by == "date" else row[0],
+        "impressions": int(row[1]),
+        "clicks": int(row[2]),
+        "ctr": float(row[3]),
+        "position": float(row[4]),
+        "rows": int(row[5])
+    } for row in rows]
+
 @app.get("/api/ga4-data/{site_id}")
 async def get_ga4_data(site_id: int, page: int = 1, per_page: int = 50):
     """Get GA4 data for comparison"""
@@ -656,28 +1174,26 @@ async def get_ga4_data(site_id: int, page: int = 1, per_page: int = 50):
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("""
+        await rollups.ensure_site(site_id)
+        # Monthly rollup rows: a few per page instead of one per page, day, country and device
+        rows = await db.fetchall(f"""
             SELECT 
                 page_path,
                 SUM(sessions) as total_sessions,
                 SUM(users) as total_users,
                 SUM(pageviews) as total_pageviews,
-                AVG(avg_session_duration) as avg_duration,
-                AVG(bounce_rate) as avg_bounce_rate,
+                {rollups.weighted('duration_weighted', 'sessions')} as avg_duration,
+                {rollups.weighted('bounce_weighted', 'sessions')} as avg_bounce_rate,
                 SUM(conversions) as total_conversions
-            FROM ga4_metrics
-            WHERE site_id = %s
+            FROM ga4_rollup_page
+            WHERE site_id = %s AND grain = 'month'
             GROUP BY page_path
             ORDER BY total_sessions DESC
             LIMIT %s OFFSET %s
         """, (site_id, per_page, (page - 1) * per_page))
         
         pages = []
-        for row in cur.fetchall():
+        for row in rows:
             pages.append({
                 "page_path": row[0],
                 "sessions": int(row[1] or 0),
@@ -688,15 +1204,16 @@ async def get_ga4_data(site_id: int, page: int = 1, per_page: int = 50):
                 "conversions": float(row[6] or 0)
             })
         
-        cur.close()
-        conn.close()
-        
         return {"pages": pages, "count": len(pages)}
     except Exception as e:
         return {"error": str(e), "pages": []}
 
 @app.post("/api/analyze-page-deep")
 async def analyze_page_deep(request_data: dict):
+    """Queue a deep page analysis; poll /api/jobs/{job_id} for the result"""
+    return await _enqueue_job("page_analysis", request_data)
+
+async def run_page_analysis(request_data, progress=_no_progress, client=None):
     """Deep AI analysis combining GSC, GA4, sitemap content, and competitors"""
     site_id = request_data.get('site_id')
     page_url = request_data.get('page_url')
@@ -705,27 +1222,24 @@ async def analyze_page_deep(request_data: dict):
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
+        await rollups.ensure_site(site_id)
         # 1. Get GSC data for this page
-        cur.execute("""
+        rows = await db.fetchall(f"""
             SELECT 
                 query,
                 SUM(impressions) as impressions,
                 SUM(clicks) as clicks,
-                AVG(ctr) as ctr,
-                AVG(position) as position
-            FROM gsc_metrics
-            WHERE site_id = %s AND url = %s
+                {rollups.weighted('ctr_weighted', 'impressions')} as ctr,
+                {rollups.weighted('position_weighted', 'impressions')} as position
+            FROM gsc_rollup_url_query
+            WHERE site_id = %s AND grain = 'month' AND url = %s
             GROUP BY query
             ORDER BY impressions DESC
             LIMIT 10
         """, (site_id, page_url))
         
         gsc_queries = []
-        for row in cur.fetchall():
+        for row in rows:
             gsc_queries.append({
                 "query": row[0],
                 "impressions": int(row[1]),
@@ -738,18 +1252,17 @@ async def analyze_page_deep(request_data: dict):
             return {"error": "No GSC data for this page"}
         
         # 2. Get GA4 data for this page
-        cur.execute("""
+        ga4_row = await db.fetchone(f"""
             SELECT 
                 SUM(sessions) as sessions,
                 SUM(pageviews) as pageviews,
-                AVG(avg_session_duration) as avg_duration,
-                AVG(bounce_rate) as bounce_rate,
+                {rollups.weighted('duration_weighted', 'sessions')} as avg_duration,
+                {rollups.weighted('bounce_weighted', 'sessions')} as bounce_rate,
                 SUM(conversions) as conversions
-            FROM ga4_metrics
-            WHERE site_id = %s AND page_path = %s
+            FROM ga4_rollup_page
+            WHERE site_id = %s AND grain = 'month' AND page_path = %s
         """, (site_id, page_url))
         
-        ga4_row = cur.fetchone()
         ga4_data = {
             "sessions": int(ga4_row[0] or 0),
             "pageviews": int(ga4_row[1] or 0),
@@ -758,26 +1271,34 @@ async def analyze_page_deep(request_data: dict):
             "conversions": float(ga4_row[4] or 0)
         } if ga4_row else None
         
-        # 3. Analyze page content
-        page_analysis = await analyze_competitor_page(page_url)
-        
-        # 4. Search competitors for top query
+        # 3 + 4. Analyze page content and search competitors for top query, concurrently
+        await progress(step="page")
+        client = client or http_client.get_client()
         top_query = gsc_queries[0]['query']
-        competitors = await search_google(top_query, 10) if SERPER_API_KEY else []
+        (page_analysis, page_terms), competitors = await asyncio.gather(
+            analyze_competitor_page(page_url, client, all_terms=True),
+            search_google(top_query, 10, client)
+        )
         
-        competitor_analysis = []
-        for comp in competitors[:5]:
-            analysis = await analyze_competitor_page(comp.get('link'))
-            if analysis:
-                competitor_analysis.append(analysis)
+        await progress(step="competitors", competitors_found=len(competitors))
+        competitor_results = await analyze_competitor_pages(
+            [comp.get('link') for comp in competitors[:5]], client, progress
+        )
+        competitor_analysis = [analysis for analysis, _ in competitor_results]
+        
+        # Terms competitors weight heavily that this page doesn't use
+        term_gaps = keywords.term_gaps(
+            page_terms, [terms for _, terms in competitor_results]
+        ) if page_terms else []
         
         # 5. Generate AI expert analysis
+        await progress(step="report", competitors_analyzed=len(competitor_analysis))
         ai_suggestions = await generate_expert_seo_analysis(
             gsc_queries, ga4_data, page_analysis, competitor_analysis, top_query
         )
         
         # 6. Store as comprehensive issue
-        cur.execute("""
+        issue = await db.fetchone("""
             INSERT INTO issues (site_id, issue_type, severity, description, suggested_action, status)
             VALUES (%s, %s, %s, %s, %s, %s)
             RETURNING id
@@ -786,13 +1307,11 @@ async def analyze_page_deep(request_data: dict):
             'deep_analysis',
             'high',
             f'Complete SEO analysis for "{top_query}" (Position: {gsc_queries[0]["position"]:.1f})',
-            ai_suggestions
+            ai_suggestions,
+            'open'
         ))
         
-        issue_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
+        issue_id = issue[0]
         
         return {
             "success": True,
@@ -801,141 +1320,117 @@ async def analyze_page_deep(request_data: dict):
             "ga4_data": ga4_data,
             "page_analysis": page_analysis,
             "competitor_count": len(competitor_analysis),
+            "term_gaps": term_gaps,
             "ai_suggestions": ai_suggestions
         }
         
     except Exception as e:
         return {"error": str(e)}
 
-async def search_google(query: str, num_results: int = 10):
-    """Search Google using Serper API"""
+async def search_google(query: str, num_results: int = 10, client=None):
+    """Search Google using Serper API (cached, identical lookups coalesced)"""
     if not SERPER_API_KEY:
         return []
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://google.serper.dev/search",
-                json={"q": query, "num": num_results},
-                headers={"X-API-KEY": SERPER_API_KEY, "Content-Type": "application/json"},
-                timeout=10.0
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('organic', [])
-            return []
-    except:
+        return await serp_cache.get_or_fetch(
+            query, num_results, lambda: _fetch_serp(query, num_results, client)
+        )
+    except Exception as e:
+        print(f"SERP lookup failed for {query!r}: {e}")
         return []
 
-async def analyze_competitor_page(url: str):
-    """Scrape and analyze competitor page deeply"""
+async def _fetch_serp(query, num_results, client=None):
+    client = client or http_client.get_client()
+    response = await client.post(
+        "https://google.serper.dev/search",
+        json={"q": query, "num": num_results},
+        headers={"X-API-KEY": SERPER_API_KEY, "Content-Type": "application/json"},
+        timeout=10.0
+    )
+    
+    if response.status_code != 200:
+        raise RuntimeError(f"Serper returned {response.status_code}")
+    return response.json().get('organic', [])
+
+@app.post("/api/serp/prewarm")
+async def prewarm_serp(request_data: dict):
+    """Pre-fetch SERP results for a batch of queries before an audit"""
+    if not SERPER_API_KEY:
+        return {"error": "Serper not configured"}
+    
+    try:
+        queries = request_data.get('queries') or []
+        num_results = int(request_data.get('num_results', 10))
+        result = await serp_cache.prewarm(
+            queries, num_results, lambda query: _fetch_serp(query, num_results)
+        )
+        return {"success": True, **result}
+    except Exception as e:
+        return {"error": str(e)}
+
+async def analyze_competitor_pages(urls, client=None, progress=_no_progress):
+    """Analyze several pages in parallel, keeping the input (SERP rank) order.
+    Returns ``(analysis, terms)`` pairs for the pages that could be analyzed."""
+    results = [None] * len(urls)
+    
+    async def analyze(rank, url):
+        return rank, await analyze_competitor_page(url, client)
+    
+    done = 0
+    for next_done in asyncio.as_completed([analyze(rank, url) for rank, url in enumerate(urls)]):
+        rank, result = await next_done
+        results[rank] = result
+        done += 1
+        await progress(competitors_analyzed=done)
+    
+    return [result for result in results if result[0]]
+
+async def analyze_competitor_page(url: str, client=None, all_terms=False):
+    """Scrape and analyze competitor page deeply: ``(analysis, terms)``,
+    or ``(None, None)`` if it can't be analyzed. ``all_terms`` keeps every
+    term of the page, which means parsing it again rather than using the cache"""
+    if not url:
+        return None, None
+    
+    # Global budget shared by every analysis running in this process
+    async with _scrape_slots:
+        return await _analyze_competitor_page(url, client, all_terms)
+
+async def _analyze_competitor_page(url, client, all_terms=False):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=15.0, follow_redirects=True)
+        # The cache holds only the most frequent terms
+        entry, fresh = (None, False) if all_terms else await page_cache.lookup(url)
+        if fresh:
+            await page_cache.record("hits", entry)
+            return entry["analysis"], entry.get("terms")
+        
+        client = client or http_client.get_client()
+        async with client.stream("GET", url, timeout=15.0, follow_redirects=True,
+                                 headers=page_cache.conditional_headers(entry)) as response:
+            if response.status_code == 304 and entry:
+                # Unchanged since we last parsed it
+                await page_cache.record("revalidated", entry)
+                await page_cache.touch(url, entry)
+                return entry["analysis"], entry.get("terms")
             
-            if response.status_code == 200:
-                html = response.text
-                soup = BeautifulSoup(html, 'html.parser')
-                
-                # SEO Elements
-                title = soup.find('title')
-                title_text = title.text.strip() if title else ""
-                
-                meta_desc = soup.find('meta', {'name': 'description'})
-                meta_desc_text = meta_desc.get('content', '').strip() if meta_desc else ""
-                
-                # Headings
-                h1s = [h.text.strip() for h in soup.find_all('h1')]
-                h2s = [h.text.strip() for h in soup.find_all('h2')]
-                h3s = [h.text.strip() for h in soup.find_all('h3')]
-                
-                # Content Analysis
-                text = soup.get_text()
-                words = len(text.split())
-                
-                # Count paragraphs
-                paragraphs = len(soup.find_all('p'))
-                
-                # Images
-                images = soup.find_all('img')
-                images_with_alt = len([img for img in images if img.get('alt')])
-                
-                # Links
-                links = soup.find_all('a', href=True)
-                internal_links = []
-                external_links = []
-                for link in links:
-                    href = link.get('href', '')
-                    if href.startswith('http'):
-                        if url.split('/')[2] in href:
-                            internal_links.append(href)
-                        else:
-                            external_links.append(href)
-                
-                # Schema markup
-                schemas = soup.find_all('script', {'type': 'application/ld+json'})
-                schema_types = []
-                for schema in schemas:
-                    try:
-                        schema_data = json.loads(schema.string)
-                        if '@type' in schema_data:
-                            schema_types.append(schema_data['@type'])
-                        elif isinstance(schema_data, list):
-                            for item in schema_data:
-                                if '@type' in item:
-                                    schema_types.append(item['@type'])
-                    except:
-                        pass
-                
-                # FAQ detection
-                has_faq = bool(soup.find_all(['div', 'section'], 
-                              class_=lambda x: x and 'faq' in x.lower())) or \
-                          'FAQPage' in schema_types
-                
-                # Check for other structured data
-                has_breadcrumb = 'BreadcrumbList' in schema_types
-                has_article = 'Article' in schema_types or 'BlogPosting' in schema_types
-                has_review = 'Review' in schema_types or 'AggregateRating' in schema_types
-                
-                # Keyword density (top 20 words)
-                words_list = text.lower().split()
-                word_freq = {}
-                stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'is', 'are', 'was', 'were'}
-                for word in words_list:
-                    if len(word) > 3 and word not in stop_words:
-                        word_freq[word] = word_freq.get(word, 0) + 1
-                
-                top_keywords = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:20]
-                
-                return {
-                    "url": url,
-                    "title": title_text,
-                    "title_length": len(title_text),
-                    "meta_desc": meta_desc_text,
-                    "meta_desc_length": len(meta_desc_text),
-                    "word_count": words,
-                    "paragraph_count": paragraphs,
-                    "h1_count": len(h1s),
-                    "h2_count": len(h2s),
-                    "h3_count": len(h3s),
-                    "h1s": h1s,
-                    "h2s": h2s[:15],
-                    "h3s": h3s[:10],
-                    "images_total": len(images),
-                    "images_with_alt": images_with_alt,
-                    "internal_links": len(internal_links),
-                    "external_links": len(external_links),
-                    "schemas": schema_types,
-                    "has_faq": has_faq,
-                    "has_breadcrumb": has_breadcrumb,
-                    "has_article_schema": has_article,
-                    "has_review_schema": has_review,
-                    "top_keywords": top_keywords
-                }
+            await page_cache.record("misses")
+            
+            if response.status_code != 200:
+                return None, None
+            if not http_client.is_html(response.headers.get("content-type")):
+                print(f"Skipping {url}: not HTML ({response.headers.get('content-type')})")
+                return None, None
+            
+            body = await http_client.read_html(response, MAX_PAGE_BYTES)
+        
+        analysis, terms = await parse_pool.analyze(url, body, response.encoding, all_terms)
+        await page_cache.store(url, response, analysis, len(body),
+                               keywords.top_terms(terms) if all_terms else terms)
+        return analysis, terms
     except Exception as e:
         print(f"Error analyzing {url}: {e}")
-        return None
+        return None, None
 
 async def generate_expert_seo_analysis(gsc_queries, ga4_data, page_analysis, competitors, query):
     """Generate comprehensive SEO expert analysis"""
@@ -1156,19 +1651,53 @@ async def generate_expert_seo_analysis(gsc_queries, ga4_data, page_analysis, com
     
     return "\n".join(suggestions)
 
+jobs.register("gsc_import", run_gsc_import)
+jobs.register("ga4_import", run_ga4_import)
+jobs.register("page_analysis", run_page_analysis)
+jobs.register("sitemap_import", run_sitemap_import)
+jobs.register("site_crawl", run_site_crawl)
+jobs.register("link_analysis", run_link_analysis)
+jobs.register("cannibalization", run_cannibalization)
+
 def calculate_expected_ctr(position):
     """Calculate expected CTR based on position"""
-    ctr_map = {
-        1: 0.316, 2: 0.158, 3: 0.106, 4: 0.077, 5: 0.062,
-        6: 0.051, 7: 0.043, 8: 0.037, 9: 0.032, 10: 0.028
-    }
-    pos = int(position)
-    if pos <= 10:
-        return ctr_map.get(pos, 0.028)
-    elif pos <= 20:
-        return 0.015
-    else:
-        return 0.005
+    return float(opportunities.expected_ctr(position))
+
+@app.get("/api/opportunities/{site_id}")
+async def get_opportunities(site_id: int, limit: int = 100, target_position: int = 3,
+                            min_impressions: int = 10, days: int = None,
+                            striking_only: bool = False):
+    """Rank every (url, query) pair of a site by the clicks it is missing:
+    CTR below what its position should earn, or rankings below
+    ``target_position``. ``days`` limits the window (default: all data)."""
+    if not DATABASE_URL:
+        return {"error": "Database not configured"}
+    
+    limit = max(1, min(limit, 1000))
+    
+    try:
+        await rollups.ensure_site(site_id)
+        # Daily rollups for a recent window, monthly ones for all data
+        if days:
+            window, params = "grain = 'day' AND period_start > CURRENT_DATE - %s", [days]
+        else:
+            window, params = "grain = 'month'", []
+        # Streamed: only each chunk and the running top `limit` are held in memory
+        ranker = opportunities.Ranker(limit, target_position, striking_only)
+        async for rows in db.stream(f"""
+            SELECT url, query, SUM(impressions), SUM(clicks),
+                   {rollups.weighted('position_weighted', 'impressions')}
+            FROM gsc_rollup_url_query
+            WHERE site_id = %s AND {window}
+            GROUP BY url, query
+            HAVING SUM(impressions) >= %s
+        """, (site_id, *params, min_impressions)):
+            await asyncio.to_thread(ranker.add, rows)
+        
+        ranked, summary = ranker.result()
+        return {"opportunities": ranked, "count": len(ranked), **summary}
+    except Exception as e:
+        return {"error": str(e), "opportunities": []}
 
 @app.get("/api/issues/{site_id}")
 async def get_issues(site_id: int):
@@ -1176,11 +1705,7 @@ async def get_issues(site_id: int):
         return {"issues": []}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("""
+        rows = await db.fetchall("""
             SELECT id, issue_type, severity, description, suggested_action, status, created_at
             FROM issues
             WHERE site_id = %s
@@ -1195,7 +1720,7 @@ async def get_issues(site_id: int):
         """, (site_id,))
         
         issues = []
-        for row in cur.fetchall():
+        for row in rows:
             issues.append({
                 "id": row[0],
                 "type": row[1],
@@ -1206,38 +1731,51 @@ async def get_issues(site_id: int):
                 "created_at": row[6].isoformat() if row[6] else None
             })
         
-        cur.close()
-        conn.close()
-        
         return {"issues": issues, "count": len(issues)}
     except Exception as e:
         return {"error": str(e)}
 
+GSC_EXPORT_COLUMNS = [
+    # (column, CSV header, Arrow type)
+    ("url", "URL", "string"),
+    ("query", "Query", "string"),
+    ("country", "Country", "string"),
+    ("device", "Device", "string"),
+    ("impressions", "Impressions", "int64"),
+    ("clicks", "Clicks", "int64"),
+    ("ctr", "CTR", "float64"),
+    ("position", "Position", "float64"),
+    ("date", "Date", "date32"),
+]
+
+# Each running export holds a pooled connection for its whole duration
+_export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
 @app.get("/api/export-gsc-data/{site_id}")
-async def export_gsc_data(site_id: int):
+async def export_gsc_data(site_id: int, format: str = "csv", gzip: bool = False):
+    """Stream the site's GSC rows as CSV, Parquet or Arrow, optionally gzipped"""
     if not DATABASE_URL:
         return {"error": "Database not configured"}
     
     try:
-        import psycopg2
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT url, query, country, device, impressions, clicks, ctr, position, date
-            FROM gsc_metrics
-            WHERE site_id = %s
-            ORDER BY impressions DESC
-        """, (site_id,))
-        
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        csv_data = "URL,Query,Country,Device,Impressions,Clicks,CTR,Position,Date\n"
-        for row in rows:
-            csv_data += f'"{row[0]}","{row[1]}","{row[2]}","{row[3]}",{row[4]},{row[5]},{row[6]},{row[7]},"{row[8]}"\n'
-        
-        return {"success": True, "csv_data": csv_data, "rows_count": len(rows)}
-    except Exception as e:
+        encoder, media_type, extension = export.encoder(format, GSC_EXPORT_COLUMNS, gzip)
+    except export.ExportError as e:
         return {"error": str(e)}
+    
+    columns = ", ".join(name for name, _, _ in GSC_EXPORT_COLUMNS)
+    sql = f"""
+        SELECT {columns}
+        FROM gsc_metrics
+        WHERE site_id = %s
+        ORDER BY impressions DESC, id DESC
+    """
+    
+    async def body():
+        async with _export_slots:
+            async for rows in db.stream(sql, (site_id,)):
+                yield await asyncio.to_thread(encoder.write, rows)
+            yield await asyncio.to_thread(encoder.close)
+    
+    return StreamingResponse(body(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="gsc-{site_id}.{extension}"'
+    })
@@ -0,0 +1,116 @@
+"""Site-wide opportunity scoring for (url, query) pairs.
+
+Pairs are scored a streamed chunk at a time, each chunk in one NumPy
+batch. The expected CTR at its average position, the shortfall of its
+actual CTR against that, and the clicks it would gain at the target
+position are all computed as whole-array operations. Pairs in "striking
+distance" (positions 8-20, close to page one) are flagged. Only a running
+top ``limit`` and the summary totals outlive a chunk, so memory does not
+grow with the number of pairs.
+"""
+from operator import itemgetter
+
+import numpy as np
+
+# Expected CTR by (truncated) position: 1-10 individually, 11-20 flat, 21+ flat
+EXPECTED_CTR = {
+    1: 0.316, 2: 0.158, 3: 0.106, 4: 0.077, 5: 0.062,
+    6: 0.051, 7: 0.043, 8: 0.037, 9: 0.032, 10: 0.028
+}
+PAGE_TWO_CTR = 0.015
+DEEP_CTR = 0.005
+
+STRIKING_DISTANCE = (8, 20)
+
+# Lookup table indexed by int(position); everything past 20 shares the last slot
+_CTR_TABLE = np.array(
+    [EXPECTED_CTR.get(p, 0.028) if p <= 10 else PAGE_TWO_CTR for p in range(21)] + [DEEP_CTR]
+)
+
+
+def expected_ctr(position):
+    """Expected CTR for a position or an array of positions."""
+    index = np.clip(np.asarray(position, dtype=np.float64).astype(np.int64), 0, len(_CTR_TABLE) - 1)
+    return _CTR_TABLE[index]
+
+
+def score(impressions, clicks, position, target_position=3):
+    """Score pairs given parallel arrays of totals and average positions.
+
+    ``potential_clicks`` is the extra clicks a pair would get at the
+    expected CTR of ``target_position`` (or of its own position, if it
+    already ranks better)."""
+    impressions = np.asarray(impressions, dtype=np.float64)
+    clicks = np.asarray(clicks, dtype=np.float64)
+    position = np.asarray(position, dtype=np.float64)
+
+    ctr = np.divide(clicks, impressions, out=np.zeros_like(clicks), where=impressions > 0)
+    expected = expected_ctr(position)
+    target = np.maximum(expected, expected_ctr(target_position))
+    return {
+        "ctr": ctr,
+        "expected_ctr": expected,
+        "ctr_gap": np.maximum(expected - ctr, 0.0),
+        "potential_clicks": np.maximum(target - ctr, 0.0) * impressions,
+        "striking_distance": (position >= STRIKING_DISTANCE[0]) & (position <= STRIKING_DISTANCE[1]),
+    }
+
+
+def top(values, limit, candidates=None):
+    """Indices of the ``limit`` largest ``values`` (among ``candidates``), largest first."""
+    index = np.arange(len(values)) if candidates is None else np.flatnonzero(candidates)
+    if len(index) > limit:
+        index = index[np.argpartition(-values[index], limit - 1)[:limit]]
+    return index[np.argsort(-values[index], kind="stable")]
+
+
+class Ranker:
+    """Running top ``limit`` pairs by potential clicks over chunks of
+    ``(url, query, impressions, clicks, position)`` rows."""
+
+    def __init__(self, limit, target_position=3, striking_only=False):
+        self.limit = limit
+        self.target_position = target_position
+        self.striking_only = striking_only
+        self.best = []  # (potential, row number, entry)
+        self.pairs = 0
+        self.striking = 0
+        self.potential = 0.0
+
+    def add(self, rows):
+        # Only the numeric columns are copied out; names are read back for the winners
+        impressions, clicks, position = (
+            np.fromiter(map(itemgetter(i), rows), dtype=np.float64, count=len(rows)) for i in (2, 3, 4)
+        )
+        scores = score(impressions, clicks, position, self.target_position)
+        striking = scores["striking_distance"]
+        potential = scores["potential_clicks"]
+
+        for i in top(potential, self.limit, striking if self.striking_only else None):
+            self.best.append((float(potential[i]), self.pairs + int(i), {
+                "url": rows[i][0],
+                "query": rows[i][1],
+                "impressions": int(impressions[i]),
+                "clicks": int(clicks[i]),
+                "ctr": round(float(scores["ctr"][i]), 4),
+                "position": round(float(position[i]), 1),
+                "expected_ctr": float(scores["expected_ctr"][i]),
+                "ctr_gap": round(float(scores["ctr_gap"][i]), 4),
+                "potential_clicks": round(float(potential[i]), 1),
+                "striking_distance": bool(striking[i])
+            }))
+        # Equal potentials keep row order, whatever the chunking
+        self.best.sort(key=lambda item: (-item[0], item[1]))
+        del self.best[self.limit:]
+        self.pairs += len(rows)
+        self.striking += int(striking.sum())
+        self.potential += float(potential.sum())
+
+    def result(self):
+        """``(top opportunities, summary)``, ranked by potential clicks."""
+        summary = {
+            "pairs_scored": self.pairs,
+            "striking_distance_pairs": self.striking,
+            "potential_clicks": round(self.potential, 1)
+        }
+        return [entry for _, _, entry in self.best], summary
@@ -0,0 +1,310 @@
+"""Cache of fetched pages and their extracted analysis dicts.
+
+Entries are fresh for ``PAGE_CACHE_TTL`` seconds. A stale entry is kept (up
+to ``PAGE_CACHE_MAX_AGE``) so the next fetch can revalidate it with
+``If-None-Match`` / ``If-Modified-Since`` and reuse the parsed result on a
+``304``. Redis is used when available, otherwise a local directory; both
+evict least-recently-used entries once ``PAGE_CACHE_MAX_BYTES`` is exceeded.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", str(24 * 3600)))
+PAGE_CACHE_MAX_AGE = int(os.getenv("PAGE_CACHE_MAX_AGE", str(14 * 24 * 3600)))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "/tmp/seo-engine-page-cache")
+
+# Longest an eviction pass can hold the Redis eviction lock
+EVICT_LOCK_SECONDS = 30
+
+STAT_FIELDS = ["hits", "revalidated", "misses", "stores", "evictions", "bytes_saved"]
+
+_backend = None
+
+
+def _key(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+class DiskBackend:
+    """One JSON file per entry, with an in-memory index of sizes in
+    least-recently-used order and their running total."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.counters = dict.fromkeys(STAT_FIELDS, 0)
+        self.index = OrderedDict()
+        self.bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+                found.append((st.st_mtime, name[:-5], st.st_size))
+            except OSError:
+                pass
+        for used, key, size in sorted(found):
+            self.index[key] = (used, size)
+            self.bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, data):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _forget(self, key):
+        _, size = self.index.pop(key, (None, 0))
+        self.bytes -= size
+
+    async def get(self, key):
+        entry = await asyncio.to_thread(self._read, key)
+        if entry and key in self.index:
+            self.index[key] = (time.time(), self.index[key][1])
+            self.index.move_to_end(key)
+        return entry
+
+    async def put(self, key, entry):
+        data = json.dumps(entry)
+        await asyncio.to_thread(self._write, key, data)
+        self._forget(key)
+        self.index[key] = (time.time(), len(data))
+        self.bytes += len(data)
+        await self._evict()
+
+    async def _evict(self):
+        # The least recently used entry is always first
+        now = time.time()
+        while self.index:
+            key, (used, _) = next(iter(self.index.items()))
+            if self.bytes <= PAGE_CACHE_MAX_BYTES and now - used < PAGE_CACHE_MAX_AGE:
+                break
+            self._forget(key)
+            await asyncio.to_thread(self._remove, key)
+            self.counters["evictions"] += 1
+
+    async def incr(self, field, amount=1):
+        self.counters[field] += amount
+
+    async def stats(self):
+        return dict(self.counters, entries=len(self.index), bytes=self.bytes)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Entries as strings with an expiry; a sorted set tracks recency for
+    size-based eviction, a hash holds each entry's size and a counter their
+    total, and another hash holds process-wide counters.
+
+    A write or removal reads the entry's old size and updates the total in
+    one transaction, retried if the entry changes in between."""
+
+    PREFIX = "seo-engine:page:"
+    LRU_KEY = "seo-engine:page-cache:lru"
+    SIZES_KEY = "seo-engine:page-cache:sizes"
+    BYTES_KEY = "seo-engine:page-cache:bytes"
+    EVICT_LOCK_KEY = "seo-engine:page-cache:evicting"
+    STATS_KEY = "seo-engine:page-cache:stats"
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def init_total(self):
+        """Seed the total from the sizes hash when it was kept by a version without one."""
+        if not await self.redis.exists(self.BYTES_KEY):
+            total = sum(int(size) for size in await self.redis.hvals(self.SIZES_KEY))
+            await self.redis.set(self.BYTES_KEY, total, nx=True)
+
+    async def get(self, key):
+        data = await self.redis.get(self.PREFIX + key)
+        if data is None:
+            return None
+        await self.redis.zadd(self.LRU_KEY, {key: time.time()})
+        return json.loads(data)
+
+    async def _replace(self, key, data=None, counter=None):
+        """Store ``data`` as the entry (or remove it, for ``None``),
+        keeping the byte total in step."""
+        from redis.exceptions import WatchError
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(self.PREFIX + key)
+                    old = int(await pipe.hget(self.SIZES_KEY, key) or 0)
+                    pipe.multi()
+                    if data is None:
+                        pipe.delete(self.PREFIX + key)
+                        pipe.zrem(self.LRU_KEY, key)
+                        pipe.hdel(self.SIZES_KEY, key)
+                        pipe.decrby(self.BYTES_KEY, old)
+                    else:
+                        pipe.set(self.PREFIX + key, data, ex=PAGE_CACHE_MAX_AGE)
+                        pipe.zadd(self.LRU_KEY, {key: time.time()})
+                        pipe.hset(self.SIZES_KEY, key, len(data))
+                        pipe.incrby(self.BYTES_KEY, len(data) - old)
+                    if counter:
+                        pipe.hincrby(self.STATS_KEY, counter, 1)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    async def put(self, key, entry):
+        await self._replace(key, json.dumps(entry))
+        await self._evict()
+
+    async def _evict(self):
+        # One evictor at a time, or concurrent writers would each evict for
+        # the same excess; a writer that finds it busy leaves its bytes to it
+        if not await self.redis.set(self.EVICT_LOCK_KEY, 1, nx=True, ex=EVICT_LOCK_SECONDS):
+            return
+        try:
+            # Entries Redis already expired still have bookkeeping rows
+            for key in await self.redis.zrangebyscore(self.LRU_KEY, 0, time.time() - PAGE_CACHE_MAX_AGE):
+                await self._replace(key)
+            while int(await self.redis.get(self.BYTES_KEY) or 0) > PAGE_CACHE_MAX_BYTES:
+                popped = await self.redis.zpopmin(self.LRU_KEY)
+                if not popped:
+                    break
+                await self._replace(popped[0][0], counter="evictions")
+        finally:
+            await self.redis.delete(self.EVICT_LOCK_KEY)
+
+    async def incr(self, field, amount=1):
+        await self.redis.hincrby(self.STATS_KEY, field, amount)
+
+    async def stats(self):
+        counters = await self.redis.hgetall(self.STATS_KEY)
+        stats = {field: int(counters.get(field, 0)) for field in STAT_FIELDS}
+        return dict(stats, entries=await self.redis.hlen(self.SIZES_KEY),
+                    bytes=int(await self.redis.get(self.BYTES_KEY) or 0))
+
+    async def close(self):
+        await self.redis.close()
+
+
+async def init(redis_url=None):
+    global _backend
+    if _backend is not None:
+        return
+    if redis_url:
+        try:
+            import redis.asyncio as redis
+            client = redis.from_url(redis_url, decode_responses=True)
+            await client.ping()
+            backend = RedisBackend(client)
+            await backend.init_total()
+            _backend = backend
+            print("Page cache: redis")
+            return
+        except Exception as e:
+            print(f"Redis unavailable ({e}), using disk page cache")
+    _backend = DiskBackend(PAGE_CACHE_DIR)
+    print(f"Page cache: {PAGE_CACHE_DIR}")
+
+
+async def close():
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
+
+async def lookup(url):
+    """Return ``(entry, fresh)``; ``entry`` is None on a miss."""
+    if _backend is None:
+        return None, False
+    try:
+        entry = await _backend.get(_key(url))
+    except Exception as e:
+        print(f"Page cache read failed for {url}: {e}")
+        return None, False
+    if entry is None:
+        return None, False
+    return entry, time.time() < entry["fetched_at"] + PAGE_CACHE_TTL
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+async def store(url, response, analysis, body_bytes, terms=None):
+    if _backend is None:
+        return
+    entry = {
+        "url": url,
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "body_bytes": body_bytes,
+        "fetched_at": time.time(),
+        "analysis": analysis,
+        "terms": terms
+    }
+    try:
+        await _backend.put(_key(url), entry)
+        await _backend.incr("stores")
+    except Exception as e:
+        print(f"Page cache write failed for {url}: {e}")
+
+
+async def touch(url, entry):
+    """Mark a revalidated (304) entry fresh again."""
+    entry["fetched_at"] = time.time()
+    try:
+        await _backend.put(_key(url), entry)
+    except Exception as e:
+        print(f"Page cache write failed for {url}: {e}")
+
+
+async def record(event, entry=None):
+    """Count a hit / revalidated / miss, crediting the body bytes not downloaded."""
+    if _backend is None:
+        return
+    try:
+        await _backend.incr(event)
+        if entry and event in ("hits", "revalidated"):
+            await _backend.incr("bytes_saved", entry.get("body_bytes", 0))
+    except Exception as e:
+        print(f"Page cache stats update failed: {e}")
+
+
+async def stats():
+    if _backend is None:
+        return {"backend": None}
+    stats = await _backend.stats()
+    lookups = stats["hits"] + stats["revalidated"] + stats["misses"]
+    stats["hit_ratio"] = round((stats["hits"] + stats["revalidated"]) / lookups, 4) if lookups else 0.0
+    stats["backend"] = "redis" if isinstance(_backend, RedisBackend) else "disk"
+    return stats
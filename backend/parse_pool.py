@@ -0,0 +1,79 @@
+"""Process pool for CPU-bound page parsing.
+
+Parsing a large competitor page holds the GIL for hundreds of milliseconds,
+which would stall every other request on the event loop (and a thread pool
+would not help). Pages are parsed in ``PARSE_WORKERS`` separate processes
+instead; only the raw body bytes go in and the compact analysis dict comes
+back. With ``PARSE_WORKERS=0`` parsing falls back to a thread.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import extractor
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+_pool = None
+
+
+def _build_pool():
+    # spawn: children must not inherit the event loop, DB pool or sockets
+    return ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def _ready():
+    return os.getpid()
+
+
+async def start():
+    """Start the workers and wait until each has imported the extractor."""
+    global _pool
+    if _pool is not None or PARSE_WORKERS <= 0:
+        return
+    pool = _build_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        pids = await asyncio.gather(*[loop.run_in_executor(pool, _ready) for _ in range(PARSE_WORKERS)])
+    except Exception as e:
+        print(f"Parse pool failed to start ({e!r}), parsing in threads")
+        pool.shutdown(wait=False, cancel_futures=True)
+        return
+    _pool = pool
+    print(f"Parse pool ready ({len(set(pids))} of {PARSE_WORKERS} processes)")
+
+
+async def stop():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+
+async def run(fn, *args):
+    """Run a module-level parsing function off the event loop."""
+    global _pool
+    if _pool is None:
+        return await asyncio.to_thread(fn, *args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_pool, fn, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed); replace the pool for the next page
+        print("Parse pool broken, restarting it")
+        broken, _pool = _pool, _build_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+async def analyze(url, body, encoding, all_terms=False):
+    """``(analysis, terms)`` for a fetched page body, off the event loop."""
+    return await run(extractor.analyze_bytes, url, body, encoding, all_terms)
+
+
+async def crawl(url, body, encoding):
+    """Extract a crawled page's stored fields and links off the event loop."""
+    return await run(extractor.crawl_bytes, url, body, encoding)
@@ -0,0 +1,230 @@
+"""Pre-aggregated GSC / GA4 rollups.
+
+Each rollup table holds one row per site, dimension values (url, query,
+page path) and period, at day, week and month grain. They are maintained
+incrementally during ingestion: the merge records how much every upserted
+row changed the metrics (new value minus the value it replaced) and those
+deltas are added to the affected periods, so a re-fetched trailing window
+never double counts.
+
+Ratios are never stored as averages. CTR and position are kept as
+impression-weighted sums (duration and bounce rate as session-weighted
+sums) and divided back out at read time, which keeps every grain exact.
+
+A site's rollups are built from its stored metrics once, before the first
+merge or read that needs them, and recorded in ``rollup_builds``; from then
+on the merges keep them current. So a database upgraded with metrics
+already in it needs no manual backfill.
+"""
+import db
+
+GRAINS = ("day", "week", "month")
+
+# Concurrent merges for one site would each compute deltas against the same
+# old rows; they are serialised on (ROLLUP_LOCK_ID, site_id)
+ROLLUP_LOCK_ID = 72_410_017
+
+
+class Rollup:
+    """Rollup tables derived from one metrics table.
+
+    ``measures`` maps each rollup column to the expression it sums per raw
+    row; ``tables`` maps each rollup table to the dimensions it keeps.
+    ``changes`` optionally names a ``(table, dimension)`` that records every
+    value of ``dimension`` a merge touched, for analyses that catch up
+    incrementally."""
+
+    def __init__(self, source, delta, dimensions, measures, tables, changes=None):
+        self.source = source
+        self.delta = delta
+        self.dimensions = dimensions
+        self.measures = measures
+        self.tables = tables
+        self.changes = changes
+
+    def delta_table_sql(self):
+        columns = [f"{d} TEXT" for d in self.dimensions]
+        columns += [f"{m} {_column_type(m)}" for m in self.measures]
+        return (f"CREATE TEMP TABLE IF NOT EXISTS {self.delta} "
+                f"(site_id INTEGER, {', '.join(columns)}, date DATE) ON COMMIT DROP")
+
+    def delta_select(self, rows, old=None, key=None):
+        """``SELECT`` of per-(site, dimensions, date) metric changes.
+
+        ``rows`` are the new raw rows; when ``old`` is given, the rows they
+        replace are joined on ``key`` and subtracted."""
+        dims = ", ".join(f"n.{d}" for d in self.dimensions)
+        if old is None:
+            sums = [f"SUM({expr.format(t='n')})" for expr in self.measures.values()]
+            join = ""
+        else:
+            sums = [f"SUM({expr.format(t='n')} - COALESCE({expr.format(t='o')}, 0))"
+                    for expr in self.measures.values()]
+            join = f"LEFT JOIN {old} o ON " + " AND ".join(f"o.{k} = n.{k}" for k in key)
+        return f"""
+            SELECT n.site_id, {dims}, {', '.join(sums)}, n.date
+            FROM {rows} n {join}
+            WHERE n.date IS NOT NULL
+            GROUP BY n.site_id, {dims}, n.date
+            HAVING {' OR '.join(f'{s} <> 0' for s in sums)}
+        """
+
+
+GSC = Rollup(
+    source="gsc_metrics",
+    delta="gsc_rollup_delta",
+    dimensions=["url", "query"],
+    measures={
+        "impressions": "{t}.impressions",
+        "clicks": "{t}.clicks",
+        "ctr_weighted": "{t}.ctr * {t}.impressions",
+        "position_weighted": "{t}.position * {t}.impressions",
+    },
+    tables={
+        "gsc_rollup_site": [],
+        "gsc_rollup_url": ["url"],
+        "gsc_rollup_query": ["query"],
+        "gsc_rollup_url_query": ["url", "query"],
+    },
+    changes=("gsc_query_changes", "query"),
+)
+
+GA4 = Rollup(
+    source="ga4_metrics",
+    delta="ga4_rollup_delta",
+    dimensions=["page_path"],
+    measures={
+        "sessions": "{t}.sessions",
+        "users": "{t}.users",
+        "pageviews": "{t}.pageviews",
+        "duration_weighted": "{t}.avg_session_duration * {t}.sessions",
+        "bounce_weighted": "{t}.bounce_rate * {t}.sessions",
+        "conversions": "{t}.conversions",
+    },
+    tables={
+        "ga4_rollup_site": [],
+        "ga4_rollup_page": ["page_path"],
+    },
+)
+
+ROLLUPS = {"gsc_metrics": GSC, "ga4_metrics": GA4}
+
+
+def _column_type(measure):
+    if measure.endswith("_weighted") or measure == "conversions":
+        return "DOUBLE PRECISION"
+    return "BIGINT"
+
+
+def create_tables(cur, rollup):
+    # Keyed (site, grain, dimensions, period) so a site's or a url's series
+    # at one grain is a single index range
+    for table, dims in rollup.tables.items():
+        columns = ["site_id INTEGER NOT NULL", "grain TEXT NOT NULL"]
+        columns += [f"{d} TEXT NOT NULL" for d in dims]
+        columns += ["period_start DATE NOT NULL"]
+        columns += [f"{m} {_column_type(m)} NOT NULL DEFAULT 0" for m in rollup.measures]
+        key = ", ".join(["site_id", "grain", *dims, "period_start"])
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(columns)}, PRIMARY KEY ({key}))")
+
+
+def lock(cur, site_id):
+    cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (ROLLUP_LOCK_ID, site_id))
+
+
+def apply_deltas(cur, rollup, record_changes=True):
+    """Add the rows in the delta table to every rollup table and grain."""
+    grains = ", ".join(f"('{g}')" for g in GRAINS)
+    measures = list(rollup.measures)
+    for table, dims in rollup.tables.items():
+        keys = ["site_id", "grain", *dims, "period_start"]
+        where = " AND ".join(f"{d} IS NOT NULL" for d in dims) or "TRUE"
+        cur.execute(f"""
+            INSERT INTO {table} AS r ({', '.join(keys + measures)})
+            SELECT site_id, g.grain, {''.join(f'{d}, ' for d in dims)}
+                   date_trunc(g.grain, date::timestamp)::date,
+                   {', '.join(f'SUM({m})' for m in measures)}
+            FROM {rollup.delta} CROSS JOIN (VALUES {grains}) AS g (grain)
+            WHERE {where}
+            GROUP BY {', '.join(str(i) for i in range(1, len(keys) + 1))}
+            ON CONFLICT ({', '.join(keys)}) DO UPDATE SET
+                {', '.join(f'{m} = r.{m} + EXCLUDED.{m}' for m in measures)}
+        """)
+    if rollup.changes and record_changes:
+        table, dim = rollup.changes
+        cur.execute(f"""
+            INSERT INTO {table} (site_id, {dim})
+            SELECT DISTINCT site_id, {dim} FROM {rollup.delta} WHERE {dim} IS NOT NULL
+            ON CONFLICT DO NOTHING
+        """)
+    cur.execute(f"TRUNCATE {rollup.delta}")
+
+
+def delete_site(cur, site_id):
+    cur.execute("DELETE FROM rollup_builds WHERE site_id = %s", (site_id,))
+    _built.discard(site_id)
+    for rollup in ROLLUPS.values():
+        for table in rollup.tables:
+            cur.execute(f"DELETE FROM {table} WHERE site_id = %s", (site_id,))
+        if rollup.changes:
+            cur.execute(f"DELETE FROM {rollup.changes[0]} WHERE site_id = %s", (site_id,))
+
+
+def rebuild(cur, rollup, site_id=None):
+    """Recompute a rollup from its metrics table (one site, or all)."""
+    where = "" if site_id is None else " WHERE site_id = %(site_id)s"
+    for table in rollup.tables:
+        cur.execute(f"DELETE FROM {table}{where}", {"site_id": site_id})
+    cur.execute(rollup.delta_table_sql())
+    source = rollup.source if site_id is None else f"(SELECT * FROM {rollup.source}{where})"
+    cur.execute(f"INSERT INTO {rollup.delta} {rollup.delta_select(source)}", {"site_id": site_id})
+    # The data itself is unchanged, so nothing is marked for re-analysis
+    apply_deltas(cur, rollup, record_changes=False)
+
+
+def backfill_site(cur, site_id):
+    """Rebuild every rollup of one site from its stored metrics."""
+    lock(cur, site_id)
+    for rollup in ROLLUPS.values():
+        rebuild(cur, rollup, site_id)
+    cur.execute("""
+        INSERT INTO rollup_builds (site_id, built_at) VALUES (%s, NOW())
+        ON CONFLICT (site_id) DO UPDATE SET built_at = NOW()
+    """, (site_id,))
+
+
+def _is_built(cur, site_id):
+    cur.execute("SELECT 1 FROM rollup_builds WHERE site_id = %s", (site_id,))
+    return cur.fetchone() is not None
+
+
+def ensure_built(cur, site_id):
+    """Build the site's rollups if they never have been. Call before
+    merging metrics, so the merge's deltas land on complete rollups.
+    Returns whether a build ran."""
+    # Checked before taking the lock, which a running merge holds
+    if _is_built(cur, site_id):
+        return False
+    lock(cur, site_id)
+    if _is_built(cur, site_id):
+        return False
+    backfill_site(cur, site_id)
+    return True
+
+
+# Sites known to be built, so reads skip the check
+_built = set()
+
+
+async def ensure_site(site_id):
+    """``ensure_built`` for readers, in its own transaction."""
+    if site_id is None or site_id in _built:
+        return
+    if await db.run(ensure_built, site_id):
+        print(f"Rollups built for site {site_id}")
+    _built.add(site_id)
+
+
+def weighted(column, weight):
+    """SQL for the mean of a weighted-sum column, e.g. ``SUM(ctr_weighted) / SUM(impressions)``."""
+    return f"COALESCE(SUM({column}) / NULLIF(SUM({weight}), 0), 0)"
@@ -0,0 +1,750 @@
+"""Versioned database schema.
+
+Migrations run in order, each in its own transaction, and are recorded in
+``schema_migrations``. They are applied at startup, or from the command
+line:
+
+    python schema.py migrate                     # apply pending migrations
+    python schema.py status                      # show applied / pending versions
+    python schema.py check                       # EXPLAIN the hot read queries
+    python schema.py backfill-rollups [SITE_ID]  # rebuild rollups from stored metrics
+
+Every migration is written to be safe on databases created before this
+module existed (``IF NOT EXISTS``, duplicate rows removed before a unique
+index is built). An advisory lock keeps concurrently starting processes
+from applying the same migration twice.
+
+Migrations that index the large metrics tables run outside a transaction
+and build with ``CREATE INDEX CONCURRENTLY``, so ingestion is not blocked
+while they run; a build that failed halfway is dropped and redone on the
+next attempt. Rollups are not backfilled by a migration: each site's are
+built the first time it is synced or read (see ``rollups``).
+``backfill-rollups`` builds them ahead of time, or rebuilds them.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import db
+import rollups
+
+MIGRATIONS_LOCK_ID = 72_410_015
+MIGRATIONS_LOCK_POLL = 0.5
+
+MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+"""
+
+BASE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS sites (
+        id SERIAL PRIMARY KEY,
+        owner_id INTEGER,
+        domain TEXT NOT NULL,
+        sitemap_url TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        last_scan_at TIMESTAMPTZ
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS connectors (
+        id SERIAL PRIMARY KEY,
+        site_id INTEGER,
+        type TEXT NOT NULL,
+        credentials_meta JSONB,
+        status TEXT NOT NULL DEFAULT 'active',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS gsc_metrics (
+        id BIGSERIAL PRIMARY KEY,
+        site_id INTEGER NOT NULL,
+        url TEXT,
+        query TEXT,
+        country TEXT,
+        device TEXT,
+        impressions INTEGER NOT NULL DEFAULT 0,
+        clicks INTEGER NOT NULL DEFAULT 0,
+        ctr DOUBLE PRECISION,
+        position DOUBLE PRECISION,
+        date DATE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ga4_metrics (
+        id BIGSERIAL PRIMARY KEY,
+        site_id INTEGER NOT NULL,
+        page_path TEXT,
+        date DATE,
+        country TEXT,
+        device TEXT,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        users INTEGER NOT NULL DEFAULT 0,
+        pageviews INTEGER NOT NULL DEFAULT 0,
+        avg_session_duration DOUBLE PRECISION,
+        bounce_rate DOUBLE PRECISION,
+        conversions DOUBLE PRECISION
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS issues (
+        id SERIAL PRIMARY KEY,
+        site_id INTEGER NOT NULL,
+        issue_type TEXT NOT NULL,
+        severity TEXT,
+        description TEXT,
+        suggested_action TEXT,
+        status TEXT NOT NULL DEFAULT 'open',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+]
+
+SYNC_WATERMARKS_SQL = """
+    CREATE TABLE IF NOT EXISTS sync_watermarks (
+        site_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        high_water_date DATE NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (site_id, source)
+    )
+"""
+
+NATURAL_KEYS = {
+    "gsc_metrics_natural_key": ("gsc_metrics", ["site_id", "url", "query", "country", "device", "date"]),
+    "ga4_metrics_natural_key": ("ga4_metrics", ["site_id", "page_path", "date", "country", "device"]),
+}
+
+# Metric columns carried in the natural-key indexes so the per-site and
+# per-page aggregates are answered with index-only scans
+COVERING_COLUMNS = {
+    "gsc_metrics_natural_key": ["impressions", "clicks", "ctr", "position"],
+    "ga4_metrics_natural_key": ["sessions", "users", "pageviews", "avg_session_duration",
+                                "bounce_rate", "conversions"],
+}
+
+SECONDARY_INDEXES = {
+    # Date-bounded reads (date filters, incremental sync windows)
+    "gsc_metrics_site_date": "gsc_metrics (site_id, date)",
+    # get_issues lists one site's issues, newest first within a severity
+    "issues_site_created": "issues (site_id, created_at DESC)",
+    # The active Google connector lookup
+    "connectors_type_status_created": "connectors (type, status, created_at DESC)",
+}
+
+
+def _index_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s)", (name,))
+    return cur.fetchone()[0] is not None
+
+
+def _create_index_concurrently(cur, name, definition, unique=False):
+    """``CREATE INDEX CONCURRENTLY`` unless a valid ``name`` exists; an invalid
+    one left by an interrupted build is dropped first."""
+    cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        cur.execute(f"DROP INDEX CONCURRENTLY {name}")
+    cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {definition}")
+
+
+def _has_include(cur, name):
+    cur.execute("SELECT indnkeyatts < indnatts FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def _dedupe(cur, table, columns):
+    cols = ", ".join(columns)
+    cur.execute(f"""
+        DELETE FROM {table} t
+        USING (
+            SELECT ctid, ROW_NUMBER() OVER (PARTITION BY {cols}) AS n
+            FROM {table}
+        ) d
+        WHERE t.ctid = d.ctid AND d.n > 1
+    """)
+
+
+def create_base_tables(cur):
+    for sql in BASE_TABLES_SQL:
+        cur.execute(sql)
+
+
+def create_sync_watermarks(cur):
+    cur.execute(SYNC_WATERMARKS_SQL)
+
+
+def create_natural_keys(cur):
+    """The unique indexes the metrics upserts conflict on."""
+    for index, (table, columns) in NATURAL_KEYS.items():
+        if _index_exists(cur, index):
+            continue
+        _dedupe(cur, table, columns)
+        cur.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({', '.join(columns)})")
+
+
+def create_covering_indexes(cur):
+    """Rebuild the natural keys with INCLUDE columns and add the secondary indexes."""
+    for index, (table, columns) in NATURAL_KEYS.items():
+        if _has_include(cur, index):
+            continue
+        include = ", ".join(COVERING_COLUMNS[index])
+        # Upserts infer the conflict index from its columns, so either copy serves them meanwhile
+        _create_index_concurrently(cur, f"{index}_covering",
+                                   f"{table} ({', '.join(columns)}) INCLUDE ({include})", unique=True)
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+        cur.execute(f"ALTER INDEX {index}_covering RENAME TO {index}")
+    for index, definition in SECONDARY_INDEXES.items():
+        _create_index_concurrently(cur, index, definition)
+    for table in ("gsc_metrics", "ga4_metrics", "issues", "connectors"):
+        cur.execute(f"ANALYZE {table}")
+
+
+def create_keyset_index(cur):
+    """get_gsc_data pages by (impressions, id) descending within a site."""
+    _create_index_concurrently(cur, "gsc_metrics_site_impressions", "gsc_metrics (site_id, impressions, id)")
+
+
+def create_rollups(cur):
+    """Day/week/month rollup tables; each site's are built on first use."""
+    for rollup in rollups.ROLLUPS.values():
+        rollups.create_tables(cur, rollup)
+
+
+ROLLUP_BUILDS_SQL = """
+    CREATE TABLE IF NOT EXISTS rollup_builds (
+        site_id INTEGER PRIMARY KEY,
+        built_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+"""
+
+
+def create_rollup_builds(cur):
+    """Sites whose rollups have been built from their stored metrics."""
+    cur.execute(ROLLUP_BUILDS_SQL)
+
+
+SITE_URLS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS site_urls (
+        site_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        lastmod TIMESTAMPTZ,
+        sitemap_url TEXT,
+        first_seen_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        last_seen_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (site_id, url)
+    )
+    """,
+    # "What changed since the last crawl" reads
+    "CREATE INDEX IF NOT EXISTS site_urls_site_changed ON site_urls (site_id, changed_at)",
+    """
+    CREATE TABLE IF NOT EXISTS site_sitemaps (
+        site_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        lastmod TIMESTAMPTZ,
+        url_count INTEGER NOT NULL DEFAULT 0,
+        fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (site_id, url)
+    )
+    """,
+]
+
+
+def create_site_urls(cur):
+    """The sitemap URL inventory and the per-sitemap lastmods."""
+    for sql in SITE_URLS_SQL:
+        cur.execute(sql)
+
+
+CRAWL_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS crawls (
+        id BIGSERIAL PRIMARY KEY,
+        site_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        start_url TEXT NOT NULL,
+        max_pages INTEGER,
+        pages INTEGER NOT NULL DEFAULT 0,
+        errors INTEGER NOT NULL DEFAULT 0,
+        discovered INTEGER NOT NULL DEFAULT 0,
+        seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        finished_at TIMESTAMPTZ
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS crawls_site ON crawls (site_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS crawl_frontier (
+        crawl_id BIGINT NOT NULL,
+        url TEXT NOT NULL,
+        depth INTEGER,
+        state SMALLINT NOT NULL DEFAULT 0,
+        seq BIGSERIAL,
+        PRIMARY KEY (crawl_id, url)
+    )
+    """,
+    # Claims take the shallowest queued URLs first
+    """
+    CREATE INDEX IF NOT EXISTS crawl_frontier_queue
+    ON crawl_frontier (crawl_id, depth, seq) WHERE state = 0
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS crawl_pages (
+        site_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        crawl_id BIGINT NOT NULL,
+        depth INTEGER,
+        status_code INTEGER,
+        final_url TEXT,
+        redirects JSONB,
+        canonical TEXT,
+        meta_robots TEXT,
+        title TEXT,
+        meta_desc TEXT,
+        h1 TEXT,
+        h1_count INTEGER,
+        word_count INTEGER,
+        internal_links INTEGER,
+        external_links INTEGER,
+        content_type TEXT,
+        bytes INTEGER,
+        response_ms INTEGER,
+        error TEXT,
+        fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (site_id, url)
+    )
+    """,
+]
+
+
+def create_crawl_tables(cur):
+    """The site crawler's runs, persisted frontier and per-URL results."""
+    for sql in CRAWL_SQL:
+        cur.execute(sql)
+
+
+LINK_GRAPH_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS crawl_urls (
+        id SERIAL PRIMARY KEY,
+        site_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        UNIQUE (site_id, url)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS crawl_links (
+        site_id INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        crawl_id BIGINT NOT NULL,
+        targets INTEGER[] NOT NULL,
+        PRIMARY KEY (site_id, source_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS link_metrics (
+        site_id INTEGER NOT NULL,
+        url_id INTEGER NOT NULL,
+        crawl_id BIGINT NOT NULL,
+        pagerank DOUBLE PRECISION NOT NULL,
+        inlinks INTEGER NOT NULL,
+        outlinks INTEGER NOT NULL,
+        depth INTEGER,
+        impressions BIGINT NOT NULL DEFAULT 0,
+        orphan BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (site_id, url_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS link_metrics_site_pagerank ON link_metrics (site_id, pagerank DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS link_analyses (
+        site_id INTEGER PRIMARY KEY,
+        crawl_id BIGINT NOT NULL,
+        urls INTEGER NOT NULL,
+        edges BIGINT NOT NULL,
+        orphans INTEGER NOT NULL,
+        max_depth INTEGER NOT NULL,
+        iterations INTEGER NOT NULL,
+        seconds DOUBLE PRECISION NOT NULL,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+]
+
+
+def create_link_graph(cur):
+    """Interned crawl URLs, per-page outlink arrays and the per-URL link metrics."""
+    for sql in LINK_GRAPH_SQL:
+        cur.execute(sql)
+
+
+def create_content_fingerprints(cur):
+    """MinHash signatures on crawl pages and an index for the thin-page listing."""
+    cur.execute("ALTER TABLE crawl_pages ADD COLUMN IF NOT EXISTS minhash BYTEA")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS crawl_pages_site_words
+        ON crawl_pages (site_id, word_count) WHERE status_code = 200
+    """)
+
+
+CANNIBALIZATION_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS gsc_query_changes (
+        site_id INTEGER NOT NULL,
+        query TEXT NOT NULL,
+        PRIMARY KEY (site_id, query)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cannibalization (
+        site_id INTEGER NOT NULL,
+        query TEXT NOT NULL,
+        urls INTEGER NOT NULL,
+        impressions BIGINT NOT NULL,
+        clicks BIGINT NOT NULL,
+        click_loss DOUBLE PRECISION NOT NULL,
+        primary_url TEXT NOT NULL,
+        competitors JSONB NOT NULL,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (site_id, query)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS cannibalization_site_loss ON cannibalization (site_id, click_loss DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS cannibalization_runs (
+        site_id INTEGER PRIMARY KEY,
+        mode TEXT NOT NULL,
+        window_start DATE NOT NULL,
+        queries_changed INTEGER,
+        conflicts INTEGER NOT NULL,
+        click_loss DOUBLE PRECISION NOT NULL,
+        seconds DOUBLE PRECISION NOT NULL,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    # Incremental runs read the weekly rows of a set of queries
+    """
+    CREATE INDEX IF NOT EXISTS gsc_rollup_url_query_week_query
+    ON gsc_rollup_url_query (site_id, query, period_start) WHERE grain = 'week'
+    """,
+]
+
+
+def create_cannibalization(cur):
+    """Changed-query queue, per-query conflicts and the last run per site."""
+    for sql in CANNIBALIZATION_SQL:
+        cur.execute(sql)
+
+
+GA4_DIMENSION_SETS_SQL = """
+    CREATE TABLE IF NOT EXISTS ga4_dimension_sets (
+        site_id INTEGER PRIMARY KEY,
+        dimensions TEXT[] NOT NULL,
+        recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+"""
+
+
+def create_ga4_dimension_sets(cur):
+    """The GA4 dimensions each site's rows are stored with."""
+    cur.execute(GA4_DIMENSION_SETS_SQL)
+
+
+MIGRATIONS = [
+    (1, "base tables", create_base_tables),
+    (2, "sync watermarks", create_sync_watermarks),
+    (3, "metrics natural keys", create_natural_keys),
+    (4, "covering indexes", create_covering_indexes),
+    (5, "gsc keyset pagination index", create_keyset_index),
+    (6, "gsc / ga4 rollups", create_rollups),
+    (7, "site url inventory", create_site_urls),
+    (8, "site crawler", create_crawl_tables),
+    (9, "internal link graph", create_link_graph),
+    (10, "content fingerprints", create_content_fingerprints),
+    (11, "keyword cannibalization", create_cannibalization),
+    (12, "rollup build flags", create_rollup_builds),
+    (13, "ga4 dimension sets", create_ga4_dimension_sets),
+]
+
+
+# Build indexes CONCURRENTLY, which cannot happen inside a transaction
+CONCURRENT_MIGRATIONS = {4, 5}
+
+
+def _lock(cur, session=False):
+    # Polled, not blocking: a process waiting inside a statement holds a
+    # snapshot, and a concurrent index build in the lock holder would wait on it
+    fn = "pg_try_advisory_lock" if session else "pg_try_advisory_xact_lock"
+    while True:
+        cur.execute(f"SELECT {fn}(%s)", (MIGRATIONS_LOCK_ID,))
+        if cur.fetchone()[0]:
+            return
+        time.sleep(MIGRATIONS_LOCK_POLL)
+
+
+def applied_versions(cur, session=False):
+    _lock(cur, session)
+    cur.execute(MIGRATIONS_TABLE_SQL)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def _record(cur, version):
+    _, name, migration = next(m for m in MIGRATIONS if m[0] == version)
+    migration(cur)
+    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+
+
+def apply(cur, version):
+    """Apply one migration unless another process got there first."""
+    if version in applied_versions(cur):
+        return False
+    _record(cur, version)
+    return True
+
+
+def apply_concurrently(cur, version):
+    """``apply`` on an autocommit connection, holding the lock for the session."""
+    try:
+        if version in applied_versions(cur, session=True):
+            return False
+        _record(cur, version)
+        return True
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+
+
+async def migrate():
+    """Apply every pending migration. Returns the versions applied."""
+    applied = await db.run(applied_versions)
+    done = []
+    for version, name, _ in MIGRATIONS:
+        if version in applied:
+            continue
+        if version in CONCURRENT_MIGRATIONS:
+            applied_now = await db.run_autocommit(apply_concurrently, version)
+        else:
+            applied_now = await db.run(apply, version)
+        if applied_now:
+            print(f"Applied migration {version}: {name}")
+            done.append(version)
+    return done
+
+
+def _site_ids(cur):
+    cur.execute("SELECT id FROM sites ORDER BY id")
+    return [row[0] for row in cur.fetchall()]
+
+
+def _analyze_rollups(cur):
+    for rollup in rollups.ROLLUPS.values():
+        for table in rollup.tables:
+            cur.execute(f"ANALYZE {table}")
+
+
+async def backfill_rollups(site_id=None):
+    """Rebuild the rollups of one site, or of every site, each in its own transaction."""
+    site_ids = [site_id] if site_id is not None else await db.run(_site_ids)
+    for i, sid in enumerate(site_ids, 1):
+        started = time.perf_counter()
+        await db.run(rollups.backfill_site, sid)
+        print(f"Rollups rebuilt for site {sid} ({i}/{len(site_ids)}, {time.perf_counter() - started:.1f}s)")
+    await db.run(_analyze_rollups)
+    return len(site_ids)
+
+
+# Representative shapes of the hot read paths in main.py; keep in step with it
+QUERY_SHAPES = {
+    "get_gsc_data": ("""
+        SELECT id, url, query, country, device, impressions, clicks, ctr, position, date
+        FROM gsc_metrics
+        WHERE site_id = %(site_id)s
+        ORDER BY impressions DESC, id DESC
+        LIMIT 50
+    """, "gsc_metrics"),
+    "get_gsc_data (cursor)": ("""
+        SELECT id, url, query, country, device, impressions, clicks, ctr, position, date
+        FROM gsc_metrics
+        WHERE site_id = %(site_id)s AND device = 'MOBILE' AND (impressions, id) < (10, 1000000)
+        ORDER BY impressions DESC, id DESC
+        LIMIT 50
+    """, "gsc_metrics"),
+    "get_gsc_data (total)": ("""
+        SELECT COUNT(*) FROM gsc_metrics
+        WHERE site_id = %(site_id)s AND date >= CURRENT_DATE - 7 AND date <= CURRENT_DATE
+    """, "gsc_metrics"),
+    "get_gsc_trend": ("""
+        SELECT period_start, impressions, clicks, ctr_weighted / NULLIF(impressions, 0)
+        FROM gsc_rollup_site
+        WHERE site_id = %(site_id)s AND grain = 'week'
+        ORDER BY period_start
+    """, "gsc_rollup_site"),
+    "get_gsc_trend (url)": ("""
+        SELECT period_start, impressions, clicks, ctr_weighted / NULLIF(impressions, 0)
+        FROM gsc_rollup_url
+        WHERE site_id = %(site_id)s AND grain = 'day' AND url = %(url)s
+        ORDER BY period_start
+    """, "gsc_rollup_url"),
+    "get_ga4_data": ("""
+        SELECT page_path, SUM(sessions), SUM(users), SUM(pageviews),
+               SUM(duration_weighted) / NULLIF(SUM(sessions), 0),
+               SUM(bounce_weighted) / NULLIF(SUM(sessions), 0), SUM(conversions)
+        FROM ga4_rollup_page
+        WHERE site_id = %(site_id)s AND grain = 'month'
+        GROUP BY page_path
+        ORDER BY 2 DESC
+        LIMIT 50
+    """, "ga4_rollup_page"),
+    "analyze_page_deep (gsc)": ("""
+        SELECT query, SUM(impressions), SUM(clicks),
+               SUM(ctr_weighted) / NULLIF(SUM(impressions), 0),
+               SUM(position_weighted) / NULLIF(SUM(impressions), 0)
+        FROM gsc_rollup_url_query
+        WHERE site_id = %(site_id)s AND grain = 'month' AND url = %(url)s
+        GROUP BY query
+        ORDER BY 2 DESC
+        LIMIT 10
+    """, "gsc_rollup_url_query"),
+    "analyze_page_deep (ga4)": ("""
+        SELECT SUM(sessions), SUM(pageviews),
+               SUM(duration_weighted) / NULLIF(SUM(sessions), 0),
+               SUM(bounce_weighted) / NULLIF(SUM(sessions), 0), SUM(conversions)
+        FROM ga4_rollup_page
+        WHERE site_id = %(site_id)s AND grain = 'month' AND page_path = %(url)s
+    """, "ga4_rollup_page"),
+    "get_opportunities": ("""
+        SELECT url, query, SUM(impressions), SUM(clicks),
+               SUM(position_weighted) / NULLIF(SUM(impressions), 0)
+        FROM gsc_rollup_url_query
+        WHERE site_id = %(site_id)s AND grain = 'month'
+        GROUP BY url, query
+        HAVING SUM(impressions) >= 10
+    """, "gsc_rollup_url_query"),
+    "get_site_urls": ("""
+        SELECT url, lastmod, sitemap_url, first_seen_at, changed_at FROM site_urls
+        WHERE site_id = %(site_id)s AND url > %(url)s
+        ORDER BY url
+        LIMIT 100
+    """, "site_urls"),
+    "crawl frontier claim": ("""
+        SELECT url FROM crawl_frontier
+        WHERE crawl_id = %(site_id)s AND state = 0 AND depth IS NOT NULL
+        ORDER BY depth, seq
+        LIMIT 64
+    """, "crawl_frontier"),
+    "get_crawl_pages": ("""
+        SELECT url, depth, status_code, final_url, canonical, title, word_count
+        FROM crawl_pages
+        WHERE site_id = %(site_id)s AND url > %(url)s
+        ORDER BY url
+        LIMIT 100
+    """, "crawl_pages"),
+    "get_link_graph": ("""
+        SELECT u.url, m.pagerank, m.inlinks, m.outlinks, m.depth, m.impressions, m.orphan
+        FROM link_metrics m
+        JOIN crawl_urls u ON u.id = m.url_id
+        WHERE m.site_id = %(site_id)s
+        ORDER BY m.pagerank DESC
+        LIMIT 100
+    """, "link_metrics"),
+    "get_thin_pages": ("""
+        SELECT url, title, word_count, depth, canonical
+        FROM crawl_pages
+        WHERE site_id = %(site_id)s AND status_code = 200 AND word_count < 200
+        ORDER BY word_count, url
+        LIMIT 50
+    """, "crawl_pages"),
+    "get_cannibalization": ("""
+        SELECT query, urls, impressions, clicks, click_loss, primary_url, competitors, computed_at
+        FROM cannibalization
+        WHERE site_id = %(site_id)s
+        ORDER BY click_loss DESC
+        LIMIT 50
+    """, "cannibalization"),
+    "get_issues": ("""
+        SELECT id, issue_type, severity, description, suggested_action, status, created_at
+        FROM issues
+        WHERE site_id = %(site_id)s
+        ORDER BY CASE severity WHEN 'critical' THEN 1 WHEN 'high' THEN 2
+                               WHEN 'medium' THEN 3 ELSE 4 END, created_at DESC
+    """, "issues"),
+}
+
+
+def _scans(plan):
+    """Yield ``(node type, relation, index)`` for every scan node in a plan."""
+    if "Relation Name" in plan:
+        # A bitmap heap scan names its indexes on the child bitmap nodes
+        index = plan.get("Index Name") or ", ".join(
+            child["Index Name"] for child in plan.get("Plans", []) if "Index Name" in child)
+        yield plan["Node Type"], plan["Relation Name"], index
+    for child in plan.get("Plans", []):
+        yield from _scans(child)
+
+
+def check(cur, site_id=None, url=None):
+    """EXPLAIN each query shape and report how its table is scanned.
+
+    Sequential scans are disabled for the check so the answer reflects
+    whether an index *can* serve the shape, not the planner's choice on a
+    small development database."""
+    if site_id is None:
+        cur.execute("SELECT site_id, url FROM gsc_metrics LIMIT 1")
+        row = cur.fetchone() or (0, "")
+        site_id, url = row
+    cur.execute("SET LOCAL enable_seqscan = off")
+    results = {}
+    for name, (sql, table) in QUERY_SHAPES.items():
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, {"site_id": site_id, "url": url or ""})
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = [s for s in _scans(plan[0]["Plan"]) if s[1] == table]
+        results[name] = {
+            "ok": bool(scans) and all(node.startswith(("Index", "Bitmap")) for node, _, _ in scans),
+            "scans": [f"{node} using {index}" if index else node for node, _, index in scans]
+        }
+    return results
+
+
+async def _main(command, args):
+    db.init_pool(os.getenv("DATABASE_URL"))
+    try:
+        if command == "migrate":
+            done = await migrate()
+            print(f"{len(done)} migration(s) applied")
+        elif command == "status":
+            applied = await db.run(applied_versions)
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:>4}  {'applied' if version in applied else 'pending':<8} {name}")
+        elif command == "check":
+            results = await db.run(check)
+            for name, result in results.items():
+                print(f"{'ok  ' if result['ok'] else 'FAIL'}  {name}: {', '.join(result['scans'])}")
+            return 0 if all(r["ok"] for r in results.values()) else 1
+        elif command == "backfill-rollups":
+            count = await backfill_rollups(int(args[0]) if args else None)
+            print(f"{count} site(s) backfilled")
+        else:
+            print(__doc__)
+            return 2
+    finally:
+        db.close_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "", sys.argv[2:])))
@@ -0,0 +1,272 @@
+"""TTL cache for SERP lookups with request coalescing.
+
+Results are keyed by the normalized query and the requested result count.
+Concurrent lookups for the same key share one in-flight request instead of
+each paying for a Serper call. Failed lookups are never cached.
+
+Redis is used when available, so the API processes and the job workers
+share one cache, and a short-lived lock key makes a lookup in another
+process wait for the one already in flight instead of calling Serper
+again. Without Redis the cache is in-process. Either way entries expire
+after ``SERP_CACHE_TTL`` and the least recently used are dropped beyond
+``SERP_CACHE_SIZE``. A cache that cannot be reached counts as a miss.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import ttl_cache
+
+SERP_CACHE_TTL = int(os.getenv("SERP_CACHE_TTL", str(6 * 3600)))
+SERP_CACHE_SIZE = int(os.getenv("SERP_CACHE_SIZE", "2000"))
+SERP_PREWARM_CONCURRENCY = int(os.getenv("SERP_PREWARM_CONCURRENCY", "5"))
+# How long another process's lookup is waited for before fetching anyway
+SERP_LOCK_SECONDS = 15
+SERP_LOCK_POLL = 0.1
+
+STAT_FIELDS = ["hits", "misses", "coalesced"]
+
+
+class LocalBackend:
+    """In-process entries; coalescing across processes does not apply."""
+
+    name = "local"
+
+    def __init__(self):
+        self.cache = ttl_cache.TTLCache(SERP_CACHE_SIZE, SERP_CACHE_TTL)
+        self.counters = dict.fromkeys(STAT_FIELDS, 0)
+
+    async def get(self, key):
+        return self.cache.get(key)
+
+    async def set(self, key, value):
+        self.cache.set(key, value)
+
+    async def lock(self, key):
+        return True
+
+    async def unlock(self, key):
+        pass
+
+    async def locked(self, key):
+        return False
+
+    async def incr(self, field):
+        self.counters[field] += 1
+
+    async def stats(self):
+        return dict(self.counters, entries=len(self.cache))
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Entries as JSON strings with an expiry; a sorted set of last-use
+    times bounds their number and a hash holds process-wide counters."""
+
+    PREFIX = "seo-engine:serp:"
+    LOCK_PREFIX = "seo-engine:serp-lock:"
+    LRU_KEY = "seo-engine:serp-cache:lru"
+    STATS_KEY = "seo-engine:serp-cache:stats"
+
+    name = "redis"
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def get(self, key):
+        data = await self.redis.get(self.PREFIX + key)
+        if data is None:
+            return None
+        await self.redis.zadd(self.LRU_KEY, {key: time.time()})
+        return json.loads(data)
+
+    async def set(self, key, value):
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.set(self.PREFIX + key, json.dumps(value), ex=SERP_CACHE_TTL)
+        pipe.zadd(self.LRU_KEY, {key: now})
+        # Unused for a whole TTL means Redis has expired the entry already
+        pipe.zremrangebyscore(self.LRU_KEY, 0, now - SERP_CACHE_TTL)
+        pipe.zcard(self.LRU_KEY)
+        entries = (await pipe.execute())[-1]
+        if entries > SERP_CACHE_SIZE:
+            evicted = [k for k, _ in await self.redis.zpopmin(self.LRU_KEY, entries - SERP_CACHE_SIZE)]
+            await self.redis.delete(*[self.PREFIX + k for k in evicted])
+
+    async def lock(self, key):
+        return bool(await self.redis.set(self.LOCK_PREFIX + key, 1, nx=True, ex=SERP_LOCK_SECONDS))
+
+    async def unlock(self, key):
+        await self.redis.delete(self.LOCK_PREFIX + key)
+
+    async def locked(self, key):
+        return bool(await self.redis.exists(self.LOCK_PREFIX + key))
+
+    async def incr(self, field):
+        await self.redis.hincrby(self.STATS_KEY, field, 1)
+
+    async def stats(self):
+        counters = await self.redis.hgetall(self.STATS_KEY)
+        entries = await self.redis.zcount(self.LRU_KEY, time.time() - SERP_CACHE_TTL, "+inf")
+        return dict({field: int(counters.get(field, 0)) for field in STAT_FIELDS}, entries=entries)
+
+    async def close(self):
+        await self.redis.close()
+
+
+_backend = LocalBackend()
+_inflight = {}
+
+
+async def init(redis_url=None):
+    global _backend
+    if not redis_url or isinstance(_backend, RedisBackend):
+        return
+    try:
+        import redis.asyncio as redis
+        client = redis.from_url(redis_url, decode_responses=True)
+        await client.ping()
+        _backend = RedisBackend(client)
+        print("SERP cache: redis")
+    except Exception as e:
+        print(f"Redis unavailable ({e}), using in-process SERP cache")
+
+
+async def close():
+    global _backend
+    await _backend.close()
+    _backend = LocalBackend()
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+def _key(query, num_results):
+    return hashlib.sha1(f"{num_results}:{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+async def _cached(key):
+    try:
+        return await _backend.get(key)
+    except Exception as e:
+        print(f"SERP cache read failed: {e}")
+        return None
+
+
+async def _count(field):
+    try:
+        await _backend.incr(field)
+    except Exception as e:
+        print(f"SERP cache stats update failed: {e}")
+
+
+async def _wait_for_other(key):
+    """Wait for a lookup another process holds the lock for. Returns its
+    result, or ``None`` if it failed or is taking too long."""
+    deadline = time.monotonic() + SERP_LOCK_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(SERP_LOCK_POLL)
+        result = await _cached(key)
+        if result is not None:
+            return result
+        try:
+            if not await _backend.locked(key):
+                return await _cached(key)
+        except Exception as e:
+            print(f"SERP cache lock check failed: {e}")
+            return None
+    return None
+
+
+async def _fetch_shared(key, fetch):
+    try:
+        locked = await _backend.lock(key)
+    except Exception as e:
+        print(f"SERP cache lock failed: {e}")
+        locked = True
+    if not locked:
+        result = await _wait_for_other(key)
+        if result is not None:
+            await _count("coalesced")
+            return result
+    await _count("misses")
+    try:
+        result = await fetch()
+        try:
+            await _backend.set(key, result)
+        except Exception as e:
+            print(f"SERP cache write failed: {e}")
+        return result
+    finally:
+        if locked:
+            try:
+                await _backend.unlock(key)
+            except Exception as e:
+                print(f"SERP cache unlock failed: {e}")
+
+
+async def get_or_fetch(query, num_results, fetch):
+    """Return the cached result for ``(query, num_results)`` or run
+    ``await fetch()`` once, sharing it with concurrent callers."""
+    key = _key(query, num_results)
+    result = await _cached(key)
+    if result is not None:
+        await _count("hits")
+        return result
+
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        await _count("coalesced")
+        return await asyncio.shield(inflight)
+
+    task = asyncio.ensure_future(_fetch_shared(key, fetch))
+    _inflight[key] = task
+    try:
+        return await asyncio.shield(task)
+    finally:
+        _inflight.pop(key, None)
+
+
+async def prewarm(queries, num_results, fetch_for):
+    """Warm the cache for a batch of queries. ``fetch_for(query)`` returns the
+    fetch coroutine for one query. Failed lookups are counted, not raised."""
+    slots = asyncio.Semaphore(SERP_PREWARM_CONCURRENCY)
+    unique = list(dict.fromkeys(normalize_query(q) for q in queries if isinstance(q, str) and q.strip()))
+
+    async def warm(query):
+        async with slots:
+            key = _key(query, num_results)
+            if await _cached(key) is not None:
+                return "cached"
+            try:
+                await get_or_fetch(query, num_results, lambda: fetch_for(query))
+                return "warmed"
+            except Exception as e:
+                print(f"SERP prewarm failed for {query!r}: {e}")
+                return "failed"
+
+    results = await asyncio.gather(*[warm(q) for q in unique])
+    return {
+        "queries": len(unique),
+        "already_cached": results.count("cached"),
+        "warmed": results.count("warmed"),
+        "failed": results.count("failed")
+    }
+
+
+async def stats():
+    try:
+        counters = await _backend.stats()
+    except Exception as e:
+        return {"backend": _backend.name, "error": str(e)}
+    lookups = sum(counters[field] for field in STAT_FIELDS)
+    return dict(
+        counters,
+        backend=_backend.name,
+        hit_ratio=round((counters["hits"] + counters["coalesced"]) / lookups, 4) if lookups else 0.0
+    )
@@ -0,0 +1,262 @@
+"""Sitemap ingestion into the per-site URL inventory (``site_urls``).
+
+Sitemaps are streamed: each response is decompressed (for ``.xml.gz``
+files) and fed to an incremental XML parser chunk by chunk, and completed
+``<url>`` entries are upserted in batches, so a 50k-URL file or an index of
+hundreds of child sitemaps is processed in constant memory. Sitemap indexes
+are followed with ``SITEMAP_CONCURRENCY`` files in flight.
+
+Each child sitemap's ``<lastmod>`` from its index is remembered in
+``site_sitemaps``; on the next run a child whose lastmod has not changed is
+skipped. Every URL keeps its own lastmod and a ``changed_at`` that only
+moves when the lastmod does, which tells the crawler and analyses what is
+new.
+"""
+import asyncio
+import os
+import xml.etree.ElementTree as ET
+import zlib
+from datetime import datetime, timezone
+
+import db
+import ingest
+
+SITEMAP_CONCURRENCY = int(os.getenv("SITEMAP_CONCURRENCY", "4"))
+# Per file, after decompression; the protocol caps sitemaps at 50MB
+SITEMAP_MAX_BYTES = int(os.getenv("SITEMAP_MAX_BYTES", str(64 * 1024 * 1024)))
+SITEMAP_MAX_FILES = int(os.getenv("SITEMAP_MAX_FILES", "5000"))
+SITEMAP_BATCH_ROWS = int(os.getenv("SITEMAP_BATCH_ROWS", "5000"))
+SITEMAP_MAX_DEPTH = 3
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS site_urls_staging (
+        url TEXT, lastmod TIMESTAMPTZ, sitemap_url TEXT
+    ) ON COMMIT DROP
+"""
+
+
+class SitemapError(Exception):
+    pass
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_lastmod(text):
+    """W3C datetime (or plain date) to an aware datetime; ``None`` if invalid."""
+    if not text:
+        return None
+    try:
+        value = datetime.fromisoformat(text.strip())
+    except ValueError:
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class SitemapParser:
+    """Incremental parser for ``<urlset>`` and ``<sitemapindex>`` documents.
+
+    ``feed(chunk)`` returns the ``(loc, lastmod)`` entries completed by that
+    chunk; finished elements are dropped from the tree as they are read."""
+
+    def __init__(self, max_bytes=None):
+        self.kind = None
+        self.bytes = 0
+        self._max_bytes = max_bytes or SITEMAP_MAX_BYTES
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root = None
+        self._inflate = None
+        self._head = b""
+
+    def feed(self, chunk):
+        if self._inflate is None:
+            # Gzipped files are often served without Content-Encoding, so sniff
+            self._head += chunk
+            if len(self._head) < len(GZIP_MAGIC):
+                return []
+            chunk, self._head = self._head, b""
+            self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk.startswith(GZIP_MAGIC) else False
+        if self._inflate:
+            # Bounded output, so a gzip bomb stops at the size cap
+            chunk = self._inflate.decompress(chunk, self._max_bytes - self.bytes + 1)
+        self.bytes += len(chunk)
+        if self.bytes > self._max_bytes:
+            raise SitemapError(f"sitemap larger than {self._max_bytes} bytes")
+        self._parser.feed(chunk)
+        return self._entries()
+
+    def close(self):
+        if self._head:
+            self._inflate = False
+            self._parser.feed(self._head)
+        self._parser.close()
+        return self._entries()
+
+    def _entries(self):
+        entries = []
+        for event, elem in self._parser.read_events():
+            tag = _local(elem.tag)
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                    self.kind = tag
+                continue
+            if tag not in ("url", "sitemap") or elem is self._root:
+                continue
+            loc = lastmod = None
+            for child in elem:
+                name = _local(child.tag)
+                if name == "loc":
+                    loc = (child.text or "").strip()
+                elif name == "lastmod":
+                    lastmod = parse_lastmod(child.text)
+            if loc:
+                entries.append((loc, lastmod))
+            # Drop every finished entry still hanging off the root
+            self._root.clear()
+        return entries
+
+
+async def fetch_entries(client, url):
+    """Yield ``(kind, entries)`` for each chunk of the sitemap at ``url``."""
+    parser = SitemapParser()
+    async with client.stream("GET", url, follow_redirects=True) as response:
+        if response.status_code != 200:
+            raise SitemapError(f"HTTP {response.status_code}")
+        async for chunk in response.aiter_bytes():
+            entries = await asyncio.to_thread(parser.feed, chunk)
+            if entries:
+                yield parser.kind, entries
+    entries = await asyncio.to_thread(parser.close)
+    if parser.kind not in ("urlset", "sitemapindex"):
+        raise SitemapError(f"not a sitemap (root element {parser.kind!r})")
+    if entries:
+        yield parser.kind, entries
+
+
+def stored_lastmods(cur, site_id):
+    cur.execute("SELECT url, lastmod FROM site_sitemaps WHERE site_id = %s", (site_id,))
+    return dict(cur.fetchall())
+
+
+def record_sitemap(cur, site_id, url, lastmod, url_count):
+    cur.execute("""
+        INSERT INTO site_sitemaps (site_id, url, lastmod, url_count, fetched_at)
+        VALUES (%s, %s, %s, %s, NOW())
+        ON CONFLICT (site_id, url) DO UPDATE SET
+            lastmod = EXCLUDED.lastmod, url_count = EXCLUDED.url_count, fetched_at = NOW()
+    """, (site_id, url, lastmod, url_count))
+
+
+def upsert_urls(cur, site_id, entries, sitemap_url):
+    """Merge ``(url, lastmod)`` entries into ``site_urls``.
+
+    Returns ``(new, changed)`` counts; ``changed_at`` only moves for URLs
+    whose lastmod differs from the stored one."""
+    cur.execute(STAGING_SQL)
+    ingest.copy_records(cur, "site_urls_staging", ["url", "lastmod", "sitemap_url"],
+                        ((url, lastmod, sitemap_url) for url, lastmod in entries))
+    # first_seen_at / changed_at equal NOW() exactly when this statement set them
+    cur.execute("""
+        WITH merged AS (
+            INSERT INTO site_urls AS u (site_id, url, lastmod, sitemap_url)
+            SELECT DISTINCT ON (url) %s, url, lastmod, sitemap_url FROM site_urls_staging
+            ON CONFLICT (site_id, url) DO UPDATE SET
+                lastmod = EXCLUDED.lastmod,
+                sitemap_url = EXCLUDED.sitemap_url,
+                last_seen_at = NOW(),
+                changed_at = CASE WHEN u.lastmod IS DISTINCT FROM EXCLUDED.lastmod
+                                  THEN NOW() ELSE u.changed_at END
+            RETURNING first_seen_at = NOW() AS new, changed_at = NOW() AS changed
+        )
+        SELECT COUNT(*) FILTER (WHERE new), COUNT(*) FILTER (WHERE changed AND NOT new) FROM merged
+    """, (site_id,))
+    new, changed = cur.fetchone()
+    cur.execute("TRUNCATE site_urls_staging")
+    return new, changed
+
+
+class _Run:
+    def __init__(self):
+        self.sitemaps = 0
+        self.skipped = 0
+        self.urls = 0
+        self.new = 0
+        self.changed = 0
+        self.errors = []
+
+    def as_dict(self):
+        return {
+            "sitemaps_fetched": self.sitemaps,
+            "sitemaps_unchanged": self.skipped,
+            "urls_seen": self.urls,
+            "urls_new": self.new,
+            "urls_changed": self.changed,
+            "errors": self.errors[:20]
+        }
+
+
+async def ingest_site(site_id, root_url, client, progress=None):
+    """Fetch ``root_url`` and every sitemap it leads to into ``site_urls``."""
+    stored = await db.run(stored_lastmods, site_id)
+    run = _Run()
+    queue = asyncio.Queue()
+    seen = {root_url}
+    queue.put_nowait((root_url, None, 0))
+
+    async def load(url, lastmod, depth):
+        batch = []
+        count = 0
+
+        async def flush():
+            nonlocal batch
+            new, changed = await db.run(upsert_urls, site_id, batch, url)
+            run.new += new
+            run.changed += changed
+            run.urls += len(batch)
+            batch = []
+            if progress:
+                await progress(**run.as_dict())
+
+        async for kind, entries in fetch_entries(client, url):
+            if kind == "sitemapindex":
+                for child, child_lastmod in entries:
+                    if child in seen or depth + 1 > SITEMAP_MAX_DEPTH or len(seen) >= SITEMAP_MAX_FILES:
+                        continue
+                    seen.add(child)
+                    if child_lastmod and stored.get(child) == child_lastmod:
+                        run.skipped += 1
+                        continue
+                    queue.put_nowait((child, child_lastmod, depth + 1))
+                continue
+            batch.extend(entries)
+            count += len(entries)
+            if len(batch) >= SITEMAP_BATCH_ROWS:
+                await flush()
+        if batch:
+            await flush()
+        # Recorded last, so a file that failed halfway is fetched again next time
+        await db.run(record_sitemap, site_id, url, lastmod, count)
+        run.sitemaps += 1
+
+    async def worker():
+        while True:
+            url, lastmod, depth = await queue.get()
+            try:
+                await load(url, lastmod, depth)
+            except Exception as e:
+                run.errors.append({"sitemap": url, "error": str(e) or type(e).__name__})
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, SITEMAP_CONCURRENCY))]
+    try:
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return run.as_dict()
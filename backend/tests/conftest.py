@@ -0,0 +1,24 @@
+"""Shared fixtures. Tests that need Postgres run against ``TEST_DATABASE_URL``
+(migrated on first use) and are skipped when it is not set."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import schema  # noqa: E402
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture(scope="session")
+def database():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    db.init_pool(TEST_DATABASE_URL)
+    asyncio.run(schema.migrate())
+    yield
+    db.close_pool()
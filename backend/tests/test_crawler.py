@@ -0,0 +1,266 @@
+"""The crawler against a small site served from a local HTTP server.
+
+The site is a binary tree: ``/`` links to ``/p/1`` and ``/p/i`` links to
+``/p/2i`` and ``/p/2i+1``, so ``/p/i`` sits at link depth ``floor(log2 i) + 1``.
+Every page also links back to ``/`` and ``/p/1``, as navigation would.
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import crawler
+import db
+import linkgraph
+
+SITE_ID = 990_022
+TREE_PAGES = 31
+ROBOTS = "User-agent: *\nDisallow: /private/\n"
+
+
+def _html(title, links):
+    anchors = "".join(f'<a href="{href}">{href}</a> ' for href in links)
+    return f"<html><head><title>{title}</title></head><body><h1>{title}</h1><p>{anchors}</p></body></html>"
+
+
+def tree_routes(extra_home_links=()):
+    nav = ["/", "/p/1"]
+    routes = {"/": (200, {}, _html("Home", ["/p/1", *extra_home_links]))}
+    for i in range(1, TREE_PAGES + 1):
+        children = [f"/p/{c}" for c in (2 * i, 2 * i + 1) if c <= TREE_PAGES]
+        routes[f"/p/{i}"] = (200, {}, _html(f"Page {i}", nav + children))
+    return routes
+
+
+class _QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Requests cut off by an interrupted crawl
+        pass
+
+
+class FixtureSite:
+    """Serves ``routes`` (path -> status, headers, body) and logs every request."""
+
+    def __init__(self):
+        self.routes = {}
+        self.robots = ROBOTS
+        self.page_delay = 0.0
+        self.requests = []
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append((time.monotonic(), self.path))
+                if self.path == "/robots.txt":
+                    status, headers, body = 200, {"Content-Type": "text/plain"}, site.robots
+                else:
+                    status, headers, body = site.routes.get(self.path, (404, {}, "not found"))
+                    time.sleep(site.page_delay)
+                payload = body.encode()
+                self.send_response(status)
+                headers = {"Content-Type": "text/html; charset=utf-8", **headers}
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _QuietServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.origin = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def fetched(self):
+        """Page paths requested, in order, without robots.txt."""
+        return [path for _, path in self.requests if path != "/robots.txt"]
+
+
+@pytest.fixture(scope="module")
+def server():
+    site = FixtureSite()
+    yield site
+    site.server.shutdown()
+
+
+def _clear(cur, site_id):
+    crawler.delete_site(cur, site_id)
+    linkgraph.delete_site(cur, site_id)
+
+
+@pytest.fixture
+def site(database, server):
+    server.routes = tree_routes()
+    server.robots = ROBOTS
+    server.page_delay = 0.0
+    server.requests = []
+    asyncio.run(db.run(_clear, SITE_ID))
+    yield server
+    asyncio.run(db.run(_clear, SITE_ID))
+
+
+def crawl(site, **kwargs):
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await crawler.crawl_site(SITE_ID, f"{site.origin}/", client, **kwargs)
+    return asyncio.run(go())
+
+
+def stored_pages(site):
+    rows = asyncio.run(db.fetchall("""
+        SELECT url, depth, status_code, final_url, redirects, title, error
+        FROM crawl_pages WHERE site_id = %s
+    """, (SITE_ID,)))
+    return {row[0][len(site.origin):]: row[1:] for row in rows}
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = crawler.BloomFilter(1000, 0.01)
+    urls = [f"https://example.com/p/{i}" for i in range(1000)]
+    assert all(bloom.add(url) for url in urls[:10])
+    assert not any(bloom.add(url) for url in urls[:10])
+    for url in urls[10:]:
+        bloom.add(url)
+    assert all(url in bloom for url in urls)
+    false_positives = sum(f"https://example.com/q/{i}" in bloom for i in range(10_000))
+    assert false_positives < 300
+
+
+def test_full_crawl_fetches_each_page_once(site):
+    result = crawl(site)
+
+    assert result["pages_crawled"] == TREE_PAGES + 1
+    assert not result["reached_max_pages"]
+    # Navigation links on every page are dropped by the Bloom filter, not refetched
+    fetched = site.fetched()
+    assert sorted(fetched) == sorted(site.routes)
+    assert result["urls_seen"] == TREE_PAGES + 1
+    crawl_row = asyncio.run(db.fetchone("SELECT status, discovered FROM crawls WHERE site_id = %s", (SITE_ID,)))
+    assert crawl_row == ("finished", TREE_PAGES + 1)
+
+    pages = stored_pages(site)
+    assert pages["/"][0] == 0
+    assert pages["/p/1"][0] == 1
+    assert pages["/p/31"][0] == 5
+    assert pages["/p/7"][4] == "Page 7"
+
+
+def test_robots_disallow_is_honoured(site):
+    site.routes = tree_routes(extra_home_links=["/private/report", "/private/"])
+    crawl(site)
+
+    assert not [path for path in site.fetched() if path.startswith("/private/")]
+    pages = stored_pages(site)
+    assert pages["/private/report"][5] == "blocked by robots.txt"
+    assert pages["/private/report"][1] is None
+
+
+def test_crawl_delay_is_honoured(site):
+    site.robots = ROBOTS + "Crawl-delay: 0.4\n"
+    crawl(site, max_pages=4)
+
+    # Fractional delays round up to whole seconds
+    times = [at for at, path in site.requests if path != "/robots.txt"]
+    assert len(times) == 4
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert min(gaps) >= 0.95
+
+
+def test_redirects_are_followed_and_recorded(site):
+    site.routes = tree_routes(extra_home_links=["/old"])
+    site.routes["/old"] = (302, {"Location": "/moved"}, "")
+    site.routes["/moved"] = (301, {"Location": f"{site.origin}/landing"}, "")
+    site.routes["/landing"] = (200, {}, _html("Landing", ["/p/2"]))
+    crawl(site)
+
+    pages = stored_pages(site)
+    depth, status, final_url, redirects, _, error = pages["/old"]
+    assert (depth, status, final_url, error) == (1, 302, f"{site.origin}/landing", None)
+    assert [(hop["url"][len(site.origin):], hop["status"]) for hop in redirects] == [
+        ("/old", 302), ("/moved", 301), ("/landing", 200)]
+    # The landing page is stored under its own URL and fetched only on the way
+    assert pages["/landing"][1] == 200
+    assert pages["/landing"][4] == "Landing"
+    assert "/moved" not in pages
+    assert site.fetched().count("/landing") == 1
+
+
+def test_redirect_loops_stop(site):
+    site.routes = tree_routes(extra_home_links=["/a"])
+    site.routes["/a"] = (301, {"Location": "/b"}, "")
+    site.routes["/b"] = (301, {"Location": "/a"}, "")
+    crawl(site)
+
+    _, status, _, redirects, _, error = stored_pages(site)["/a"]
+    assert (status, error) == (301, "too many redirects")
+    assert len(redirects) == 2
+
+
+def test_max_pages_limit(site):
+    result = crawl(site, max_pages=10)
+
+    assert result["pages_crawled"] == 10
+    assert result["reached_max_pages"]
+    assert len(site.fetched()) == 10
+    assert len(stored_pages(site)) == 10
+
+
+def test_max_depth_limit(site):
+    result = crawl(site, max_depth=2)
+
+    assert sorted(site.fetched()) == ["/", "/p/1", "/p/2", "/p/3"]
+    assert result["pages_crawled"] == 4
+    assert max(page[0] for page in stored_pages(site).values()) == 2
+
+
+def test_interrupted_crawl_resumes_from_frontier(site, monkeypatch):
+    monkeypatch.setattr(crawler, "CRAWL_CONCURRENCY", 2)
+    monkeypatch.setattr(crawler, "CRAWL_BATCH_ROWS", 2)
+    site.page_delay = 0.05
+
+    async def interrupted():
+        async with httpx.AsyncClient() as client:
+            task = asyncio.create_task(crawler.crawl_site(SITE_ID, f"{site.origin}/", client))
+            for _ in range(200):
+                await asyncio.sleep(0.05)
+                row = await db.fetchone("SELECT pages FROM crawls WHERE site_id = %s", (SITE_ID,))
+                if row and row[0] >= 8:
+                    break
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+    asyncio.run(interrupted())
+
+    # A batch write already in flight when the crawl stopped still commits
+    stopped_at = None
+    while True:
+        time.sleep(0.1)
+        row = asyncio.run(db.fetchone("SELECT id, pages FROM crawls WHERE site_id = %s", (SITE_ID,)))
+        if row == stopped_at:
+            break
+        stopped_at = row
+    assert 8 <= stopped_at[1] < TREE_PAGES + 1
+    queued = asyncio.run(db.fetchone("SELECT COUNT(*) FROM crawl_frontier WHERE crawl_id = %s AND state <> %s",
+                                     (stopped_at[0], crawler.DONE)))
+    assert queued[0] > 0
+
+    # Its heartbeat is fresh, so the crawl still counts as running
+    with pytest.raises(crawler.CrawlError):
+        crawl(site)
+    monkeypatch.setattr(crawler, "CRAWL_STALE_SECONDS", 0)
+    time.sleep(0.01)
+    result = crawl(site)
+
+    assert result["resumed"]
+    assert result["crawl_id"] == stopped_at[0]
+    assert result["pages_crawled"] == TREE_PAGES + 1
+    assert result["pages_this_run"] == TREE_PAGES + 1 - stopped_at[1]
+    assert set(stored_pages(site)) == set(site.routes)
+    # Only URLs claimed but not yet written when it stopped are fetched again
+    fetched = site.fetched()
+    assert len(fetched) - len(set(fetched)) <= crawler.CRAWL_CONCURRENCY * 4
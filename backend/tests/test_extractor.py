@@ -0,0 +1,15 @@
+"""The single-pass extractor against the BeautifulSoup analysis it replaced."""
+import pytest
+
+import extractor
+from bench_extractor import load_fixtures, reference_analyze_html
+
+FIXTURES = load_fixtures()
+URL = "https://example.com/page"
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_matches_beautifulsoup_analysis(name):
+    html = FIXTURES[name]
+    assert extractor.analyze_html(URL, html) == reference_analyze_html(URL, html)
+
@@ -0,0 +1,36 @@
+"""In-process LRU cache whose entries expire a fixed time after insert.
+
+Shared by the local SERP cache and the GSC pagination totals in ``main``.
+Not thread-safe: use it from the event loop only.
+"""
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """LRU-ordered mapping whose entries expire ``ttl`` seconds after insert."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,28 @@
+"""Job worker process: python worker.py
+
+Runs queued imports and analyses from Redis with JOB_CONCURRENCY slots, so
+the API processes only enqueue work and serve reads.
+"""
+import asyncio
+
+import jobs
+import main
+
+
+async def run():
+    if not main.REDIS_URL:
+        raise SystemExit("REDIS_URL is required; without it jobs run inside the API process")
+    try:
+        # An in-process queue here would never see the API's jobs
+        await main.startup(require_redis=True)
+    except RuntimeError as e:
+        await main.shutdown()
+        raise SystemExit(f"Worker cannot start: {e}")
+    try:
+        await jobs.work_forever()
+    finally:
+        await main.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -42,6 +42,26 @@ function App() {
       .catch(err => setLoading(false));
   }, []);
 
+  // Long-running endpoints return a job id; poll until the job finishes
+  const waitForJob = (data) => {
+    if (!data.job_id) return Promise.resolve(data);
+    return new Promise((resolve, reject) => {
+      const poll = () => {
+        fetch(`${API_URL}/api/jobs/${data.job_id}`)
+          .then(res => res.json())
+          .then(job => {
+            if (job.status === 'succeeded' || job.status === 'failed') {
+              resolve(job.result || { error: job.error });
+            } else {
+              setTimeout(poll, 2000);
+            }
+          })
+          .catch(reject);
+      };
+      poll();
+    });
+  };
+
   const loadSites = () => {
     fetch(`${API_URL}/api/sites`)
       .then(res => res.json())
@@ -87,6 +107,7 @@ function App() {
       body: JSON.stringify({ site_id: siteId, days: dateRange })
     })
       .then(res => res.json())
+      .then(waitForJob)
       .then(data => {
         setFetchingStates(prev => ({ ...prev, [siteId]: false }));
         if (data.success) {
@@ -112,6 +133,7 @@ function App() {
       body: JSON.stringify({ site_id: siteId, property_id: ga4PropertyId, days: dateRange })
     })
       .then(res => res.json())
+      .then(waitForJob)
       .then(data => {
         setFetchingStates(prev => ({ ...prev, [`ga4_${siteId}`]: false }));
         if (data.success) {
@@ -157,6 +179,7 @@ function App() {
       body: JSON.stringify({ site_id: siteId, page_url: pageUrl })
     })
       .then(res => res.json())
+      .then(waitForJob)
       .then(data => {
         setAnalyzingPages(prev => ({ ...prev, [pageUrl]: false }));
         if (data.success) {